@@ -90,5 +90,9 @@ setup(
             "matplotlib>=3.5.0",
             "plotly>=5.0.0",
         ],
+        "perf": [
+            "orjson>=3.6.0",
+            "numba>=0.56.0",
+        ],
     },
 )
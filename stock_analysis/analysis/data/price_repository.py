@@ -64,22 +64,24 @@ class DatabasePriceDataRepository(PriceDataRepository):
         key = (symbol, start, end)
         if key in self._cache:
             return self._cache[key]
-        stock = self._db.get_stock_data(symbol, start, end)
-        if not stock or stock.data_points == 0:
+        # 直接读取为 DataFrame，省去 PriceData 列表与统计量的中间构造
+        df = self._db.get_price_df(symbol, start, end)
+        if df is None or df.empty:
             df = pd.DataFrame()
             self._cache[key] = df
             return df
-        df = pd.DataFrame(
-            {
-                'Date': pd.to_datetime(stock.price_data.dates),
-                'Open': stock.price_data.open,
-                'High': stock.price_data.high,
-                'Low': stock.price_data.low,
-                'Close': stock.price_data.close,
-                'Adj Close': stock.price_data.adj_close or stock.price_data.close,
-                'Volume': stock.price_data.volume,
+        df = df.rename(
+            columns={
+                'date': 'Date',
+                'open': 'Open',
+                'high': 'High',
+                'low': 'Low',
+                'close': 'Close',
+                'adj_close': 'Adj Close',
+                'volume': 'Volume',
             }
         )
+        df['Date'] = pd.to_datetime(df['Date'])
         df = df.set_index('Date').sort_index()
         df = df[['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']]
         self._cache[key] = df
@@ -167,27 +167,15 @@ def cmd_query(args: argparse.Namespace) -> int:
 
     dbp = str(Path(args.db_path))
     storage = create_storage('sqlite', db_path=dbp)
-    data = storage.get_stock_data(
+    df = storage.get_price_df(
         args.symbol.upper(), start_date=args.start_date, end_date=args.end_date
     )
 
-    if data is None or data.data_points == 0:
+    if df is None or df.empty:
         logger.info("无数据")
         storage.close()
         return 0
 
-    # 转为 DataFrame 以便展示
-    pd_data = {
-        'date': data.price_data.dates,
-        'open': data.price_data.open,
-        'high': data.price_data.high,
-        'low': data.price_data.low,
-        'close': data.price_data.close,
-        'volume': data.price_data.volume,
-        'adj_close': data.price_data.adj_close,
-    }
-    df = pd.DataFrame(pd_data)
-
     # 统计与范围
     first = min(df['date']) if not df.empty else None
     last = max(df['date']) if not df.empty else None
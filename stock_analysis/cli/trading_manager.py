@@ -33,7 +33,7 @@
 import argparse
 import logging
 from datetime import date
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from stock_analysis.data.storage import create_storage, StorageError
 from stock_analysis.utils.logging_utils import setup_logging
@@ -275,33 +275,34 @@ def cmd_dividend(args: argparse.Namespace) -> int:
             config = DEFAULT_TRADING_CONFIG
             svc = TransactionService(storage, config)
 
-            transaction = svc.record_buy_transaction(
-                symbol=args.symbol.upper(),
-                quantity=args.shares,
-                price=args.reinvest_price,
-                transaction_date=args.date,
-                external_id=f"DRIP_{args.symbol}_{args.date}",
-                notes=f"Dividend Reinvestment - {getattr(args, 'notes', '')}"
-            )
-
-            # 记录分红信息
-            storage.connection.execute("""
-                INSERT INTO dividends (
-                    symbol, dividend_date, dividend_type,
-                    reinvest_shares, reinvest_price, reinvest_transaction_id,
-                    platform, notes
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                args.symbol.upper(),
-                args.date,
-                'STOCK',
-                args.shares,
-                args.reinvest_price,
-                transaction.id,
-                getattr(args, 'platform', None),
-                getattr(args, 'notes', None)
-            ))
-            storage.connection.commit()
+            # 买入交易与分红记录同一事务提交，避免只写入其中一半
+            with storage.transaction():
+                transaction = svc.record_buy_transaction(
+                    symbol=args.symbol.upper(),
+                    quantity=args.shares,
+                    price=args.reinvest_price,
+                    transaction_date=args.date,
+                    external_id=f"DRIP_{args.symbol}_{args.date}",
+                    notes=f"Dividend Reinvestment - {getattr(args, 'notes', '')}"
+                )
+
+                # 记录分红信息
+                storage.connection.execute("""
+                    INSERT INTO dividends (
+                        symbol, dividend_date, dividend_type,
+                        reinvest_shares, reinvest_price, reinvest_transaction_id,
+                        platform, notes
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    args.symbol.upper(),
+                    args.date,
+                    'STOCK',
+                    args.shares,
+                    args.reinvest_price,
+                    transaction.id,
+                    getattr(args, 'platform', None),
+                    getattr(args, 'notes', None)
+                ))
 
             print(f"✅ 股票分红记录成功 (DRIP)")
             print(f"📊 {args.symbol} - 再投资股数: {args.shares:.4f} 股")
@@ -424,11 +425,18 @@ def cmd_calculate_pnl(args: argparse.Namespace) -> int:
             calc.calculate_daily_pnl(sym.upper(), args.date)
     else:
         # 对所有持仓计算
-        calc.calculate_all_positions_pnl(args.date)
+        _, errors = calc.calculate_all_positions_pnl(args.date)
+        _print_pnl_errors(errors)
     storage.close()
     return 0
 
 
+def _print_pnl_errors(errors: List[Tuple[str, str]]) -> None:
+    """输出逐只股票的盈亏计算失败信息"""
+    for symbol, message in errors:
+        print(f"❌ 计算持仓盈亏失败: {symbol} - {message}")
+
+
 def cmd_batch_calculate(args: argparse.Namespace) -> int:
     setup_logging('INFO' if args.verbose else 'WARNING')
     storage = _storage_from_args(args)
@@ -461,7 +469,8 @@ def cmd_daily(args: argparse.Namespace) -> int:
         price_field=_price_source_from_args(args.price_source),
         only_trading_days=args.only_trading_days,
     )
-    calc.calculate_all_positions_pnl(today)
+    _, errors = calc.calculate_all_positions_pnl(today)
+    _print_pnl_errors(errors)
     storage.close()
     return 0
 
@@ -8,7 +8,9 @@ import re
 from abc import ABC, abstractmethod
 from dataclasses import asdict, dataclass
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
 
 
 class BaseDataModel(ABC):
@@ -144,9 +146,11 @@ def validate_date_string(date_string: str) -> bool:
         return False
 
 
-def calculate_summary_stats(prices: List[float], volumes: List[int]) -> SummaryStats:
+def calculate_summary_stats(
+    prices: Union[List[float], np.ndarray], volumes: Union[List[int], np.ndarray]
+) -> SummaryStats:
     """
-    计算价格和交易量的统计数据
+    计算价格和交易量的统计数据（列表或 NumPy 数组均可，整列向量化计算）
 
     Args:
         prices: 价格列表
@@ -155,21 +159,18 @@ def calculate_summary_stats(prices: List[float], volumes: List[int]) -> SummaryS
     Returns:
         统计数据对象
     """
-    if not prices:
+    if len(prices) == 0:
         return SummaryStats(0.0, 0.0, 0.0, 0.0, 0)
 
-    mean_price = sum(prices) / len(prices)
+    price_array = np.asarray(prices, dtype=float)
+    mean_price = float(price_array.mean())
 
-    # 计算标准差
-    if len(prices) > 1:
-        variance = sum((p - mean_price) ** 2 for p in prices) / (len(prices) - 1)
-        std_price = variance**0.5
-    else:
-        std_price = 0.0
+    # 计算样本标准差
+    std_price = float(price_array.std(ddof=1)) if len(price_array) > 1 else 0.0
 
-    min_price = min(prices)
-    max_price = max(prices)
-    total_volume = sum(volumes) if volumes else 0
+    min_price = float(price_array.min())
+    max_price = float(price_array.max())
+    total_volume = np.asarray(volumes).sum().item() if len(volumes) else 0
 
     return SummaryStats(
         mean_price=mean_price,
@@ -6,6 +6,7 @@
 
 from dataclasses import asdict, dataclass
 from datetime import datetime
+from itertools import chain
 from typing import Any, Dict, List, Optional
 
 from .base_models import BasicInfo
@@ -250,10 +251,11 @@ def merge_financial_statements(
         合并后的报表
     """
     # 合并报告期（去重并保持顺序）
-    periods = new_stmt.periods.copy()
-    for period in old_stmt.periods:
-        if period not in periods:
-            periods.append(period)
+    periods = list(dict.fromkeys(chain(new_stmt.periods, old_stmt.periods)))
+
+    # 报告期 -> 位置索引，一次构建，避免在 项目 × 报告期 循环中反复 list.index()
+    new_index = {period: idx for idx, period in reversed(list(enumerate(new_stmt.periods)))}
+    old_index = {period: idx for idx, period in reversed(list(enumerate(old_stmt.periods)))}
 
     # 合并财务项目
     items = {}
@@ -269,15 +271,14 @@ def merge_financial_statements(
             value = None
 
             # 优先使用新数据
-            if period in new_stmt.periods:
-                idx = new_stmt.periods.index(period)
-                if idx < len(new_values):
-                    value = new_values[idx]
+            idx = new_index.get(period)
+            if idx is not None and idx < len(new_values):
+                value = new_values[idx]
 
             # 如果新数据没有，使用旧数据
-            if value is None and period in old_stmt.periods:
-                idx = old_stmt.periods.index(period)
-                if idx < len(old_values):
+            if value is None:
+                idx = old_index.get(period)
+                if idx is not None and idx < len(old_values):
                     value = old_values[idx]
 
             merged_values.append(value)
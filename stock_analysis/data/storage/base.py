@@ -7,6 +7,8 @@
 from abc import ABC, abstractmethod
 from typing import Dict, List, Optional, Union
 
+import pandas as pd
+
 from ..models import DataQuality, FinancialData, StockData
 
 
@@ -39,6 +41,31 @@ class BaseStorage(ABC):
     ) -> Optional[StockData]:
         """获取股票数据"""
 
+    def get_price_df(
+        self, symbol: str, start_date: Optional[str] = None, end_date: Optional[str] = None
+    ) -> Optional[pd.DataFrame]:
+        """
+        以 DataFrame 获取逐日价格（按日期升序）
+
+        默认由 get_stock_data 的 PriceData 转换；后端可覆盖为直接查询，省去中间对象构造
+
+        Returns:
+            列为 date、open、high、low、close、volume、adj_close 的 DataFrame；无数据时返回 None
+        """
+        stock_data = self.get_stock_data(symbol, start_date, end_date)
+        if stock_data is None or not stock_data.price_data.dates:
+            return None
+        price_data = stock_data.price_data
+        return pd.DataFrame({
+            'date': price_data.dates,
+            'open': price_data.open,
+            'high': price_data.high,
+            'low': price_data.low,
+            'close': price_data.close,
+            'volume': price_data.volume,
+            'adj_close': price_data.adj_close,
+        })
+
     @abstractmethod
     def get_financial_data(self, symbol: str) -> Optional[FinancialData]:
         """获取财务数据"""
@@ -10,6 +10,9 @@ from typing import Dict, List
 class StorageConfig:
     """存储层配置类 - 统一管理表名、字段名和SQL模板"""
     
+    # 数据库架构版本（记录在 PRAGMA user_version）；修改表或索引定义时需递增
+    SCHEMA_VERSION = 4
+    
     # ============= 表名定义 =============
     class Tables:
         STOCKS = "stocks"
@@ -18,6 +21,10 @@ class StorageConfig:
         BALANCE_SHEET = "balance_sheet"
         CASH_FLOW = "cash_flow"
         DOWNLOAD_LOGS = "download_logs"
+        # 关键财务指标宽表（每个 symbol+period 一行，由报表写入时同步投影）
+        FINANCIAL_KEY_METRICS = "financial_key_metrics"
+        # 全历史价格聚合（每个 symbol 一行，写入价格时刷新）
+        PRICE_STATS = "price_stats"
         
         # 交易相关表
         TRANSACTIONS = "transactions"
@@ -100,6 +107,30 @@ class StorageConfig:
             METRIC_NAME = "metric_name"
             METRIC_VALUE = "metric_value"
         
+        # 关键财务指标宽表字段
+        class KeyMetrics:
+            ID = "id"
+            PERIOD = "period"
+            REVENUE = "revenue"
+            NET_INCOME = "net_income"
+            TOTAL_ASSETS = "total_assets"
+            TOTAL_LIABILITIES = "total_liabilities"
+            TOTAL_EQUITY = "total_equity"
+            SHARES_OUTSTANDING = "shares_outstanding"
+            OPERATING_CASH_FLOW = "operating_cash_flow"
+        
+        # 全历史价格聚合字段（列顺序与价格摘要聚合查询一致）
+        class PriceStats:
+            DATA_POINTS = "data_points"
+            START_DATE = "start_date"
+            END_DATE = "end_date"
+            MEAN_CLOSE = "mean_close"
+            MIN_CLOSE = "min_close"
+            MAX_CLOSE = "max_close"
+            TOTAL_VOLUME = "total_volume"
+            SUM_CLOSE_SQ = "sum_close_sq"
+            CLOSE_COUNT = "close_count"  # 非空收盘价数（方差的样本数）
+        
         # 下载日志字段
         class DownloadLogs:
             ID = "id"
@@ -169,6 +200,85 @@ class StorageConfig:
             SALE_PRICE = "sale_price"
             REALIZED_PNL = "realized_pnl"
     
+    # ============= 关键指标映射 =============
+    class KeyMetrics:
+        """关键指标列与原始科目名的对应关系（科目名按优先级排列，取第一个有值的）"""
+        
+        @classmethod
+        def get_aliases(cls) -> Dict[str, Dict[str, List[str]]]:
+            """获取 报表类型 -> {宽表列: [原始科目名, ...]} 映射"""
+            K = StorageConfig.Fields.KeyMetrics
+            return {
+                'income_statement': {
+                    K.REVENUE: ['Revenue', 'Revenue, Net', 'Net sales', 'Total Revenue'],
+                    K.NET_INCOME: [
+                        'Net income',
+                        'Net Income',
+                        'Net Income (Loss) Attributable to Parent',
+                        'Net Income Loss',
+                    ],
+                },
+                'balance_sheet': {
+                    K.TOTAL_ASSETS: ['Total assets', 'Assets', 'Total Assets'],
+                    K.TOTAL_LIABILITIES: [
+                        'Total liabilities',
+                        'Liabilities',
+                        'Total Liab',
+                        'Total Liabilities',
+                    ],
+                    K.TOTAL_EQUITY: [
+                        "Total shareholders' equity",
+                        "Stockholders' Equity Attributable to Parent",
+                        'Stockholders Equity',
+                        'Total Stockholder Equity',
+                        'Total Equity',
+                    ],
+                    K.SHARES_OUTSTANDING: [
+                        'Common stock, shares outstanding (in shares)',
+                        'Common stock, shares issued (in shares)',
+                        'Common Shares Outstanding',
+                        'Shares Outstanding',
+                    ],
+                },
+                'cash_flow': {
+                    K.OPERATING_CASH_FLOW: [
+                        'Net cash provided by operating activities',
+                        'Net Cash Provided by (Used in) Operating Activities',
+                        'Operating Cash Flow',
+                        'Total Cash From Operating Activities',
+                    ],
+                },
+            }
+    
+    # ============= 连接参数定义 =============
+    class Pragmas:
+        """连接建立后设置的 PRAGMA（WAL 模式下每次提交不再强制 fsync 整个日志）"""
+        
+        JOURNAL_MODE = "WAL"
+        SYNCHRONOUS = "NORMAL"
+        TEMP_STORE = "MEMORY"
+        CACHE_SIZE = -65536          # 负值单位为 KiB，即 64 MiB 页缓存
+        MMAP_SIZE = 268435456        # 256 MiB 内存映射 I/O
+        WAL_AUTOCHECKPOINT = 1000    # 每 1000 页触发一次自动检查点
+        BUSY_TIMEOUT_MS = 5000       # 写锁被占用时等待的毫秒数
+        
+        SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+        
+        @classmethod
+        def get_connection_pragmas(
+            cls, synchronous: str = SYNCHRONOUS, mmap_size: int = MMAP_SIZE
+        ) -> List[str]:
+            """获取连接初始化 PRAGMA 语句"""
+            return [
+                f"PRAGMA journal_mode = {cls.JOURNAL_MODE}",
+                f"PRAGMA synchronous = {synchronous}",
+                f"PRAGMA temp_store = {cls.TEMP_STORE}",
+                f"PRAGMA cache_size = {cls.CACHE_SIZE}",
+                f"PRAGMA mmap_size = {int(mmap_size)}",
+                f"PRAGMA wal_autocheckpoint = {cls.WAL_AUTOCHECKPOINT}",
+                f"PRAGMA busy_timeout = {cls.BUSY_TIMEOUT_MS}",
+            ]
+    
     # ============= SQL模板定义 =============
     class SQLTemplates:
         """SQL模板定义"""
@@ -182,6 +292,21 @@ class StorageConfig:
         # 插入/更新模板
         INSERT_OR_REPLACE = "INSERT OR REPLACE INTO {table} ({fields}) VALUES ({placeholders})"
         INSERT_OR_IGNORE = "INSERT OR IGNORE INTO {table} ({fields}) VALUES ({placeholders})"
+        # 原地更新的 upsert：冲突时只改写 updates 中的列，不删除重插（保留 id、created_at）
+        UPSERT = (
+            "INSERT INTO {table} ({fields}) VALUES ({placeholders}) "
+            "ON CONFLICT ({conflict}) DO UPDATE SET {updates}"
+        )
+        # 多行 VALUES 版本，rows 形如 "(?, ?), (?, ?)"
+        UPSERT_MULTI = (
+            "INSERT INTO {table} ({fields}) VALUES {rows} "
+            "ON CONFLICT ({conflict}) DO UPDATE SET {updates}"
+        )
+        
+        @staticmethod
+        def excluded_updates(columns: List[str]) -> str:
+            """生成 upsert 的 SET 子句：col = excluded.col"""
+            return ", ".join(f"{column} = excluded.{column}" for column in columns)
         
         # 删除模板
         DELETE_WHERE = "DELETE FROM {table} WHERE {where}"
@@ -248,16 +373,29 @@ class StorageConfig:
         F = cls.Fields
         
         return [
-            f"CREATE INDEX IF NOT EXISTS idx_{T.STOCK_PRICES}_symbol_date ON {T.STOCK_PRICES} ({F.SYMBOL}, {F.StockPrices.DATE})",
-            f"CREATE INDEX IF NOT EXISTS idx_{T.INCOME_STATEMENT}_symbol_period ON {T.INCOME_STATEMENT} ({F.SYMBOL}, {F.FinancialStatement.PERIOD})",
-            f"CREATE INDEX IF NOT EXISTS idx_{T.BALANCE_SHEET}_symbol_period ON {T.BALANCE_SHEET} ({F.SYMBOL}, {F.FinancialStatement.PERIOD})",
-            f"CREATE INDEX IF NOT EXISTS idx_{T.CASH_FLOW}_symbol_period ON {T.CASH_FLOW} ({F.SYMBOL}, {F.FinancialStatement.PERIOD})",
+            # 覆盖索引：区间查询直接从索引取数，无需回表
+            f"CREATE INDEX IF NOT EXISTS idx_{T.STOCK_PRICES}_cover ON {T.STOCK_PRICES} ({F.SYMBOL}, {F.StockPrices.DATE}, {F.StockPrices.OPEN}, {F.StockPrices.HIGH}, {F.StockPrices.LOW}, {F.StockPrices.CLOSE}, {F.StockPrices.VOLUME}, {F.StockPrices.ADJ_CLOSE})",
+            f"CREATE INDEX IF NOT EXISTS idx_{T.INCOME_STATEMENT}_cover ON {T.INCOME_STATEMENT} ({F.SYMBOL}, {F.FinancialStatement.PERIOD}, {F.FinancialStatement.METRIC_NAME}, {F.FinancialStatement.METRIC_VALUE})",
+            f"CREATE INDEX IF NOT EXISTS idx_{T.BALANCE_SHEET}_cover ON {T.BALANCE_SHEET} ({F.SYMBOL}, {F.FinancialStatement.PERIOD}, {F.FinancialStatement.METRIC_NAME}, {F.FinancialStatement.METRIC_VALUE})",
+            f"CREATE INDEX IF NOT EXISTS idx_{T.CASH_FLOW}_cover ON {T.CASH_FLOW} ({F.SYMBOL}, {F.FinancialStatement.PERIOD}, {F.FinancialStatement.METRIC_NAME}, {F.FinancialStatement.METRIC_VALUE})",
             f"CREATE INDEX IF NOT EXISTS idx_{T.INCOME_STATEMENT}_metric_name ON {T.INCOME_STATEMENT} ({F.FinancialStatement.METRIC_NAME})",
             f"CREATE INDEX IF NOT EXISTS idx_{T.BALANCE_SHEET}_metric_name ON {T.BALANCE_SHEET} ({F.FinancialStatement.METRIC_NAME})",
             f"CREATE INDEX IF NOT EXISTS idx_{T.CASH_FLOW}_metric_name ON {T.CASH_FLOW} ({F.FinancialStatement.METRIC_NAME})",
             f"CREATE INDEX IF NOT EXISTS idx_{T.DOWNLOAD_LOGS}_symbol ON {T.DOWNLOAD_LOGS} ({F.SYMBOL})",
         ]
 
+    @classmethod
+    def get_obsolete_indexes(cls) -> List[str]:
+        """获取已被覆盖索引取代的旧索引删除语句"""
+        T = cls.Tables
+
+        return [
+            f"DROP INDEX IF EXISTS idx_{T.STOCK_PRICES}_symbol_date",
+            f"DROP INDEX IF EXISTS idx_{T.INCOME_STATEMENT}_symbol_period",
+            f"DROP INDEX IF EXISTS idx_{T.BALANCE_SHEET}_symbol_period",
+            f"DROP INDEX IF EXISTS idx_{T.CASH_FLOW}_symbol_period",
+        ]
+
     @classmethod
     def get_trading_and_lot_indexes(cls) -> List[str]:
         """获取交易和批次追踪表索引创建语句"""
@@ -7,11 +7,19 @@ SQLite 查询方法
 import sqlite3
 import logging
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
-from ..models import BasicInfo, FinancialData, FinancialStatement, PriceData, StockData
+from ..models import (
+    BasicInfo,
+    FinancialData,
+    FinancialStatement,
+    PriceData,
+    StockData,
+    SummaryStats,
+)
 from .config import StorageConfig, QueryBuilder
 
 
@@ -30,54 +38,133 @@ class SQLiteQueryManager:
         self.cursor = cursor
         self.config = StorageConfig()
         self.logger = logging.getLogger(__name__)
+        
+        # 预构建的价格区间查询语句，按 (是否有起始日期, 是否有结束日期) 索引
+        F = self.config.Fields.StockPrices
+        self._price_rows_sql = self._build_price_range_sql(
+            f"{F.DATE}, {F.OPEN}, {F.HIGH}, {F.LOW}, {F.CLOSE}, {F.VOLUME}, {F.ADJ_CLOSE}",
+            ordered=True,
+        )
+        # 由 SQLite 单次扫描完成聚合；样本标准差由平方和推导。
+        # AVG/SUM 跳过 NULL 收盘价，方差的样本数须用 COUNT(close) 而非 COUNT(*)
+        self._price_summary_sql = self._build_price_range_sql(
+            f"COUNT(*), MIN({F.DATE}), MAX({F.DATE}), AVG({F.CLOSE}), "
+            f"MIN({F.CLOSE}), MAX({F.CLOSE}), SUM({F.VOLUME}), "
+            f"SUM({F.CLOSE} * {F.CLOSE}), COUNT({F.CLOSE})",
+            ordered=False,
+        )
+        S = self.config.Fields.PriceStats
+        # 列顺序与上面的区间聚合一致
+        self._price_stats_sql = (
+            f"SELECT {S.DATA_POINTS}, {S.START_DATE}, {S.END_DATE}, {S.MEAN_CLOSE}, "
+            f"{S.MIN_CLOSE}, {S.MAX_CLOSE}, {S.TOTAL_VOLUME}, {S.SUM_CLOSE_SQ}, {S.CLOSE_COUNT} "
+            f"FROM {self.config.Tables.PRICE_STATS} WHERE {self.config.Fields.SYMBOL} = ?"
+        )
     
+    def _build_price_range_sql(self, fields: str, ordered: bool) -> Dict[Tuple[bool, bool], str]:
+        """
+        预构建按日期区间筛选价格的全部条件组合（无 / 仅起始 / 仅结束 / 起止）
+
+        语句文本在实例生命周期内保持不变，sqlite3 语句缓存可直接复用已编译的执行计划
+        """
+        F = self.config.Fields.StockPrices
+        statements = {}
+        for has_start in (False, True):
+            for has_end in (False, True):
+                builder = QueryBuilder(self.config.Tables.STOCK_PRICES)
+                builder.where(f"{self.config.Fields.SYMBOL} = ?")
+                if has_start:
+                    builder.where(f"{F.DATE} >= ?")
+                if has_end:
+                    builder.where(f"{F.DATE} <= ?")
+                if ordered:
+                    builder.order(F.DATE)
+                statements[(has_start, has_end)] = builder.build_select(fields)[0]
+        return statements
+
+    @staticmethod
+    def _price_range_key(
+        symbol: str, start_date: Optional[str], end_date: Optional[str]
+    ) -> Tuple[Tuple[bool, bool], List[str]]:
+        """价格区间查询的语句索引与绑定参数"""
+        params = [symbol]
+        if start_date:
+            params.append(start_date)
+        if end_date:
+            params.append(end_date)
+        return (bool(start_date), bool(end_date)), params
+
+    def _build_price_rows_query(
+        self, symbol: str, start_date: Optional[str], end_date: Optional[str]
+    ) -> Tuple[str, List[Any]]:
+        """逐日价格查询（按日期升序，列顺序与 PriceData 字段一致）"""
+        key, params = self._price_range_key(symbol, start_date, end_date)
+        return self._price_rows_sql[key], params
+
+    def iter_prices(
+        self,
+        symbol: str,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        chunk_size: int = 1000,
+    ) -> Iterator[List[Tuple]]:
+        """
+        分块迭代逐日价格，不经过 DataFrame
+
+        Yields:
+            每块最多 chunk_size 行的 (date, open, high, low, close, volume, adj_close) 元组列表
+        """
+        sql, params = self._build_price_rows_query(symbol, start_date, end_date)
+        cursor = self.connection.execute(sql, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            cursor.close()
+
     def get_stock_data(
         self, symbol: str, start_date: Optional[str] = None, end_date: Optional[str] = None
     ) -> Optional[StockData]:
         """获取股票数据"""
         try:
-            # 使用查询构建器构建查询
-            builder = QueryBuilder(self.config.Tables.STOCK_PRICES)
-            builder.where(f"{self.config.Fields.SYMBOL} = ?", symbol)
-            
-            if start_date:
-                builder.where(f"{self.config.Fields.StockPrices.DATE} >= ?", start_date)
-            
-            if end_date:
-                builder.where(f"{self.config.Fields.StockPrices.DATE} <= ?", end_date)
-            
-            builder.order(self.config.Fields.StockPrices.DATE)
-            
-            # 构建字段列表
-            F = self.config.Fields.StockPrices
-            fields = f"{F.DATE}, {F.OPEN}, {F.HIGH}, {F.LOW}, {F.CLOSE}, {F.VOLUME}, {F.ADJ_CLOSE}"
-            
-            sql, params = builder.build_select(fields)
-            df = pd.read_sql_query(sql, self.connection, params=params)
+            sql, params = self._build_price_rows_query(symbol, start_date, end_date)
+            rows = self.connection.execute(sql, params).fetchall()
 
-            if df.empty:
+            if not rows:
                 return None
 
-            # 构建价格数据
+            # 游标元组直接按列转置，省去 DataFrame 中间层
+            dates, opens, highs, lows, closes, volumes, adj_closes = (
+                list(column) for column in zip(*rows)
+            )
             price_data = PriceData(
-                dates=df[F.DATE].tolist(),
-                open=df[F.OPEN].tolist(),
-                high=df[F.HIGH].tolist(),
-                low=df[F.LOW].tolist(),
-                close=df[F.CLOSE].tolist(),
-                volume=df[F.VOLUME].tolist(),
-                adj_close=df[F.ADJ_CLOSE].tolist(),
+                dates=dates,
+                open=opens,
+                high=highs,
+                low=lows,
+                close=closes,
+                volume=volumes,
+                adj_close=adj_closes,
             )
 
-            # 计算统计数据
-            from ..models import calculate_summary_stats
-            summary_stats = calculate_summary_stats(price_data.close, price_data.volume)
+            # 统计口径与 pandas 一致：忽略 NULL，标准差为样本标准差
+            close = np.array(closes, dtype=float)
+            summary_stats = SummaryStats(
+                mean_price=float(np.nanmean(close)),
+                std_price=float(np.nanstd(close, ddof=1)) if len(close) > 1 else 0.0,
+                min_price=float(np.nanmin(close)),
+                max_price=float(np.nanmax(close)),
+                total_volume=int(sum(volume for volume in volumes if volume is not None)),
+            )
 
             return StockData(
                 symbol=symbol,
-                start_date=start_date or df[F.DATE].min(),
-                end_date=end_date or df[F.DATE].max(),
-                data_points=len(df),
+                start_date=start_date or dates[0],
+                end_date=end_date or dates[-1],
+                data_points=len(rows),
                 price_data=price_data,
                 summary_stats=summary_stats,
                 downloaded_at=datetime.now().isoformat(),
@@ -88,6 +175,70 @@ class SQLiteQueryManager:
             self.logger.error(f"❌ 获取股票数据失败 {symbol}: {e}")
             return None
     
+    def get_price_df(
+        self, symbol: str, start_date: Optional[str] = None, end_date: Optional[str] = None
+    ) -> Optional[pd.DataFrame]:
+        """
+        以 DataFrame 获取逐日价格（按日期升序），供向量化分析直接使用
+
+        Returns:
+            列为 date、open、high、low、close、volume、adj_close 的 DataFrame；无数据时返回 None
+        """
+        try:
+            sql, params = self._build_price_rows_query(symbol, start_date, end_date)
+            df = pd.read_sql_query(sql, self.connection, params=params)
+            return df if not df.empty else None
+
+        except Exception as e:
+            self.logger.error(f"❌ 获取价格数据失败 {symbol}: {e}")
+            return None
+
+    def get_price_summary(
+        self, symbol: str, start_date: Optional[str] = None, end_date: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        仅获取价格区间摘要（不加载逐日数据）
+
+        Returns:
+            包含 data_points、start_date、end_date、summary_stats 的字典；无数据时返回 None
+        """
+        try:
+            row = None
+            if not start_date and not end_date:
+                # 全历史摘要直接读取写入时维护的聚合行
+                row = self.connection.execute(self._price_stats_sql, (symbol,)).fetchone()
+            if row is None:
+                key, params = self._price_range_key(symbol, start_date, end_date)
+                sql = self._price_summary_sql[key]
+                row = self.connection.execute(sql, params).fetchone()
+
+            (count, first_date, last_date, mean_price, min_price, max_price, volume, sum_sq,
+             close_count) = row
+            if not count:
+                return None
+
+            std_price = 0.0
+            if close_count > 1:
+                variance = (sum_sq - close_count * mean_price * mean_price) / (close_count - 1)
+                std_price = max(variance, 0.0) ** 0.5
+
+            return {
+                'data_points': count,
+                'start_date': start_date or first_date,
+                'end_date': end_date or last_date,
+                'summary_stats': SummaryStats(
+                    mean_price=mean_price,
+                    std_price=std_price,
+                    min_price=min_price,
+                    max_price=max_price,
+                    total_volume=volume or 0,
+                ),
+            }
+
+        except Exception as e:
+            self.logger.error(f"❌ 获取价格摘要失败 {symbol}: {e}")
+            return None
+
     def get_financial_metrics(
         self, symbol: str, statement_type: str, start_period: Optional[str] = None, end_period: Optional[str] = None
     ) -> Optional[pd.DataFrame]:
@@ -120,6 +271,29 @@ class SQLiteQueryManager:
             self.logger.error(f"❌ 获取{statement_type}指标失败 {symbol}: {e}")
             return None
     
+    def get_key_metrics(self, symbol: str) -> Optional[pd.DataFrame]:
+        """获取关键财务指标宽表数据：每个报告期一行，按报告期降序"""
+        try:
+            F = self.config.Fields
+            K = F.KeyMetrics
+            builder = QueryBuilder(self.config.Tables.FINANCIAL_KEY_METRICS)
+            builder.where(f"{F.SYMBOL} = ?", symbol)
+            builder.order(K.PERIOD, "DESC")
+
+            fields = (
+                f"{K.PERIOD}, {K.REVENUE}, {K.NET_INCOME}, {K.TOTAL_ASSETS}, "
+                f"{K.TOTAL_LIABILITIES}, {K.TOTAL_EQUITY}, {K.SHARES_OUTSTANDING}, "
+                f"{K.OPERATING_CASH_FLOW}"
+            )
+            sql, params = builder.build_select(fields)
+            df = pd.read_sql_query(sql, self.connection, params=params)
+
+            return df if not df.empty else None
+
+        except Exception as e:
+            self.logger.error(f"❌ 获取关键财务指标失败 {symbol}: {e}")
+            return None
+
     def get_financial_data(self, symbol: str) -> Optional[FinancialData]:
         """获取财务数据"""
         try:
@@ -127,19 +301,25 @@ class SQLiteQueryManager:
             T = self.config.Tables
             F = self.config.Fields
             
-            basic_info_sql = f"SELECT * FROM {T.STOCKS} WHERE {F.SYMBOL} = ?"
-            basic_df = pd.read_sql_query(basic_info_sql, self.connection, params=[symbol])
+            # 单行读取直接用游标，按显式列顺序取值，无需构造 DataFrame
+            basic_info_sql = (
+                f"SELECT {F.Stocks.COMPANY_NAME}, {F.Stocks.SECTOR}, {F.Stocks.INDUSTRY}, "
+                f"{F.Stocks.MARKET_CAP}, {F.Stocks.EMPLOYEES}, {F.Stocks.DESCRIPTION} "
+                f"FROM {T.STOCKS} WHERE {F.SYMBOL} = ?"
+            )
+            row = self.cursor.execute(basic_info_sql, (symbol,)).fetchone()
 
-            if basic_df.empty:
+            if row is None:
                 return None
 
+            company_name, sector, industry, market_cap, employees, description = row
             basic_info = BasicInfo(
-                company_name=basic_df.iloc[0][F.Stocks.COMPANY_NAME] or "",
-                sector=basic_df.iloc[0][F.Stocks.SECTOR] or "",
-                industry=basic_df.iloc[0][F.Stocks.INDUSTRY] or "",
-                market_cap=basic_df.iloc[0][F.Stocks.MARKET_CAP] or 0,
-                employees=basic_df.iloc[0][F.Stocks.EMPLOYEES] or 0,
-                description=basic_df.iloc[0][F.Stocks.DESCRIPTION] or "",
+                company_name=company_name or "",
+                sector=sector or "",
+                industry=industry or "",
+                market_cap=market_cap or 0,
+                employees=employees or 0,
+                description=description or "",
             )
 
             # 从独立的财务表获取数据并构建 FinancialStatement 对象
@@ -152,27 +332,24 @@ class SQLiteQueryManager:
                 try:
                     # 获取该表的所有数据
                     sql = f"SELECT {F.FinancialStatement.PERIOD}, {F.FinancialStatement.METRIC_NAME}, {F.FinancialStatement.METRIC_VALUE} FROM {table_name} WHERE {F.SYMBOL} = ? ORDER BY {F.FinancialStatement.PERIOD} DESC"
-                    df = pd.read_sql_query(sql, self.connection, params=[symbol])
+                    # 逐行迭代游标：报告期按 SQL 降序首次出现的顺序收集，指标保持出现顺序
+                    periods: Dict[str, None] = {}
+                    values_by_metric: Dict[str, Dict[str, float]] = {}
+                    for period, metric_name, metric_value in self.connection.execute(sql, (symbol,)):
+                        periods.setdefault(period)
+                        metric_values = values_by_metric.setdefault(metric_name, {})
+                        if metric_value is not None:
+                            metric_values.setdefault(period, float(metric_value))
                     
-                    if not df.empty:
-                        # 重构数据为 FinancialStatement 格式
-                        periods = sorted(df[F.FinancialStatement.PERIOD].unique(), reverse=True)
-                        items = {}
-                        
-                        for metric_name in df[F.FinancialStatement.METRIC_NAME].unique():
-                            metric_data = df[df[F.FinancialStatement.METRIC_NAME] == metric_name]
-                            values = []
-                            for period in periods:
-                                period_data = metric_data[metric_data[F.FinancialStatement.PERIOD] == period]
-                                if not period_data.empty:
-                                    values.append(period_data.iloc[0][F.FinancialStatement.METRIC_VALUE])
-                                else:
-                                    values.append(None)
-                            items[metric_name] = values
+                    if periods:
+                        items = {
+                            metric_name: [metric_values.get(period) for period in periods]
+                            for metric_name, metric_values in values_by_metric.items()
+                        }
                         
                         statements[stmt_type] = FinancialStatement(
                             statement_type=stmt_type,
-                            periods=periods,
+                            periods=list(periods),
                             items=items
                         )
                         
@@ -207,18 +384,16 @@ class SQLiteQueryManager:
             T = self.config.Tables
             F = self.config.Fields
             
-            # 使用UNION查询获取所有表的最新期间
-            sql = f"""
-            SELECT MAX(period) as max_period FROM (
-                SELECT MAX({F.FinancialStatement.PERIOD}) as period FROM {T.INCOME_STATEMENT} WHERE {F.SYMBOL} = ?
-                UNION ALL
-                SELECT MAX({F.FinancialStatement.PERIOD}) as period FROM {T.BALANCE_SHEET} WHERE {F.SYMBOL} = ?
-                UNION ALL
-                SELECT MAX({F.FinancialStatement.PERIOD}) as period FROM {T.CASH_FLOW} WHERE {F.SYMBOL} = ?
+            # 单条语句内三个标量子查询，各自走 (symbol, period) 索引直接取最大值
+            sql = (
+                "SELECT "
+                + ", ".join(
+                    f"(SELECT MAX({F.FinancialStatement.PERIOD}) FROM {table} WHERE {F.SYMBOL} = ?)"
+                    for table in (T.INCOME_STATEMENT, T.BALANCE_SHEET, T.CASH_FLOW)
+                )
             )
-            """
             result = self.cursor.execute(sql, (symbol, symbol, symbol)).fetchone()
-            return result[0] if result and result[0] else None
+            return max((period for period in result if period), default=None)
         except Exception as e:
             self.logger.error(f"❌ 获取最近财务期间失败 {symbol}: {e}")
             return None
@@ -31,8 +31,7 @@ class SQLiteSchemaManager:
         self.logger.info("📊 创建/修复数据库表结构...")
         
         # 创建核心表
-        for table_sql in self._get_table_definitions():
-            self.cursor.execute(table_sql)
+        self.ensure_core_tables()
         
         # 注意：交易表和批次追踪表由connect()方法确保创建，避免重复调用
         
@@ -43,38 +42,102 @@ class SQLiteSchemaManager:
         self.connection.commit()
         self.logger.info("✅ 数据库表结构就绪")
     
-    def schema_exists(self) -> bool:
-        """检查核心表是否已存在"""
+    def ensure_core_tables(self) -> None:
+        """补建缺失的核心表（幂等操作，已有数据库升级时新增的表也由此创建）"""
+        # price_stats 是可由 stock_prices 重新聚合的派生表，旧版本缺少列时直接删除重建
+        T = self.config.Tables
+        columns = {row[1] for row in self.cursor.execute(f"PRAGMA table_info({T.PRICE_STATS})")}
+        if columns and self.config.Fields.PriceStats.CLOSE_COUNT not in columns:
+            self.cursor.execute(f"DROP TABLE {T.PRICE_STATS}")
+
+        for table_sql in self._get_table_definitions():
+            self.cursor.execute(table_sql)
+
+    def get_schema_version(self) -> int:
+        """读取数据库记录的架构版本（PRAGMA user_version，新库为 0）"""
+        return self.cursor.execute("PRAGMA user_version").fetchone()[0]
+
+    def set_schema_version(self, version: int) -> None:
+        """记录数据库架构版本"""
+        self.cursor.execute(f"PRAGMA user_version = {int(version)}")
+
+    def ensure_core_indexes(self) -> None:
+        """
+        确保已有数据库的核心索引与当前定义一致（幂等操作）
+
+        创建缺失的索引、删除已被取代的旧索引，并对新建了索引的表执行 ANALYZE，
+        让查询规划器立即掌握新索引的统计信息。
+        """
+        index_list_sql = "SELECT name, tbl_name FROM sqlite_master WHERE type='index'"
+        existing = {name for name, _ in self.cursor.execute(index_list_sql).fetchall()}
+
+        for index_sql in self.config.get_core_indexes():
+            self.cursor.execute(index_sql)
+        for drop_sql in self.config.get_obsolete_indexes():
+            self.cursor.execute(drop_sql)
+
+        new_index_tables = {
+            table
+            for name, table in self.cursor.execute(index_list_sql).fetchall()
+            if name not in existing
+        }
+        for table in sorted(new_index_tables):
+            self.cursor.execute(f"ANALYZE {table}")
+
+        self.connection.commit()
+
+    def drop_secondary_indexes(self, tables: List[str]) -> List[str]:
+        """
+        删除指定表上显式创建的二级索引（UNIQUE 约束的自动索引保留，upsert 依赖它）
+
+        架构版本在同一事务中清零：若进程在重建索引前退出，下次连接会走完整的建表/索引流程补回索引
+
+        Returns:
+            被删除索引的 CREATE INDEX 语句，供 restore_indexes 重建
+        """
+        placeholders = ",".join(["?"] * len(tables))
+        sql = (
+            f"SELECT name, sql FROM sqlite_master "
+            f"WHERE type='index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})"
+        )
+        rows = self.cursor.execute(sql, tables).fetchall()
+        self.cursor.execute("BEGIN")
+        self.set_schema_version(0)
+        for name, _ in rows:
+            self.cursor.execute(f"DROP INDEX IF EXISTS {name}")
+        self.connection.commit()
+        return [index_sql for _, index_sql in rows]
+
+    def restore_indexes(self, index_sqls: List[str], tables: List[str]) -> None:
+        """重建 drop_secondary_indexes 删除的索引并对相关表执行 ANALYZE，同一事务中恢复架构版本"""
+        self.cursor.execute("BEGIN")
+        for index_sql in index_sqls:
+            self.cursor.execute(index_sql)
+        for table in tables:
+            self.cursor.execute(f"ANALYZE {table}")
+        self.set_schema_version(self.config.SCHEMA_VERSION)
+        self.connection.commit()
+
+    def _tables_exist(self, tables: List[str]) -> bool:
+        """检查给定表是否全部存在（由 SQLite 直接计数，不取回表名列表）"""
         try:
-            required_tables = self.config.Tables.get_all_required_tables()
-            placeholders = ",".join(["?"] * len(required_tables))
-            sql = f"SELECT name FROM sqlite_master WHERE type='table' AND name IN ({placeholders})"
-            rows = self.cursor.execute(sql, required_tables).fetchall()
-            return len(rows) == len(required_tables)
+            placeholders = ",".join(["?"] * len(tables))
+            sql = f"SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name IN ({placeholders})"
+            return self.cursor.execute(sql, tables).fetchone()[0] == len(tables)
         except Exception:
             return False
+
+    def schema_exists(self) -> bool:
+        """检查核心表是否已存在"""
+        return self._tables_exist(self.config.Tables.get_all_required_tables())
     
     def trading_tables_exist(self) -> bool:
         """检查交易相关表是否已存在"""
-        try:
-            trading_tables = self.config.Tables.get_trading_tables()
-            placeholders = ",".join(["?"] * len(trading_tables))
-            sql = f"SELECT name FROM sqlite_master WHERE type='table' AND name IN ({placeholders})"
-            rows = self.cursor.execute(sql, trading_tables).fetchall()
-            return len(rows) == len(trading_tables)
-        except Exception:
-            return False
+        return self._tables_exist(self.config.Tables.get_trading_tables())
     
     def lot_tracking_tables_exist(self) -> bool:
         """检查批次追踪相关表是否已存在"""
-        try:
-            lot_tracking_tables = self.config.Tables.get_lot_tracking_tables()
-            placeholders = ",".join(["?"] * len(lot_tracking_tables))
-            sql = f"SELECT name FROM sqlite_master WHERE type='table' AND name IN ({placeholders})"
-            rows = self.cursor.execute(sql, lot_tracking_tables).fetchall()
-            return len(rows) == len(lot_tracking_tables)
-        except Exception:
-            return False
+        return self._tables_exist(self.config.Tables.get_lot_tracking_tables())
     
     def ensure_lot_tracking_tables(self) -> None:
         """确保批次追踪相关表存在（幂等操作，仅创建批次追踪表及索引）"""
@@ -224,7 +287,12 @@ class SQLiteSchemaManager:
     
     
     def _get_table_definitions(self) -> List[str]:
-        """获取表定义SQL"""
+        """
+        获取表定义SQL
+
+        行情与财报等可重建的数据表使用普通 INTEGER PRIMARY KEY（rowid 别名），
+        不需要 AUTOINCREMENT 的 sqlite_sequence 维护，每次插入少一次写入
+        """
         T = self.config.Tables
         F = self.config.Fields
         
@@ -243,7 +311,7 @@ class SQLiteSchemaManager:
             """,
             f"""
             CREATE TABLE IF NOT EXISTS {T.STOCK_PRICES} (
-                {F.StockPrices.ID} INTEGER PRIMARY KEY AUTOINCREMENT,
+                {F.StockPrices.ID} INTEGER PRIMARY KEY,
                 {F.SYMBOL} TEXT NOT NULL,
                 {F.StockPrices.DATE} TEXT NOT NULL,
                 {F.StockPrices.OPEN} REAL,
@@ -258,7 +326,7 @@ class SQLiteSchemaManager:
             """,
             f"""
             CREATE TABLE IF NOT EXISTS {T.INCOME_STATEMENT} (
-                {F.FinancialStatement.ID} INTEGER PRIMARY KEY AUTOINCREMENT,
+                {F.FinancialStatement.ID} INTEGER PRIMARY KEY,
                 {F.SYMBOL} TEXT NOT NULL,
                 {F.FinancialStatement.PERIOD} TEXT NOT NULL,
                 {F.FinancialStatement.METRIC_NAME} TEXT NOT NULL,
@@ -270,7 +338,7 @@ class SQLiteSchemaManager:
             """,
             f"""
             CREATE TABLE IF NOT EXISTS {T.BALANCE_SHEET} (
-                {F.FinancialStatement.ID} INTEGER PRIMARY KEY AUTOINCREMENT,
+                {F.FinancialStatement.ID} INTEGER PRIMARY KEY,
                 {F.SYMBOL} TEXT NOT NULL,
                 {F.FinancialStatement.PERIOD} TEXT NOT NULL,
                 {F.FinancialStatement.METRIC_NAME} TEXT NOT NULL,
@@ -282,7 +350,7 @@ class SQLiteSchemaManager:
             """,
             f"""
             CREATE TABLE IF NOT EXISTS {T.CASH_FLOW} (
-                {F.FinancialStatement.ID} INTEGER PRIMARY KEY AUTOINCREMENT,
+                {F.FinancialStatement.ID} INTEGER PRIMARY KEY,
                 {F.SYMBOL} TEXT NOT NULL,
                 {F.FinancialStatement.PERIOD} TEXT NOT NULL,
                 {F.FinancialStatement.METRIC_NAME} TEXT NOT NULL,
@@ -294,7 +362,7 @@ class SQLiteSchemaManager:
             """,
             f"""
             CREATE TABLE IF NOT EXISTS {T.DOWNLOAD_LOGS} (
-                {F.DownloadLogs.ID} INTEGER PRIMARY KEY AUTOINCREMENT,
+                {F.DownloadLogs.ID} INTEGER PRIMARY KEY,
                 {F.SYMBOL} TEXT NOT NULL,
                 {F.DownloadLogs.DOWNLOAD_TYPE} TEXT NOT NULL,
                 {F.DownloadLogs.STATUS} TEXT NOT NULL,
@@ -304,5 +372,38 @@ class SQLiteSchemaManager:
                 {F.DownloadLogs.DOWNLOAD_TIMESTAMP} TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY ({F.SYMBOL}) REFERENCES {T.STOCKS}({F.SYMBOL})
             )
+            """,
+            f"""
+            CREATE TABLE IF NOT EXISTS {T.PRICE_STATS} (
+                {F.SYMBOL} TEXT PRIMARY KEY,
+                {F.PriceStats.DATA_POINTS} INTEGER NOT NULL,
+                {F.PriceStats.START_DATE} TEXT,
+                {F.PriceStats.END_DATE} TEXT,
+                {F.PriceStats.MEAN_CLOSE} REAL,
+                {F.PriceStats.MIN_CLOSE} REAL,
+                {F.PriceStats.MAX_CLOSE} REAL,
+                {F.PriceStats.TOTAL_VOLUME} INTEGER,
+                {F.PriceStats.SUM_CLOSE_SQ} REAL,
+                {F.PriceStats.CLOSE_COUNT} INTEGER NOT NULL DEFAULT 0,
+                {F.UPDATED_AT} TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY ({F.SYMBOL}) REFERENCES {T.STOCKS}({F.SYMBOL})
+            )
+            """,
+            f"""
+            CREATE TABLE IF NOT EXISTS {T.FINANCIAL_KEY_METRICS} (
+                {F.KeyMetrics.ID} INTEGER PRIMARY KEY,
+                {F.SYMBOL} TEXT NOT NULL,
+                {F.KeyMetrics.PERIOD} TEXT NOT NULL,
+                {F.KeyMetrics.REVENUE} REAL,
+                {F.KeyMetrics.NET_INCOME} REAL,
+                {F.KeyMetrics.TOTAL_ASSETS} REAL,
+                {F.KeyMetrics.TOTAL_LIABILITIES} REAL,
+                {F.KeyMetrics.TOTAL_EQUITY} REAL,
+                {F.KeyMetrics.SHARES_OUTSTANDING} REAL,
+                {F.KeyMetrics.OPERATING_CASH_FLOW} REAL,
+                {F.UPDATED_AT} TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY ({F.SYMBOL}) REFERENCES {T.STOCKS}({F.SYMBOL}),
+                UNIQUE({F.SYMBOL}, {F.KeyMetrics.PERIOD})
+            )
             """
         ]
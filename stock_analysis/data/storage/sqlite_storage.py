@@ -4,13 +4,26 @@ SQLite 存储实现
 使用模块化设计，将复杂逻辑分离到专门的模块中
 """
 
+import atexit
+import functools
 import json
 import logging
 import sqlite3
+import threading
+import time
+import weakref
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import datetime, timezone
+from itertools import chain, islice, repeat
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, TypeVar, Union
+
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，未安装时回退标准库 json
+    orjson = None  # type: ignore[assignment]
 
 from ..models import (
     BasicInfo,
@@ -26,17 +39,281 @@ from .sqlite_schema import SQLiteSchemaManager
 from .sqlite_queries import SQLiteQueryManager
 
 
+_T = TypeVar("_T")
+
+_PRICE_FIELDS = [
+    StorageConfig.Fields.SYMBOL,
+    StorageConfig.Fields.StockPrices.DATE,
+    StorageConfig.Fields.StockPrices.OPEN,
+    StorageConfig.Fields.StockPrices.HIGH,
+    StorageConfig.Fields.StockPrices.LOW,
+    StorageConfig.Fields.StockPrices.CLOSE,
+    StorageConfig.Fields.StockPrices.VOLUME,
+    StorageConfig.Fields.StockPrices.ADJ_CLOSE,
+]
+_PRICE_ROW_PLACEHOLDERS = f"({', '.join('?' * len(_PRICE_FIELDS))})"
+
+
+@functools.lru_cache(maxsize=128)
+def _build_price_insert_sql(row_count: int) -> str:
+    """构造一次写入 row_count 行价格数据的多行 upsert 语句（按 symbol+date 冲突原地更新）"""
+    return StorageConfig.SQLTemplates.UPSERT_MULTI.format(
+        table=StorageConfig.Tables.STOCK_PRICES,
+        fields=", ".join(_PRICE_FIELDS),
+        rows=", ".join([_PRICE_ROW_PLACEHOLDERS] * row_count),
+        conflict=", ".join(_PRICE_FIELDS[:2]),
+        updates=StorageConfig.SQLTemplates.excluded_updates(_PRICE_FIELDS[2:]),
+    )
+
+
+def _build_price_stats_refresh_sql(by_symbol: bool) -> str:
+    """
+    由 stock_prices 重新聚合 price_stats（按 symbol 冲突原地更新）
+
+    by_symbol 为 True 时只刷新一个 symbol（一个绑定参数），否则重建全部 symbol
+    """
+    F = StorageConfig.Fields
+    P = F.StockPrices
+    S = F.PriceStats
+    columns = [
+        S.DATA_POINTS,
+        S.START_DATE,
+        S.END_DATE,
+        S.MEAN_CLOSE,
+        S.MIN_CLOSE,
+        S.MAX_CLOSE,
+        S.TOTAL_VOLUME,
+        S.SUM_CLOSE_SQ,
+        S.CLOSE_COUNT,
+    ]
+    # WHERE 子句不可省略：INSERT ... SELECT 后接 ON CONFLICT 时需借此消除解析歧义
+    where = f"{F.SYMBOL} = ?" if by_symbol else "1"
+    return (
+        f"INSERT INTO {StorageConfig.Tables.PRICE_STATS} "
+        f"({F.SYMBOL}, {', '.join(columns)}) "
+        f"SELECT {F.SYMBOL}, COUNT(*), MIN({P.DATE}), MAX({P.DATE}), AVG({P.CLOSE}), "
+        f"MIN({P.CLOSE}), MAX({P.CLOSE}), SUM({P.VOLUME}), SUM({P.CLOSE} * {P.CLOSE}), "
+        f"COUNT({P.CLOSE}) "
+        f"FROM {StorageConfig.Tables.STOCK_PRICES} WHERE {where} GROUP BY {F.SYMBOL} "
+        f"ON CONFLICT({F.SYMBOL}) DO UPDATE SET "
+        f"{StorageConfig.SQLTemplates.excluded_updates(columns)}, "
+        f"{F.UPDATED_AT} = CURRENT_TIMESTAMP"
+    )
+
+
+def _build_basic_info_upsert_sql() -> str:
+    """stocks 基本信息 upsert：原地更新，updated_at 由 SQLite 生成"""
+    F = StorageConfig.Fields
+    columns = [
+        F.SYMBOL,
+        F.Stocks.COMPANY_NAME,
+        F.Stocks.SECTOR,
+        F.Stocks.INDUSTRY,
+        F.Stocks.MARKET_CAP,
+        F.Stocks.EMPLOYEES,
+        F.Stocks.DESCRIPTION,
+    ]
+    return StorageConfig.SQLTemplates.UPSERT.format(
+        table=StorageConfig.Tables.STOCKS,
+        fields=", ".join(columns),
+        placeholders=", ".join("?" * len(columns)),
+        conflict=F.SYMBOL,
+        updates=StorageConfig.SQLTemplates.excluded_updates(columns[1:])
+        + f", {F.UPDATED_AT} = CURRENT_TIMESTAMP",
+    )
+
+
+def _build_stock_placeholder_sql() -> str:
+    """stocks 占位记录 INSERT OR IGNORE（updated_at 取列默认值）"""
+    F = StorageConfig.Fields
+    return StorageConfig.SQLTemplates.INSERT_OR_IGNORE.format(
+        table=StorageConfig.Tables.STOCKS,
+        fields=f"{F.SYMBOL}, {F.Stocks.COMPANY_NAME}, {F.Stocks.SECTOR}, {F.Stocks.INDUSTRY}, {F.Stocks.MARKET_CAP}, {F.Stocks.EMPLOYEES}, {F.Stocks.DESCRIPTION}",
+        placeholders="?, ?, ?, ?, ?, ?, ?",
+    )
+
+
+def _build_statement_upsert_sql(table_name: str) -> str:
+    """财务报表指标 upsert：created_at 取列默认值，冲突时只更新数值"""
+    F = StorageConfig.Fields
+    FS = F.FinancialStatement
+    return StorageConfig.SQLTemplates.UPSERT.format(
+        table=table_name,
+        fields=f"{F.SYMBOL}, {FS.PERIOD}, {FS.METRIC_NAME}, {FS.METRIC_VALUE}",
+        placeholders="?, ?, ?, ?",
+        conflict=f"{F.SYMBOL}, {FS.PERIOD}, {FS.METRIC_NAME}",
+        updates=StorageConfig.SQLTemplates.excluded_updates([FS.METRIC_VALUE]),
+    )
+
+
+def _build_key_metrics_upsert_sql(columns: List[str]) -> str:
+    """关键指标宽表 upsert：仅更新给定列，updated_at 由 SQLite 生成"""
+    F = StorageConfig.Fields
+    fields = [F.SYMBOL, F.KeyMetrics.PERIOD, *columns]
+    return StorageConfig.SQLTemplates.UPSERT.format(
+        table=StorageConfig.Tables.FINANCIAL_KEY_METRICS,
+        fields=", ".join(fields),
+        placeholders=", ".join("?" * len(fields)),
+        conflict=f"{F.SYMBOL}, {F.KeyMetrics.PERIOD}",
+        updates=StorageConfig.SQLTemplates.excluded_updates(columns)
+        + f", {F.UPDATED_AT} = CURRENT_TIMESTAMP",
+    )
+
+
+def _build_download_log_insert_sql() -> str:
+    """下载日志插入语句"""
+    F = StorageConfig.Fields
+    DL = F.DownloadLogs
+    return StorageConfig.SQLTemplates.INSERT_OR_REPLACE.format(
+        table=StorageConfig.Tables.DOWNLOAD_LOGS,
+        fields=f"{F.SYMBOL}, {DL.DOWNLOAD_TYPE}, {DL.STATUS}, {DL.DATA_POINTS}, {DL.ERROR_MESSAGE}, {DL.DETAILS}, {DL.DOWNLOAD_TIMESTAMP}",
+        placeholders="?, ?, ?, ?, ?, ?, ?",
+    )
+
+
+def _build_price_lookup_sql(price_column: str, mode: str) -> str:
+    """
+    单只股票的价格点查询
+
+    mode: "on" 取指定日期；"before" 取截至指定日期（含）最近一条；"latest" 取最新一条
+    """
+    F = StorageConfig.Fields
+    T = StorageConfig.Tables.STOCK_PRICES
+    if mode == "on":
+        return f"SELECT {price_column} FROM {T} WHERE {F.SYMBOL} = ? AND {F.StockPrices.DATE} = ?"
+    before = f" AND {F.StockPrices.DATE} <= ?" if mode == "before" else ""
+    return (
+        f"SELECT {F.StockPrices.DATE}, {price_column} FROM {T} "
+        f"WHERE {F.SYMBOL} = ?{before} ORDER BY {F.StockPrices.DATE} DESC LIMIT 1"
+    )
+
+
+def _build_daily_realized_pnl_sql() -> str:
+    """单只股票单日已实现盈亏合计（卖出分配 -> 批次 -> 卖出交易）"""
+    F = StorageConfig.Fields
+    T = StorageConfig.Tables
+    return (
+        f"SELECT SUM(sa.{F.SaleAllocations.REALIZED_PNL}) "
+        f"FROM {T.SALE_ALLOCATIONS} sa "
+        f"JOIN {T.POSITION_LOTS} pl ON sa.{F.SaleAllocations.LOT_ID} = pl.{F.PositionLots.ID} "
+        f"JOIN {T.TRANSACTIONS} t ON sa.{F.SaleAllocations.SALE_TRANSACTION_ID} = t.{F.Transactions.ID} "
+        f"WHERE pl.{F.SYMBOL} = ? AND t.{F.Transactions.TRANSACTION_DATE} = ?"
+    )
+
+
+# 热路径写入语句在模块加载时构建一次，每次调用传入同一字符串对象，
+# 直接命中 sqlite3 连接的预编译语句缓存，省去逐次拼接
+_SQL_UPSERT_BASIC_INFO = _build_basic_info_upsert_sql()
+_SQL_INSERT_STOCK_PLACEHOLDER = _build_stock_placeholder_sql()
+_SQL_UPSERT_STATEMENT = {
+    stmt_type: _build_statement_upsert_sql(table_name)
+    for stmt_type, table_name in StorageConfig.Tables.get_financial_tables().items()
+}
+_SQL_UPSERT_KEY_METRICS = {
+    stmt_type: _build_key_metrics_upsert_sql(list(aliases))
+    for stmt_type, aliases in StorageConfig.KeyMetrics.get_aliases().items()
+}
+_SQL_INSERT_DOWNLOAD_LOG = _build_download_log_insert_sql()
+_SQL_REFRESH_PRICE_STATS = _build_price_stats_refresh_sql(by_symbol=True)
+_SQL_REBUILD_PRICE_STATS = _build_price_stats_refresh_sql(by_symbol=False)
+# 盈亏计算逐日调用的点查询同样预构建，按价格字段名索引
+_SQL_PRICE_LOOKUP = {
+    mode: {
+        price_field: _build_price_lookup_sql(column, mode)
+        for price_field, column in StorageConfig.get_price_field_mapping().items()
+    }
+    for mode in ("on", "before", "latest")
+}
+_SQL_DAILY_REALIZED_PNL = _build_daily_realized_pnl_sql()
+
+
+def _dumps_json(obj: Any) -> str:
+    """序列化为紧凑 JSON 字符串：优先使用 orjson（可直接处理 datetime/numpy 标量），否则回退 json"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+            ).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+# 科目名中的弯引号统一为直引号
+_QUOTE_TRANSLATION = str.maketrans({"\u2018": "'", "\u2019": "'", "\u201c": '"', "\u201d": '"'})
+
+
+# 已连接的存储实例（弱引用）；进程退出时由唯一的 atexit 钩子统一写出缓冲日志
+_LIVE_STORAGES: "weakref.WeakSet[SQLiteStorage]" = weakref.WeakSet()
+
+
+def _flush_logs_at_exit() -> None:
+    """进程退出时写出各存储实例仍在缓冲区中的下载日志"""
+    for storage in list(_LIVE_STORAGES):
+        try:
+            storage._flush_logs()
+        except sqlite3.Error:
+            pass
+
+
+atexit.register(_flush_logs_at_exit)
+
+
+def _serialized(method: Callable[..., _T]) -> Callable[..., _T]:
+    """
+    在存储实例的写锁内执行方法，串行化共享主连接上的写入
+
+    所有在主连接上写入的方法都应经由本装饰器或 transaction()，写锁可重入，
+    在事务内调用时直接复用已持有的锁。
+    """
+
+    @functools.wraps(method)
+    def wrapper(self: "SQLiteStorage", *args: Any, **kwargs: Any) -> _T:
+        with self._write_lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 class SQLiteStorage(BaseStorage):
     """SQLite 存储实现"""
 
-    def __init__(self, db_path: str = "database/stock_data.db"):
+    # IN 子句单次绑定的参数上限（低于 SQLITE_MAX_VARIABLE_NUMBER 的旧版默认值 999）
+    IN_CLAUSE_CHUNK_SIZE = 500
+    # 长会话中两次 PRAGMA optimize 之间的最小间隔（秒）
+    OPTIMIZE_INTERVAL_SECONDS = 4 * 60 * 60
+    # 下载日志缓冲达到该条数时批量写入（失败日志总是立即写入）
+    LOG_FLUSH_THRESHOLD = 128
+    # 多行 upsert 每条语句写入的价格行数（绑定参数总数不超过 IN_CLAUSE_CHUNK_SIZE）
+    PRICE_ROWS_PER_INSERT = IN_CLAUSE_CHUNK_SIZE // len(_PRICE_FIELDS)
+    # 每个连接的预编译语句缓存容量（sqlite3 默认 128）
+    STATEMENT_CACHE_SIZE = 256
+
+    def __init__(
+        self,
+        db_path: str = "database/stock_data.db",
+        synchronous: str = StorageConfig.Pragmas.SYNCHRONOUS,
+        mmap_size: int = StorageConfig.Pragmas.MMAP_SIZE,
+    ):
         """
         初始化 SQLite 存储
 
+        连接使用 WAL 日志模式，会在 db_path 旁生成 `-wal` / `-shm` 附属文件
+
         Args:
             db_path: 数据库文件路径
+            synchronous: PRAGMA synchronous 级别（OFF/NORMAL/FULL/EXTRA），默认 NORMAL
+            mmap_size: PRAGMA mmap_size 字节数，默认 256 MiB；0 表示关闭内存映射 I/O
         """
+        synchronous = synchronous.upper()
+        if synchronous not in StorageConfig.Pragmas.SYNCHRONOUS_LEVELS:
+            raise ValueError(f"无效的 synchronous 级别: {synchronous}")
+        if mmap_size < 0:
+            raise ValueError(f"无效的 mmap_size: {mmap_size}")
+
         self.db_path = db_path
+        self.synchronous = synchronous
+        self.mmap_size = mmap_size
         self.connection: Optional[sqlite3.Connection] = None
         self.cursor: Optional[sqlite3.Cursor] = None
         self.logger = logging.getLogger(__name__)
@@ -47,6 +324,26 @@ class SQLiteStorage(BaseStorage):
         self.query_manager: Optional[SQLiteQueryManager] = None
         # 事务深度：用于区分用户级事务与内部隐式事务
         self._txn_depth: int = 0
+        # 最近一次 PRAGMA optimize 的时间（time.monotonic）
+        self._last_optimize_ts: float = 0.0
+        # 写入串行化：共享主连接上的写路径与事务互斥（可重入，允许嵌套事务）
+        self._write_lock = threading.RLock()
+        # 创建主连接的线程；其他线程的读取走各自的只读连接
+        self._owner_thread_id: Optional[int] = None
+        self._local = threading.local()
+        self._reader_connections: List[sqlite3.Connection] = []
+        # 每次 connect() 递增，使旧的线程本地连接失效
+        self._connection_generation: int = 0
+        # 已确认存在于 stocks 表的代码（首次使用时从数据库加载，回滚后失效重载）
+        self._known_symbols: Optional[Set[str]] = None
+        # 待写入的下载日志行，批量 executemany 以减少逐条插入
+        self._log_buffer: List[Tuple[Any, ...]] = []
+        # 事务内请求的日志写入推迟到最外层事务结束后执行
+        self._log_flush_pending: bool = False
+        # 预构建的卖出分配查询语句，按 (是否按symbol过滤, 是否按交易ID过滤) 索引
+        self._sale_allocations_sql: Dict[Tuple[bool, bool], str] = (
+            self._build_sale_allocations_sql()
+        )
         
         self.connect()
 
@@ -59,27 +356,24 @@ class SQLiteStorage(BaseStorage):
                 dbp.parent.mkdir(parents=True, exist_ok=True)
 
             # 建立连接
-            self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
-            self.connection.execute("PRAGMA foreign_keys = ON")
+            self.connection = self._open_connection()
             self.cursor = self.connection.cursor()
+            self._owner_thread_id = threading.get_ident()
+            self._connection_generation += 1
+            self._known_symbols = None
+            _LIVE_STORAGES.add(self)
+            self._check_journal_mode()
             
             # 初始化管理器
             self.schema_manager = SQLiteSchemaManager(self.connection, self.cursor)
             self.query_manager = SQLiteQueryManager(self.connection, self.cursor)
 
-            # 初始化表结构
-            if not self.schema_manager.schema_exists():
-                self.schema_manager.create_tables()
-            
-            # 确保交易相关表存在（幂等操作）
-            self.schema_manager.ensure_trading_tables()
-            
-            # 确保批次追踪表存在（幂等操作）
-            self.schema_manager.ensure_lot_tracking_tables()
+            # 架构版本已是最新时跳过全部建表/索引探测
+            if self.schema_manager.get_schema_version() < self.config.SCHEMA_VERSION:
+                self._ensure_schema()
 
-            # 创建交易和批次追踪相关索引
-            for index_sql in self.config.get_trading_and_lot_indexes():
-                self.cursor.execute(index_sql)
+            # 刷新查询规划器统计信息（稳态下为空操作）
+            self._optimize()
 
             self.logger.info(f"📁 SQLite 数据库连接成功: {self.db_path}")
 
@@ -87,9 +381,104 @@ class SQLiteStorage(BaseStorage):
             self.logger.error(f"❌ SQLite 数据库连接失败: {e}")
             raise StorageError(f"Failed to connect to SQLite database: {e}", "connect")
 
+    def _check_journal_mode(self) -> None:
+        """回读 journal_mode，确认 WAL 已生效（内存库固定为 memory 模式，跳过）"""
+        if self.db_path == ":memory:":
+            return
+        journal_mode = self.connection.execute("PRAGMA journal_mode").fetchone()[0]
+        if journal_mode.upper() != self.config.Pragmas.JOURNAL_MODE:
+            # 例如网络文件系统不支持 WAL 所需的共享内存，SQLite 会保留原日志模式
+            self.logger.warning(
+                f"⚠️ 未能启用 {self.config.Pragmas.JOURNAL_MODE} 日志模式，当前为 {journal_mode}"
+            )
+        else:
+            self.logger.debug(f"journal_mode = {journal_mode}")
+
+    def _ensure_schema(self) -> None:
+        """创建或升级表结构与索引（幂等），完成后记录当前架构版本"""
+        # 初始化表结构
+        if not self.schema_manager.schema_exists():
+            self.schema_manager.create_tables()
+        else:
+            # 已有数据库：补建新增的核心表，再同步索引定义
+            self.schema_manager.ensure_core_tables()
+            self.schema_manager.ensure_core_indexes()
+        
+        # 确保交易相关表存在（幂等操作）
+        self.schema_manager.ensure_trading_tables()
+        
+        # 确保批次追踪表存在（幂等操作）
+        self.schema_manager.ensure_lot_tracking_tables()
+
+        # 创建交易和批次追踪相关索引
+        for index_sql in self.config.get_trading_and_lot_indexes():
+            self.cursor.execute(index_sql)
+
+        # 由已有价格数据重建全历史聚合（升级前写入的数据也随之补齐）
+        self.cursor.execute(_SQL_REBUILD_PRICE_STATS)
+
+        self.schema_manager.set_schema_version(self.config.SCHEMA_VERSION)
+        self.connection.commit()
+
+    def _open_connection(self, query_only: bool = False) -> sqlite3.Connection:
+        """
+        打开一个应用了连接级 PRAGMA 的新连接
+
+        Args:
+            query_only: 是否为只读连接（以 mode=ro 打开，并设置 PRAGMA query_only）
+        """
+        if query_only:
+            # 只读 URI：不会创建数据库文件，也不会尝试获取写锁
+            database, uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro", True
+        else:
+            database, uri = self.db_path, False
+        connection = sqlite3.connect(
+            database,
+            check_same_thread=False,
+            cached_statements=self.STATEMENT_CACHE_SIZE,
+            uri=uri,
+        )
+        connection.execute("PRAGMA foreign_keys = ON")
+        for pragma_sql in self.config.Pragmas.get_connection_pragmas(
+            self.synchronous, self.mmap_size
+        ):
+            connection.execute(pragma_sql)
+        if query_only:
+            connection.execute("PRAGMA query_only = ON")
+        return connection
+
+    def _get_query_manager(self) -> Optional[SQLiteQueryManager]:
+        """
+        获取当前线程使用的查询管理器
+
+        创建主连接的线程（以及内存数据库）直接复用主连接；其他线程懒加载各自的
+        只读连接，在 WAL 模式下与写入并发执行，不再争用同一个连接。
+        """
+        if not self.query_manager:
+            return None
+        if threading.get_ident() == self._owner_thread_id or self.db_path == ":memory:":
+            return self.query_manager
+
+        local = self._local
+        if getattr(local, "generation", None) != self._connection_generation:
+            connection = self._open_connection(query_only=True)
+            with self._write_lock:
+                self._reader_connections.append(connection)
+            local.query_manager = SQLiteQueryManager(connection, connection.cursor())
+            local.generation = self._connection_generation
+        return local.query_manager
+
     def disconnect(self) -> None:
         """关闭数据库连接"""
+        with self._write_lock:
+            if self.connection:
+                self._flush_logs()
+            _LIVE_STORAGES.discard(self)
+            for connection in self._reader_connections:
+                connection.close()
+            self._reader_connections.clear()
         if self.connection:
+            self._optimize()
             self.connection.close()
             self.logger.info("📴 SQLite 数据库连接已关闭")
 
@@ -104,6 +493,19 @@ class SQLiteStorage(BaseStorage):
                 f"Database connection not available for {operation_name}", operation_name
             )
     
+    def _optimize(self) -> None:
+        """执行 PRAGMA optimize，失败时仅记录日志"""
+        try:
+            self.connection.execute("PRAGMA optimize")
+        except sqlite3.Error as e:
+            self.logger.debug(f"PRAGMA optimize 执行失败: {e}")
+        self._last_optimize_ts = time.monotonic()
+
+    def _maybe_optimize(self) -> None:
+        """长会话中按固定间隔执行 PRAGMA optimize"""
+        if time.monotonic() - self._last_optimize_ts >= self.OPTIMIZE_INTERVAL_SECONDS:
+            self._optimize()
+
     def _maybe_commit(self) -> None:
         """
         智能提交：仅在不处于事务中时才提交
@@ -115,104 +517,124 @@ class SQLiteStorage(BaseStorage):
 
     # =================== 数据存储方法 ===================
     
+    @_serialized
     def store_stock_data(self, symbol: str, stock_data: Union[StockData, Dict]) -> bool:
         """存储股票数据"""
         self._check_connection("store_stock_data")
         try:
-            if isinstance(stock_data, StockData):
-                # 确保股票记录存在
-                basic_info = getattr(stock_data, 'basic_info', None)
-                if basic_info:
-                    self._store_basic_info(symbol, basic_info)
-                else:
-                    self.ensure_stock_exists(symbol)
-
-                # 存储价格数据
-                self._store_price_data_batch(symbol, stock_data.price_data)
-
-            elif isinstance(stock_data, dict):
-                # 从字典存储
-                if 'basic_info' in stock_data:
-                    self._store_basic_info(symbol, stock_data['basic_info'])
-                else:
-                    self.ensure_stock_exists(symbol)
-
-                if 'price_data' in stock_data:
-                    price_data = PriceData.from_dict(stock_data['price_data'])
-                    self._store_price_data_batch(symbol, price_data)
-
-            # 记录下载日志
-            self._log_download(
-                symbol,
-                "stock",
-                "success",
-                (
-                    getattr(stock_data, 'data_points', 0)
-                    if hasattr(stock_data, 'data_points')
-                    else (stock_data.get('data_points', 0) if isinstance(stock_data, dict) else 0)
-                ),
-            )
+            with self.transaction(immediate=True):
+                if isinstance(stock_data, StockData):
+                    # 确保股票记录存在
+                    basic_info = getattr(stock_data, 'basic_info', None)
+                    if basic_info:
+                        self._store_basic_info(symbol, basic_info)
+                    else:
+                        self.ensure_stock_exists(symbol)
+
+                    # 存储价格数据
+                    self._store_price_data_batch(symbol, stock_data.price_data)
+
+                elif isinstance(stock_data, dict):
+                    # 从字典存储
+                    if 'basic_info' in stock_data:
+                        self._store_basic_info(symbol, stock_data['basic_info'])
+                    else:
+                        self.ensure_stock_exists(symbol)
+
+                    if 'price_data' in stock_data:
+                        price_data = PriceData.from_dict(stock_data['price_data'])
+                        self._store_price_data_batch(symbol, price_data)
+
+                # 记录下载日志
+                self._log_download(
+                    symbol,
+                    "stock",
+                    "success",
+                    (
+                        getattr(stock_data, 'data_points', 0)
+                        if hasattr(stock_data, 'data_points')
+                        else (
+                            stock_data.get('data_points', 0) if isinstance(stock_data, dict) else 0
+                        )
+                    ),
+                )
 
             return True
 
         except Exception as e:
             self.logger.error(f"❌ 存储股票数据失败 {symbol}: {e}")
-            self._log_download(symbol, "stock", "failed", 0, str(e))
+            # 整批写入已回滚，失败日志依赖的 stocks 记录需要重新补上；
+            # 原错误可能是锁等待超时或连接已关闭，补写同样可能失败，不得再向外抛出
+            try:
+                self.ensure_stock_exists(symbol)
+                self._log_download(symbol, "stock", "failed", 0, str(e))
+            except Exception as log_error:
+                self.logger.error(f"❌ 记录下载失败日志失败 {symbol}: {log_error}")
             return False
 
+    @_serialized
     def store_financial_data(self, symbol: str, financial_data: Union[FinancialData, Dict]) -> bool:
         """存储财务数据"""
         self._check_connection("store_financial_data")
         try:
-            if isinstance(financial_data, FinancialData):
-                # 存储基本信息
-                self._store_basic_info(symbol, financial_data.basic_info)
-
-                # 存储财务报表
-                for stmt_type, statement in financial_data.financial_statements.items():
-                    self._store_financial_statement(symbol, stmt_type, statement)
-
-            elif isinstance(financial_data, dict):
-                if 'basic_info' in financial_data:
-                    self._store_basic_info(symbol, financial_data['basic_info'])
-
-                if 'financial_statements' in financial_data:
-                    for stmt_type, stmt_data in financial_data['financial_statements'].items():
-                        if 'error' not in stmt_data:
-                            statement = FinancialStatement.from_dict(stmt_data)
-                            self._store_financial_statement(symbol, stmt_type, statement)
-
-            # 记录下载日志
-            stmt_count = (
-                len(getattr(financial_data, 'financial_statements', {}))
-                if hasattr(financial_data, 'financial_statements')
-                else len(financial_data.get('financial_statements', {}))
-            )
-            self._log_download(symbol, "financial", "success", stmt_count)
+            with self.transaction(immediate=True):
+                if isinstance(financial_data, FinancialData):
+                    # 存储基本信息
+                    self._store_basic_info(symbol, financial_data.basic_info)
+
+                    # 存储财务报表
+                    for stmt_type, statement in financial_data.financial_statements.items():
+                        self._store_financial_statement(symbol, stmt_type, statement)
+
+                elif isinstance(financial_data, dict):
+                    if 'basic_info' in financial_data:
+                        self._store_basic_info(symbol, financial_data['basic_info'])
+
+                    if 'financial_statements' in financial_data:
+                        for stmt_type, stmt_data in financial_data['financial_statements'].items():
+                            if 'error' not in stmt_data:
+                                statement = FinancialStatement.from_dict(stmt_data)
+                                self._store_financial_statement(symbol, stmt_type, statement)
+
+                # 记录下载日志
+                stmt_count = (
+                    len(getattr(financial_data, 'financial_statements', {}))
+                    if hasattr(financial_data, 'financial_statements')
+                    else len(financial_data.get('financial_statements', {}))
+                )
+                self._log_download(symbol, "financial", "success", stmt_count)
 
             return True
 
         except Exception as e:
             self.logger.error(f"❌ 存储财务数据失败 {symbol}: {e}")
-            self._log_download(symbol, "financial", "failed", 0, str(e))
+            # 整批写入已回滚，失败日志依赖的 stocks 记录需要重新补上；
+            # 原错误可能是锁等待超时或连接已关闭，补写同样可能失败，不得再向外抛出
+            try:
+                self.ensure_stock_exists(symbol)
+                self._log_download(symbol, "financial", "failed", 0, str(e))
+            except Exception as log_error:
+                self.logger.error(f"❌ 记录下载失败日志失败 {symbol}: {log_error}")
             return False
 
+    @_serialized
     def store_data_quality(self, symbol: str, quality_data: Union[DataQuality, Dict]) -> bool:
         """将数据质量评估作为下载日志的一部分进行记录"""
         try:
-            if isinstance(quality_data, DataQuality):
-                details = quality_data.to_dict()
-            else:
-                details = quality_data
-
-            self._log_download(
-                symbol=symbol,
-                download_type="quality",
-                status="success",
-                data_points=0,
-                error_message=None,
-                details=details,
-            )
+            with self.transaction(immediate=True):
+                if isinstance(quality_data, DataQuality):
+                    details = quality_data.to_dict()
+                else:
+                    details = quality_data
+
+                self._log_download(
+                    symbol=symbol,
+                    download_type="quality",
+                    status="success",
+                    data_points=0,
+                    error_message=None,
+                    details=details,
+                )
             return True
         except Exception as e:
             self.logger.error(f"❌ 记录数据质量评估失败 {symbol}: {e}")
@@ -228,44 +650,89 @@ class SQLiteStorage(BaseStorage):
         self, symbol: str, start_date: Optional[str] = None, end_date: Optional[str] = None
     ) -> Optional[StockData]:
         """获取股票数据"""
-        if not self.query_manager:
+        query_manager = self._get_query_manager()
+        if not query_manager:
             return None
-        return self.query_manager.get_stock_data(symbol, start_date, end_date)
+        return query_manager.get_stock_data(symbol, start_date, end_date)
+
+    def get_price_df(
+        self, symbol: str, start_date: Optional[str] = None, end_date: Optional[str] = None
+    ) -> Optional[pd.DataFrame]:
+        """获取逐日价格 DataFrame（不构造 PriceData，也不计算统计量）"""
+        query_manager = self._get_query_manager()
+        if not query_manager:
+            return None
+        return query_manager.get_price_df(symbol, start_date, end_date)
+
+    def get_price_summary(
+        self, symbol: str, start_date: Optional[str] = None, end_date: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """获取价格区间摘要（仅聚合统计，不加载逐日数据）"""
+        query_manager = self._get_query_manager()
+        if not query_manager:
+            return None
+        return query_manager.get_price_summary(symbol, start_date, end_date)
+
+    def iter_prices(
+        self,
+        symbol: str,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        chunk_size: int = 1000,
+    ) -> Iterator[List[Tuple]]:
+        """分块迭代逐日价格元组（批量导出用，不构造 DataFrame）"""
+        query_manager = self._get_query_manager()
+        if not query_manager:
+            return iter(())
+        return query_manager.iter_prices(symbol, start_date, end_date, chunk_size)
 
     def get_financial_data(self, symbol: str) -> Optional[FinancialData]:
         """获取财务数据"""
-        if not self.query_manager:
+        query_manager = self._get_query_manager()
+        if not query_manager:
+            return None
+        return query_manager.get_financial_data(symbol)
+
+    def get_key_metrics(self, symbol: str) -> Optional[pd.DataFrame]:
+        """获取关键财务指标宽表数据（按报告期降序）"""
+        query_manager = self._get_query_manager()
+        if not query_manager:
             return None
-        return self.query_manager.get_financial_data(symbol)
+        return query_manager.get_key_metrics(symbol)
 
     def get_financial_metrics(
         self, symbol: str, statement_type: str, start_period: Optional[str] = None, end_period: Optional[str] = None
-    ) -> Optional:
+    ) -> Optional[pd.DataFrame]:
         """获取财务指标数据"""
-        if not self.query_manager:
+        query_manager = self._get_query_manager()
+        if not query_manager:
             return None
-        return self.query_manager.get_financial_metrics(symbol, statement_type, start_period, end_period)
+        return query_manager.get_financial_metrics(symbol, statement_type, start_period, end_period)
 
     def get_last_update_date(self, symbol: str) -> Optional[str]:
         """获取最后更新日期"""
-        if not self.query_manager:
+        query_manager = self._get_query_manager()
+        if not query_manager:
             return None
-        return self.query_manager.get_last_update_date(symbol)
+        return query_manager.get_last_update_date(symbol)
 
     def get_last_financial_period(self, symbol: str) -> Optional[str]:
         """获取最近财务期间"""
-        if not self.query_manager:
+        query_manager = self._get_query_manager()
+        if not query_manager:
             return None
-        return self.query_manager.get_last_financial_period(symbol)
+        return query_manager.get_last_financial_period(symbol)
 
     def get_existing_symbols(self) -> List[str]:
         """获取已存储的股票代码列表"""
-        if not self.query_manager:
+        query_manager = self._get_query_manager()
+        if not query_manager:
             return []
-        return self.query_manager.get_existing_symbols()
+        return query_manager.get_existing_symbols()
 
     # =================== 私有辅助方法 ===================
 
+    @_serialized
     def _store_basic_info(self, symbol: str, basic_info: Union[BasicInfo, Dict]) -> None:
         """存储股票基本信息"""
         self._check_connection("_store_basic_info")
@@ -274,20 +741,9 @@ class SQLiteStorage(BaseStorage):
         else:
             data = basic_info
 
-        T = self.config.Tables.STOCKS
-        F = self.config.Fields
-        
-        fields = f"{F.SYMBOL}, {F.Stocks.COMPANY_NAME}, {F.Stocks.SECTOR}, {F.Stocks.INDUSTRY}, {F.Stocks.MARKET_CAP}, {F.Stocks.EMPLOYEES}, {F.Stocks.DESCRIPTION}, {F.UPDATED_AT}"
-        placeholders = "?, ?, ?, ?, ?, ?, ?, ?"
-        
-        sql = self.config.SQLTemplates.INSERT_OR_REPLACE.format(
-            table=T,
-            fields=fields,
-            placeholders=placeholders
-        )
-
+        # upsert 原地更新，避免 REPLACE 删除被 position_lots 等表 RESTRICT 引用的行
         self.cursor.execute(
-            sql,
+            _SQL_UPSERT_BASIC_INFO,
             (
                 symbol,
                 data.get('company_name', ''),
@@ -296,85 +752,115 @@ class SQLiteStorage(BaseStorage):
                 data.get('market_cap', 0),
                 data.get('employees', 0),
                 data.get('description', ''),
-                datetime.now().isoformat(),
             ),
         )
+        if self._known_symbols is not None:
+            self._known_symbols.add(symbol)
         self._maybe_commit()
 
 
+    @_serialized
     def _store_price_data_batch(self, symbol: str, price_data: PriceData) -> None:
         """批量存储价格数据"""
         self._check_connection("_store_price_data_batch")
         
-        T = self.config.Tables.STOCK_PRICES
-        F = self.config.Fields
-        
-        fields = f"{F.SYMBOL}, {F.StockPrices.DATE}, {F.StockPrices.OPEN}, {F.StockPrices.HIGH}, {F.StockPrices.LOW}, {F.StockPrices.CLOSE}, {F.StockPrices.VOLUME}, {F.StockPrices.ADJ_CLOSE}"
-        placeholders = "?, ?, ?, ?, ?, ?, ?, ?"
-        
-        sql = self.config.SQLTemplates.INSERT_OR_REPLACE.format(
-            table=T,
-            fields=fields,
-            placeholders=placeholders
-        )
-        
-        # 准备批量数据
-        data = [
-            (symbol, price_data.dates[i], price_data.open[i], price_data.high[i],
-             price_data.low[i], price_data.close[i], price_data.volume[i], price_data.adj_close[i])
-            for i in range(len(price_data.dates))
+        # 按列拼接行元组，再按块展开为多行 VALUES 的绑定参数；
+        # numpy / pandas 列先整列转换为 Python 标量（np.int64 等无法被 sqlite3 绑定）
+        columns = [
+            price_data.dates,
+            price_data.open,
+            price_data.high,
+            price_data.low,
+            price_data.close,
+            price_data.volume,
+            price_data.adj_close,
         ]
+        rows = zip(
+            repeat(symbol),
+            *(column.tolist() if hasattr(column, "tolist") else column for column in columns),
+        )
         
-        # 批量插入
-        self.cursor.executemany(sql, data)
+        # 多行 upsert：每条语句写入一整块，比逐行 executemany 少一个数量级的语句执行
+        chunk_size = self.PRICE_ROWS_PER_INSERT
+        full_chunk_sql = _build_price_insert_sql(chunk_size)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            sql = full_chunk_sql if len(chunk) == chunk_size else _build_price_insert_sql(len(chunk))
+            self.cursor.execute(sql, list(chain.from_iterable(chunk)))
+        
+        # 同一事务内刷新该 symbol 的全历史聚合，读取摘要时无需再扫描价格表
+        self.cursor.execute(_SQL_REFRESH_PRICE_STATS, (symbol,))
         self._maybe_commit()
 
+    @_serialized
     def _store_financial_statement(
         self, symbol: str, stmt_type: str, statement: FinancialStatement
     ) -> None:
         """存储财务报表"""
         self._check_connection("_store_financial_statement")
-        for period in statement.periods:
-            # 获取该期间的数据
-            period_data = {}
-            for item_name, values in statement.items.items():
-                try:
-                    period_index = statement.periods.index(period)
-                    if period_index < len(values):
-                        period_data[item_name] = values[period_index]
-                except (ValueError, IndexError):
-                    period_data[item_name] = None
-
-            # 存储到独立的报表表
-            self._store_to_statement_table(stmt_type, symbol, period, period_data)
+        # 单次遍历 指标 × 报告期，直接生成非空行（values 按报告期位置对齐）
+        rows = [
+            (symbol, period, item_name, value)
+            for item_name, values in statement.items.items()
+            for period, value in zip(statement.periods, values)
+            if value is not None
+        ]
 
+        # 存储到独立的报表表，并同步关键指标宽表
+        self._store_to_statement_table(stmt_type, rows)
+        self._store_key_metrics(symbol, stmt_type, statement)
         self._maybe_commit()
 
+    def _store_key_metrics(self, symbol: str, stmt_type: str, statement: FinancialStatement) -> None:
+        """将报表中的关键科目投影到宽表，每个报告期一行（仅更新本报表类型负责的列）"""
+        aliases = self.config.KeyMetrics.get_aliases().get(stmt_type)
+        if not aliases:
+            return
+
+        # 统一弯引号，与分析层读取时的科目名规范化保持一致
+        items = {
+            name.translate(_QUOTE_TRANSLATION): values for name, values in statement.items.items()
+        }
+        columns = list(aliases)
+
+        rows = []
+        for i, period in enumerate(statement.periods):
+            row_values = []
+            for column in columns:
+                value = None
+                for label in aliases[column]:
+                    values = items.get(label)
+                    if values is not None and i < len(values) and values[i] is not None:
+                        value = values[i]
+                        break
+                row_values.append(value)
+            if any(value is not None for value in row_values):
+                rows.append((symbol, period, *row_values))
+
+        if not rows:
+            return
+
+        self.cursor.executemany(_SQL_UPSERT_KEY_METRICS[stmt_type], rows)
+
     def _store_to_statement_table(
-        self, stmt_type: str, symbol: str, period: str, metrics: Dict[str, Optional[float]]
+        self, stmt_type: str, rows: List[Tuple[str, str, str, float]]
     ) -> None:
-        """存储财务指标到对应的独立报表表中"""
+        """
+        存储财务指标到对应的独立报表表中
+
+        Args:
+            stmt_type: 报表类型
+            rows: (symbol, period, metric_name, metric_value) 行列表
+        """
         self._check_connection("_store_to_statement_table")
         
-        # 使用配置类获取表名
-        table_name = self.config.get_table_for_statement_type(stmt_type)
-        F = self.config.Fields
-        
-        fields = f"{F.SYMBOL}, {F.FinancialStatement.PERIOD}, {F.FinancialStatement.METRIC_NAME}, {F.FinancialStatement.METRIC_VALUE}, {F.CREATED_AT}"
-        placeholders = "?, ?, ?, ?, ?"
+        sql = _SQL_UPSERT_STATEMENT.get(stmt_type)
+        if sql is None:
+            raise ValueError(f"未知的报表类型: {stmt_type}")
         
-        sql = self.config.SQLTemplates.INSERT_OR_REPLACE.format(
-            table=table_name,
-            fields=fields,
-            placeholders=placeholders
-        )
-
-        for metric_name, metric_value in metrics.items():
-            if metric_value is not None:
-                self.cursor.execute(
-                    sql,
-                    (symbol, period, metric_name, metric_value, datetime.now().isoformat()),
-                )
+        self.cursor.executemany(sql, rows)
 
     def _log_download(
         self,
@@ -385,35 +871,55 @@ class SQLiteStorage(BaseStorage):
         error_message: Optional[str] = None,
         details: Optional[Dict[str, Any]] = None,
     ) -> None:
-        """记录下载日志"""
+        """
+        记录下载日志
+
+        日志先进入缓冲区，累计到 LOG_FLUSH_THRESHOLD 条或出现失败日志时批量写入
+        （处于事务内时推迟到最外层事务提交或回滚之后）；关闭连接和进程退出时也会写出剩余日志。
+        """
         self._check_connection("_log_download")
         
-        T = self.config.Tables.DOWNLOAD_LOGS
-        F = self.config.Fields
-        
-        fields = f"{F.SYMBOL}, {F.DownloadLogs.DOWNLOAD_TYPE}, {F.DownloadLogs.STATUS}, {F.DownloadLogs.DATA_POINTS}, {F.DownloadLogs.ERROR_MESSAGE}, {F.DownloadLogs.DETAILS}"
-        placeholders = "?, ?, ?, ?, ?, ?"
-        
-        sql = self.config.SQLTemplates.INSERT_OR_REPLACE.format(
-            table=T,
-            fields=fields,
-            placeholders=placeholders
-        )
-        
-        details_json = json.dumps(details, ensure_ascii=False) if details else None
+        details_json = _dumps_json(details) if details else None
+        # 记录入缓冲时的时间，与列默认值 CURRENT_TIMESTAMP 格式一致（UTC）
+        logged_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
         
-        self.cursor.execute(
-            sql,
-            (symbol, download_type, status, data_points, error_message, details_json),
-        )
-        self._maybe_commit()
+        with self._write_lock:
+            self._log_buffer.append(
+                (symbol, download_type, status, data_points, error_message, details_json, logged_at)
+            )
+            if status == "failed" or len(self._log_buffer) >= self.LOG_FLUSH_THRESHOLD:
+                self._flush_logs()
+        self._maybe_optimize()
+
+    def _flush_logs(self) -> None:
+        """将缓冲的下载日志一次性写入 download_logs"""
+        with self._write_lock:
+            if not self._log_buffer:
+                return
+            if self._txn_depth > 0:
+                # 在事务内写入会随外层事务一起回滚（失败日志也会丢失），推迟到事务结束后
+                self._log_flush_pending = True
+                return
+            
+            self.cursor.executemany(_SQL_INSERT_DOWNLOAD_LOG, self._log_buffer)
+            self._log_buffer.clear()
+            self._log_flush_pending = False
+            self._maybe_commit()
 
     # ============= 事务管理 =============
     
     @contextmanager
-    def transaction(self):
-        """事务上下文管理器，支持嵌套（基于 SAVEPOINT）"""
+    def transaction(self, immediate: bool = False):
+        """
+        事务上下文管理器，支持嵌套（基于 SAVEPOINT）
+
+        Args:
+            immediate: 顶层事务是否使用 BEGIN IMMEDIATE，在开始时即获取写锁，
+                避免整批写入进行到一半才因锁升级失败（嵌套时忽略）
+        """
         self._check_connection("transaction")
+        # 事务期间独占主连接，避免其他线程的写入混入同一事务
+        self._write_lock.acquire()
         nested = self._txn_depth > 0
         sp_name = f"sp_txn_{self._txn_depth+1}"
         try:
@@ -422,7 +928,7 @@ class SQLiteStorage(BaseStorage):
                 self.connection.execute(f"SAVEPOINT {sp_name}")
             else:
                 # 顶层事务
-                self.connection.execute("BEGIN")
+                self.connection.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
             self._txn_depth += 1
             yield
             # 提交
@@ -431,7 +937,8 @@ class SQLiteStorage(BaseStorage):
             else:
                 self.connection.commit()
         except Exception as e:
-            # 回滚
+            # 回滚（其中插入的 stocks 记录可能被撤销，已知代码缓存随之失效）
+            self._known_symbols = None
             if nested:
                 self.connection.execute(f"ROLLBACK TO SAVEPOINT {sp_name}")
                 self.connection.execute(f"RELEASE SAVEPOINT {sp_name}")
@@ -443,30 +950,70 @@ class SQLiteStorage(BaseStorage):
             # 事务深度计数还原
             if self._txn_depth > 0:
                 self._txn_depth -= 1
+            try:
+                # 最外层事务结束（提交或回滚）后写出期间推迟的下载日志
+                if self._txn_depth == 0 and self._log_flush_pending:
+                    self._flush_logs()
+            except sqlite3.Error as e:
+                self.logger.error(f"❌ 写出下载日志失败: {e}")
+            finally:
+                self._write_lock.release()
+    
+    @contextmanager
+    def bulk_load(self, tables: Optional[List[str]] = None) -> Iterator[None]:
+        """
+        批量导入上下文：进入时删除二级索引，退出时一次性重建并 ANALYZE
+
+        大批量首次导入时省去逐行维护索引的写入；期间的范围查询会变慢。
+        不能在事务内使用（索引的删除与重建会各自提交）。
+        期间架构版本记为 0，进程中途退出时下次连接会自动补建索引。
+
+        Args:
+            tables: 需要暂时删除索引的表，默认价格表与三张财务报表
+        """
+        self._check_connection("bulk_load")
+        if tables is None:
+            tables = [
+                self.config.Tables.STOCK_PRICES,
+                *self.config.Tables.get_financial_tables().values(),
+            ]
+        with self._write_lock:
+            if self._txn_depth > 0:
+                raise StorageError("bulk_load 不能在事务内使用", "bulk_load")
+            index_sqls = self.schema_manager.drop_secondary_indexes(tables)
+            try:
+                yield
+            finally:
+                self.schema_manager.restore_indexes(index_sqls, tables)
+                self.logger.info(f"🔧 批量导入结束，已重建 {len(index_sqls)} 个索引")
     
+    @_serialized
     def ensure_stock_exists(self, symbol: str) -> None:
         """确保stocks表中存在指定的股票记录，避免外键约束失败"""
         self._check_connection("ensure_stock_exists")
         
-        T = self.config.Tables.STOCKS
-        F = self.config.Fields
+        # 已知存在时直接返回，省去一次 INSERT OR IGNORE
+        known_symbols = self._get_known_symbols()
+        if symbol in known_symbols:
+            return
         
         # 使用 INSERT OR IGNORE 直接创建记录（如果不存在）
-        # 插入所有字段以确保完整性，与 _ensure_stock_exists 保持一致
-        fields = f"{F.SYMBOL}, {F.Stocks.COMPANY_NAME}, {F.Stocks.SECTOR}, {F.Stocks.INDUSTRY}, {F.Stocks.MARKET_CAP}, {F.Stocks.EMPLOYEES}, {F.Stocks.DESCRIPTION}, {F.UPDATED_AT}"
-        placeholders = "?, ?, ?, ?, ?, ?, ?, ?"
-        
-        sql = self.config.SQLTemplates.INSERT_OR_IGNORE.format(
-            table=T,
-            fields=fields,
-            placeholders=placeholders
-        )
-        
-        self.cursor.execute(sql, (symbol, '', '', '', 0, 0, '', datetime.now().isoformat()))
+        # 插入所有字段以确保完整性，与 _ensure_stock_exists 保持一致（updated_at 取列默认值）
+        self.cursor.execute(_SQL_INSERT_STOCK_PLACEHOLDER, (symbol, '', '', '', 0, 0, ''))
         self._maybe_commit()
+        known_symbols.add(symbol)
+
+    def _get_known_symbols(self) -> Set[str]:
+        """获取已知存在于 stocks 表的代码集合（惰性加载）"""
+        if self._known_symbols is None:
+            T = self.config.Tables.STOCKS
+            rows = self.connection.execute(f"SELECT {self.config.Fields.SYMBOL} FROM {T}").fetchall()
+            self._known_symbols = {row[0] for row in rows}
+        return self._known_symbols
 
     # ============= 交易相关方法 =============
     
+    @_serialized
     def upsert_transaction(self, transaction_data: Dict[str, Any]) -> int:
         """
         插入交易记录（支持幂等性）
@@ -594,6 +1141,7 @@ class SQLiteStorage(BaseStorage):
         columns = [description[0] for description in self.cursor.description]
         return [dict(zip(columns, row)) for row in rows]
 
+    @_serialized
     def upsert_position(self, position_data: Dict[str, Any]) -> int:
         """插入或更新持仓记录"""
         self._check_connection("upsert_position")
@@ -677,15 +1225,13 @@ class SQLiteStorage(BaseStorage):
         
         return None
 
-    def upsert_daily_pnl(self, pnl_data: Dict[str, Any]) -> int:
-        """插入或更新每日盈亏记录"""
-        self._check_connection("upsert_daily_pnl")
-        
+    def _daily_pnl_upsert_sql(self) -> str:
+        """每日盈亏 upsert 语句"""
         T = self.config.Tables.DAILY_PNL
         F = self.config.Fields
         
         # 使用ON CONFLICT进行精确更新，避免REPLACE的副作用
-        sql = f"""
+        return f"""
         INSERT INTO {T} (
             {F.SYMBOL}, {F.DailyPnL.VALUATION_DATE},
             {F.DailyPnL.QUANTITY}, {F.DailyPnL.AVG_COST}, {F.DailyPnL.MARKET_PRICE},
@@ -707,8 +1253,11 @@ class SQLiteStorage(BaseStorage):
             {F.DailyPnL.PRICE_DATE} = excluded.{F.DailyPnL.PRICE_DATE},
             {F.DailyPnL.IS_STALE_PRICE} = excluded.{F.DailyPnL.IS_STALE_PRICE}
         """
-        
-        self.cursor.execute(sql, (
+
+    @staticmethod
+    def _daily_pnl_params(pnl_data: Dict[str, Any]) -> Tuple:
+        """每日盈亏记录 -> 绑定参数（数值统一转 float）"""
+        return (
             pnl_data['symbol'],
             pnl_data['valuation_date'],
             float(pnl_data['quantity']),
@@ -722,11 +1271,36 @@ class SQLiteStorage(BaseStorage):
             float(pnl_data['total_cost']) if pnl_data['total_cost'] is not None else None,
             pnl_data.get('price_date'),
             pnl_data.get('is_stale_price', 0),
-        ))
+        )
+
+    @_serialized
+    def upsert_daily_pnl(self, pnl_data: Dict[str, Any]) -> int:
+        """插入或更新每日盈亏记录"""
+        self._check_connection("upsert_daily_pnl")
+        
+        self.cursor.execute(self._daily_pnl_upsert_sql(), self._daily_pnl_params(pnl_data))
         
         self._maybe_commit()
         return self.cursor.lastrowid
 
+    def upsert_daily_pnls(self, pnl_records: List[Dict[str, Any]]) -> int:
+        """
+        批量插入或更新每日盈亏记录（单个事务内 executemany）
+
+        Returns:
+            int: 写入的记录数
+        """
+        self._check_connection("upsert_daily_pnls")
+        if not pnl_records:
+            return 0
+        
+        with self.transaction(immediate=True):
+            self.cursor.executemany(
+                self._daily_pnl_upsert_sql(),
+                [self._daily_pnl_params(pnl_data) for pnl_data in pnl_records],
+            )
+        return len(pnl_records)
+
     def get_daily_pnl(self, symbol: str = None, 
                       start_date: str = None, end_date: str = None) -> List[Dict[str, Any]]:
         """获取每日盈亏记录"""
@@ -759,6 +1333,7 @@ class SQLiteStorage(BaseStorage):
         columns = [description[0] for description in self.cursor.description]
         return [dict(zip(columns, row)) for row in rows]
 
+    @_serialized
     def delete_position(self, symbol: str) -> bool:
         """删除持仓记录"""
         self._check_connection("delete_position")
@@ -778,19 +1353,11 @@ class SQLiteStorage(BaseStorage):
         """获取指定日期的股票价格"""
         self._check_connection("get_stock_price_for_date")
         
-        T = self.config.Tables.STOCK_PRICES
-        F = self.config.Fields
-        
         # 验证价格字段
         if not self.config.validate_price_field(price_field):
             raise ValueError(f"无效的价格字段: {price_field}")
         
-        # 获取字段映射
-        field_map = self.config.get_price_field_mapping()
-        
-        sql = f"SELECT {field_map[price_field]} FROM {T} WHERE {F.SYMBOL} = ? AND {F.StockPrices.DATE} = ?"
-        
-        self.cursor.execute(sql, (symbol, date))
+        self.cursor.execute(_SQL_PRICE_LOOKUP["on"][price_field], (symbol, date))
         row = self.cursor.fetchone()
         
         return row[0] if row and row[0] is not None else None
@@ -800,32 +1367,139 @@ class SQLiteStorage(BaseStorage):
         """获取最新的股票价格（可指定截止日期）"""
         self._check_connection("get_latest_stock_price")
         
-        T = self.config.Tables.STOCK_PRICES
-        F = self.config.Fields
-        
         # 验证价格字段
         if not self.config.validate_price_field(price_field):
             raise ValueError(f"无效的价格字段: {price_field}")
         
-        # 获取字段映射
-        field_map = self.config.get_price_field_mapping()
-        
         if before_date:
-            sql = f"SELECT {F.StockPrices.DATE}, {field_map[price_field]} FROM {T} " \
-                  f"WHERE {F.SYMBOL} = ? AND {F.StockPrices.DATE} <= ? " \
-                  f"ORDER BY {F.StockPrices.DATE} DESC LIMIT 1"
-            self.cursor.execute(sql, (symbol, before_date))
+            self.cursor.execute(_SQL_PRICE_LOOKUP["before"][price_field], (symbol, before_date))
         else:
-            sql = f"SELECT {F.StockPrices.DATE}, {field_map[price_field]} FROM {T} " \
-                  f"WHERE {F.SYMBOL} = ? ORDER BY {F.StockPrices.DATE} DESC LIMIT 1"
-            self.cursor.execute(sql, (symbol,))
+            self.cursor.execute(_SQL_PRICE_LOOKUP["latest"][price_field], (symbol,))
         
         row = self.cursor.fetchone()
         
         return (row[0], row[1]) if row and row[1] is not None else None
 
+    def _iter_symbol_chunks(self, symbols: List[str]) -> Iterator[Tuple[str, List[str]]]:
+        """
+        symbols 去重排序后按 IN_CLAUSE_CHUNK_SIZE 分块，产出 (IN 占位符串, 绑定参数)
+
+        每块参数个数补齐到 2 的幂（不超过分块上限），用最后一个代码重复填充：IN 语义不变，
+        同一查询只会生成少数几种 SQL 文本，可以命中连接的预编译语句缓存。
+        各块覆盖的 symbol 区间互不重叠且按序产出。
+        """
+        ordered_symbols = sorted(set(symbols))
+        chunk_size = self.IN_CLAUSE_CHUNK_SIZE
+        for start in range(0, len(ordered_symbols), chunk_size):
+            chunk = ordered_symbols[start:start + chunk_size]
+            padded_size = min(1 << (len(chunk) - 1).bit_length(), chunk_size)
+            chunk.extend(chunk[-1:] * (padded_size - len(chunk)))
+            yield ','.join('?' * padded_size), chunk
+
+    def get_stock_prices_bulk(self, symbols: List[str], start_date: str, end_date: str,
+                              price_field: str = 'adj_close') -> Dict[str, List[Tuple[str, Optional[float]]]]:
+        """
+        批量获取多只股票在日期区间内的价格
+
+        每个 symbol 额外附带 start_date 之前最近的一条记录，供区间起点的价格回填；
+        symbols 按 IN_CLAUSE_CHUNK_SIZE 分块，每块两条查询。
+
+        Returns:
+            Dict[symbol, List[(date, price)]]: 按日期升序排列，price 可能为 None
+        """
+        self._check_connection("get_stock_prices_bulk")
+        
+        T = self.config.Tables.STOCK_PRICES
+        F = self.config.Fields
+        
+        # 验证价格字段
+        if not self.config.validate_price_field(price_field):
+            raise ValueError(f"无效的价格字段: {price_field}")
+        
+        price_column = self.config.get_price_field_mapping()[price_field]
+        prices: Dict[str, List[Tuple[str, Optional[float]]]] = {}
+        
+        for placeholders, chunk in self._iter_symbol_chunks(symbols):
+            in_clause = f"{F.SYMBOL} IN ({placeholders})"
+            
+            # 区间之前最近的一条（SQLite 中与 MAX() 同行的裸列取自该最大值所在行）
+            prior_sql = (
+                f"SELECT {F.SYMBOL}, MAX({F.StockPrices.DATE}), {price_column} FROM {T} "
+                f"WHERE {in_clause} AND {F.StockPrices.DATE} < ? GROUP BY {F.SYMBOL}"
+            )
+            for symbol, price_date, price in self.cursor.execute(prior_sql, (*chunk, start_date)):
+                prices[symbol] = [(price_date, price)]
+            
+            range_sql = (
+                f"SELECT {F.SYMBOL}, {F.StockPrices.DATE}, {price_column} FROM {T} "
+                f"WHERE {in_clause} AND {F.StockPrices.DATE} BETWEEN ? AND ? "
+                f"ORDER BY {F.SYMBOL}, {F.StockPrices.DATE}"
+            )
+            for symbol, price_date, price in self.cursor.execute(
+                range_sql, (*chunk, start_date, end_date)
+            ):
+                prices.setdefault(symbol, []).append((price_date, price))
+        
+        return prices
+
+    def has_stock_prices(
+        self, symbols: List[str], end_date: str, start_date: Optional[str] = None
+    ) -> bool:
+        """
+        探测给定股票在 end_date（及可选的 start_date）之前/之间是否存在任何价格记录
+
+        每个分块一条 LIMIT 1 查询，命中即返回；用于批量计算前跳过无价格数据的冷启动。
+        """
+        self._check_connection("has_stock_prices")
+        
+        T = self.config.Tables.STOCK_PRICES
+        F = self.config.Fields
+        
+        date_clause = f"{F.StockPrices.DATE} <= ?"
+        date_params: Tuple[str, ...] = (end_date,)
+        if start_date:
+            date_clause = f"{F.StockPrices.DATE} BETWEEN ? AND ?"
+            date_params = (start_date, end_date)
+        
+        for placeholders, chunk in self._iter_symbol_chunks(symbols):
+            sql = (
+                f"SELECT 1 FROM {T} WHERE {F.SYMBOL} IN ({placeholders}) "
+                f"AND {date_clause} LIMIT 1"
+            )
+            if self.cursor.execute(sql, (*chunk, *date_params)).fetchone():
+                return True
+        return False
+
+    def get_trading_days(self, start_date: str, end_date: str,
+                         symbols: Optional[List[str]] = None) -> List[str]:
+        """
+        获取日期区间内有价格记录的交易日（升序、去重）
+
+        Args:
+            symbols: 可选，只统计这些股票的联合交易日；为空时统计所有股票
+        """
+        self._check_connection("get_trading_days")
+        
+        T = self.config.Tables.STOCK_PRICES
+        F = self.config.Fields
+        date_range = f"{F.StockPrices.DATE} BETWEEN ? AND ?"
+        
+        if not symbols:
+            sql = f"SELECT DISTINCT {F.StockPrices.DATE} FROM {T} WHERE {date_range}"
+            days = {row[0] for row in self.cursor.execute(sql, (start_date, end_date))}
+        else:
+            days = set()
+            for placeholders, chunk in self._iter_symbol_chunks(symbols):
+                sql = (
+                    f"SELECT DISTINCT {F.StockPrices.DATE} FROM {T} "
+                    f"WHERE {F.SYMBOL} IN ({placeholders}) AND {date_range}"
+                )
+                days.update(row[0] for row in self.cursor.execute(sql, (*chunk, start_date, end_date)))
+        return sorted(days)
+
     # ============= 批次追踪相关方法 =============
     
+    @_serialized
     def create_position_lot(self, lot_data: Dict[str, Any]) -> int:
         """创建持仓批次记录"""
         self._check_connection("create_position_lot")
@@ -859,6 +1533,7 @@ class SQLiteStorage(BaseStorage):
         self._maybe_commit()
         return self.cursor.lastrowid
 
+    @_serialized
     def update_lot_remaining_quantity(self, lot_id: int, remaining_quantity: float, 
                                     is_closed: bool = None) -> None:
         """更新批次剩余数量"""
@@ -880,6 +1555,32 @@ class SQLiteStorage(BaseStorage):
         self.cursor.execute(sql, params)
         self._maybe_commit()
 
+    @_serialized
+    def apply_lot_sales(self, updates: List[Tuple[float, bool, int]]) -> None:
+        """
+        批量更新批次剩余数量与关闭状态（单条语句 executemany）
+
+        Args:
+            updates: [(remaining_quantity, is_closed, lot_id), ...]
+        """
+        self._check_connection("apply_lot_sales")
+
+        if not updates:
+            return
+
+        T = self.config.Tables.POSITION_LOTS
+        F = self.config.Fields
+
+        sql = f"UPDATE {T} SET {F.PositionLots.REMAINING_QUANTITY} = ?, " \
+              f"{F.PositionLots.IS_CLOSED} = ?, {F.UPDATED_AT} = CURRENT_TIMESTAMP " \
+              f"WHERE {F.PositionLots.ID} = ?"
+
+        self.cursor.executemany(
+            sql,
+            [(float(remaining), bool(is_closed), lot_id) for remaining, is_closed, lot_id in updates],
+        )
+        self._maybe_commit()
+
     def get_position_lots(self, symbol: str = None,
                          active_only: bool = True) -> List[Dict[str, Any]]:
         """获取持仓批次（包含关联交易的notes信息用于识别DRIP）"""
@@ -898,14 +1599,15 @@ class SQLiteStorage(BaseStorage):
         if active_only:
             conditions.append(f"pl.{F.PositionLots.IS_CLOSED} = 0")
 
-        where_clause = " AND ".join(conditions) if conditions else "1=1"
+        # 无条件时省略WHERE子句（symbol=None且active_only=False时枚举全表）
+        where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
 
         # JOIN transactions表获取notes字段，用于识别DRIP交易
         sql = f"""
             SELECT pl.*, t.notes
             FROM {T} pl
             LEFT JOIN transactions t ON pl.transaction_id = t.id
-            WHERE {where_clause}
+            {where_sql}
             ORDER BY pl.{F.SYMBOL}, pl.{F.PositionLots.PURCHASE_DATE}, pl.{F.PositionLots.ID}
         """
 
@@ -932,6 +1634,7 @@ class SQLiteStorage(BaseStorage):
             return dict(zip(columns, row))
         return None
 
+    @_serialized
     def create_sale_allocation(self, allocation_data: Dict[str, Any]) -> int:
         """创建卖出分配记录"""
         self._check_connection("create_sale_allocation")
@@ -960,40 +1663,55 @@ class SQLiteStorage(BaseStorage):
         self._maybe_commit()
         return self.cursor.lastrowid
 
-    def get_sale_allocations(self, symbol: str = None,
-                           sale_transaction_id: int = None) -> List[Dict[str, Any]]:
-        """获取卖出分配记录"""
-        self._check_connection("get_sale_allocations")
-        
+    def _build_sale_allocations_sql(self) -> Dict[Tuple[bool, bool], str]:
+        """
+        预构建卖出分配联接查询的全部条件组合
+
+        语句文本在实例生命周期内保持不变，sqlite3 语句缓存可直接复用已编译的执行计划
+        （依赖 sale_allocations.lot_id / sale_transaction_id 及 transactions.transaction_date 索引）
+        """
         T_SALE = self.config.Tables.SALE_ALLOCATIONS
         T_LOT = self.config.Tables.POSITION_LOTS
         T_TXN = self.config.Tables.TRANSACTIONS
         F = self.config.Fields
+
+        base_sql = (
+            f"SELECT sa.*, pl.{F.SYMBOL}, "
+            f"pl.{F.PositionLots.PURCHASE_DATE}, t.{F.Transactions.TRANSACTION_DATE} "
+            f"FROM {T_SALE} sa "
+            f"JOIN {T_LOT} pl ON sa.{F.SaleAllocations.LOT_ID} = pl.{F.PositionLots.ID} "
+            f"JOIN {T_TXN} t ON sa.{F.SaleAllocations.SALE_TRANSACTION_ID} = t.{F.Transactions.ID}"
+        )
+        order_sql = (
+            f" ORDER BY t.{F.Transactions.TRANSACTION_DATE} DESC, sa.{F.SaleAllocations.ID} DESC"
+        )
+        symbol_cond = f"pl.{F.SYMBOL} = ?"
+        txn_cond = f"sa.{F.SaleAllocations.SALE_TRANSACTION_ID} = ?"
+
+        statements = {}
+        for by_symbol in (False, True):
+            for by_txn in (False, True):
+                conditions = []
+                if by_symbol:
+                    conditions.append(symbol_cond)
+                if by_txn:
+                    conditions.append(txn_cond)
+                where_sql = " WHERE " + " AND ".join(conditions) if conditions else ""
+                statements[(by_symbol, by_txn)] = base_sql + where_sql + order_sql
+        return statements
+
+    def get_sale_allocations(self, symbol: str = None,
+                           sale_transaction_id: int = None) -> List[Dict[str, Any]]:
+        """获取卖出分配记录"""
+        self._check_connection("get_sale_allocations")
         
-        # 联接查询获取完整信息
-        sql = f"""
-            SELECT sa.*, pl.{F.SYMBOL}, 
-                   pl.{F.PositionLots.PURCHASE_DATE}, t.{F.Transactions.TRANSACTION_DATE}
-            FROM {T_SALE} sa
-            JOIN {T_LOT} pl ON sa.{F.SaleAllocations.LOT_ID} = pl.{F.PositionLots.ID}
-            JOIN {T_TXN} t ON sa.{F.SaleAllocations.SALE_TRANSACTION_ID} = t.{F.Transactions.ID}
-        """
-        
-        conditions = []
         params = []
-        
         if symbol:
-            conditions.append(f"pl.{F.SYMBOL} = ?")
             params.append(symbol)
-        
         if sale_transaction_id:
-            conditions.append(f"sa.{F.SaleAllocations.SALE_TRANSACTION_ID} = ?")
             params.append(sale_transaction_id)
         
-        if conditions:
-            sql += " WHERE " + " AND ".join(conditions)
-        
-        sql += f" ORDER BY t.{F.Transactions.TRANSACTION_DATE} DESC, sa.{F.SaleAllocations.ID} DESC"
+        sql = self._sale_allocations_sql[(bool(symbol), bool(sale_transaction_id))]
         
         self.cursor.execute(sql, params)
         rows = self.cursor.fetchall()
@@ -1005,24 +1723,44 @@ class SQLiteStorage(BaseStorage):
         """获取指定日期的已实现盈亏总额"""
         self._check_connection("get_daily_realized_pnl")
         
+        self.cursor.execute(_SQL_DAILY_REALIZED_PNL, (symbol, date))
+        result = self.cursor.fetchone()
+        
+        return result[0] if result and result[0] is not None else 0.0
+
+    def get_daily_realized_pnl_bulk(self, symbols: List[str], start_date: str,
+                                    end_date: str) -> Dict[Tuple[str, str], float]:
+        """
+        批量获取日期区间内每只股票每日的已实现盈亏总额
+
+        Returns:
+            Dict[(symbol, date), float]: 仅包含有卖出分配记录的日期（其余日期视为 0.0）
+        """
+        self._check_connection("get_daily_realized_pnl_bulk")
+        
         T_SALE = self.config.Tables.SALE_ALLOCATIONS
         T_LOT = self.config.Tables.POSITION_LOTS
         T_TXN = self.config.Tables.TRANSACTIONS
         F = self.config.Fields
         
-        sql = f"""
-            SELECT SUM(sa.{F.SaleAllocations.REALIZED_PNL})
-            FROM {T_SALE} sa
-            JOIN {T_LOT} pl ON sa.{F.SaleAllocations.LOT_ID} = pl.{F.PositionLots.ID}
-            JOIN {T_TXN} t ON sa.{F.SaleAllocations.SALE_TRANSACTION_ID} = t.{F.Transactions.ID}
-            WHERE pl.{F.SYMBOL} = ? 
-            AND t.{F.Transactions.TRANSACTION_DATE} = ?
-        """
-        
-        self.cursor.execute(sql, (symbol, date))
-        result = self.cursor.fetchone()
-        
-        return result[0] if result and result[0] is not None else 0.0
+        realized: Dict[Tuple[str, str], float] = {}
+        
+        for placeholders, chunk in self._iter_symbol_chunks(symbols):
+            sql = f"""
+                SELECT pl.{F.SYMBOL}, t.{F.Transactions.TRANSACTION_DATE},
+                       SUM(sa.{F.SaleAllocations.REALIZED_PNL})
+                FROM {T_SALE} sa
+                JOIN {T_LOT} pl ON sa.{F.SaleAllocations.LOT_ID} = pl.{F.PositionLots.ID}
+                JOIN {T_TXN} t ON sa.{F.SaleAllocations.SALE_TRANSACTION_ID} = t.{F.Transactions.ID}
+                WHERE pl.{F.SYMBOL} IN ({placeholders})
+                AND t.{F.Transactions.TRANSACTION_DATE} BETWEEN ? AND ?
+                GROUP BY pl.{F.SYMBOL}, t.{F.Transactions.TRANSACTION_DATE}
+            """
+            for symbol, date, total in self.cursor.execute(sql, (*chunk, start_date, end_date)):
+                if total is not None:
+                    realized[(symbol, date)] = total
+        
+        return realized
 
     def get_active_symbols_for_user(self) -> List[str]:
         """获取所有活跃持仓的股票代码列表"""
@@ -1062,40 +1800,18 @@ class SQLiteStorage(BaseStorage):
         if not symbols:
             return {}
         
-        T = self.config.Tables.POSITION_LOTS
         F = self.config.Fields
         
-        # 构建IN子句的占位符
-        symbol_placeholders = ','.join(['?' for _ in symbols])
-        
-        # 构建SQL查询
-        conditions = [
-            f"{F.SYMBOL} IN ({symbol_placeholders})"
-        ]
-        
-        params = symbols
-        
-        if active_only:
-            conditions.append(f"{F.PositionLots.IS_CLOSED} = 0")
-        
-        where_clause = " AND ".join(conditions)
-        sql = f"""
-            SELECT * FROM {T} 
-            WHERE {where_clause}
-            ORDER BY {F.SYMBOL}, {F.PositionLots.PURCHASE_DATE}
-            LIMIT ? OFFSET ?
-        """
-        
-        params.extend([page_size, page_offset])
-        
-        self.cursor.execute(sql, params)
-        rows = self.cursor.fetchall()
-        columns = [description[0] for description in self.cursor.description]
-        lots_data = [dict(zip(columns, row)) for row in rows]
+        # 分页作用于按 (symbol, purchase_date) 排序后的整体结果
+        rows = islice(
+            self._iter_position_lot_rows(symbols, active_only),
+            page_offset,
+            page_offset + page_size,
+        )
         
         # 按symbol分组
         result = {}
-        for lot_data in lots_data:
+        for lot_data in rows:
             key = lot_data[F.SYMBOL]
             if key not in result:
                 result[key] = []
@@ -1103,6 +1819,67 @@ class SQLiteStorage(BaseStorage):
         
         return result
 
+    def iter_position_lots_batch(
+        self, symbols: List[str], active_only: bool = True
+    ) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        流式获取多个股票的批次数据，逐个股票产出 (symbol, [lot_data...])
+        
+        适用于股票数量较多的场景：IN 子句按块拆分，结果按块读取，峰值内存与单个股票的批次数相关
+        """
+        self._check_connection("iter_position_lots_batch")
+        
+        F = self.config.Fields
+        # current_lots 非空时 current_symbol 必为已读到的 symbol，初值不会被产出
+        current_symbol = ""
+        current_lots: List[Dict[str, Any]] = []
+        
+        # 行按symbol排序，遇到新symbol即可产出上一组
+        for lot_data in self._iter_position_lot_rows(symbols, active_only):
+            key = lot_data[F.SYMBOL]
+            if key != current_symbol:
+                if current_lots:
+                    yield current_symbol, current_lots
+                current_symbol = key
+                current_lots = []
+            current_lots.append(lot_data)
+        
+        if current_lots:
+            yield current_symbol, current_lots
+
+    def _iter_position_lot_rows(
+        self, symbols: List[str], active_only: bool
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        按 (symbol, purchase_date, id) 顺序逐行产出批次记录（与 get_position_lots 一致，附带交易notes）
+        
+        symbols 按 _iter_symbol_chunks 分块查询，避免超过 SQLite 绑定参数上限；
+        各块覆盖的symbol区间互不重叠，因此块间拼接后仍保持整体有序
+        """
+        T = self.config.Tables.POSITION_LOTS
+        T_TXN = self.config.Tables.TRANSACTIONS
+        F = self.config.Fields
+        
+        for placeholders, chunk in self._iter_symbol_chunks(symbols):
+            conditions = [f"pl.{F.SYMBOL} IN ({placeholders})"]
+            if active_only:
+                conditions.append(f"pl.{F.PositionLots.IS_CLOSED} = 0")
+            
+            # JOIN transactions表获取notes字段，用于识别DRIP交易
+            sql = f"""
+                SELECT pl.*, t.{F.Transactions.NOTES}
+                FROM {T} pl
+                LEFT JOIN {T_TXN} t ON pl.{F.PositionLots.TRANSACTION_ID} = t.{F.Transactions.ID}
+                WHERE {' AND '.join(conditions)}
+                ORDER BY pl.{F.SYMBOL}, pl.{F.PositionLots.PURCHASE_DATE}, pl.{F.PositionLots.ID}
+            """
+            
+            # 使用独立游标，避免流式读取期间与共享游标上的其他查询互相干扰
+            cursor = self.connection.execute(sql, chunk)
+            columns = [description[0] for description in cursor.description]
+            for row in cursor:
+                yield dict(zip(columns, row))
+
     def get_position_lots_paginated(self, symbol: str = None, 
                                    active_only: bool = True, page_size: int = 100, 
                                    page_offset: int = 0) -> tuple:
@@ -1128,17 +1905,17 @@ class SQLiteStorage(BaseStorage):
         if active_only:
             conditions.append(f"{F.PositionLots.IS_CLOSED} = 0")
         
-        where_clause = " AND ".join(conditions)
+        where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
         
         # 获取总数
-        count_sql = f"SELECT COUNT(*) FROM {T} WHERE {where_clause}"
+        count_sql = f"SELECT COUNT(*) FROM {T} {where_sql}"
         self.cursor.execute(count_sql, params)
         total_count = self.cursor.fetchone()[0]
         
         # 获取分页数据
         data_sql = f"""
             SELECT * FROM {T} 
-            WHERE {where_clause}
+            {where_sql}
             ORDER BY {F.PositionLots.PURCHASE_DATE} DESC, {F.PositionLots.ID} DESC
             LIMIT ? OFFSET ?
         """
@@ -4,15 +4,22 @@
 基于批次数据计算精确的每日盈亏
 """
 
+import functools
 import logging
-from decimal import Decimal
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import List, Dict, Optional, Any
 
+import numpy as np
+
 from ...data.storage import create_storage
 from ..models.position_lot import PositionLot
 from ..models.portfolio import DailyPnL
 from ..config import DEFAULT_TRADING_CONFIG
+from ._kernels import compute_pnl_columns
+
+
+# 批次的 created_at/updated_at 多为同一批写入的相同时间戳，缓存解析结果避免重复解析
+_parse_timestamp = functools.lru_cache(maxsize=4096)(datetime.fromisoformat)
 
 
 class LotPnLCalculator:
@@ -64,12 +71,16 @@ class LotPnLCalculator:
             self.logger.warning(f"无法获取 {symbol} 在 {calculation_date} 的价格")
             return None
         
-        # 计算基于批次的未实现盈亏
-        unrealized_pnl = self.calculate_unrealized_pnl_by_lots(lots, market_price)
+        # 计算加权平均成本（单次遍历同时累加数量与成本）
+        total_quantity = total_cost = 0
+        for lot in lots:
+            total_quantity += lot.remaining_quantity
+            total_cost += lot.total_cost
         
-        # 计算加权平均成本
-        total_quantity = sum(lot.remaining_quantity for lot in lots)
-        total_cost = sum(lot.total_cost for lot in lots)
+        # 计算基于批次的未实现盈亏（没有剩余股数时必为0，无需逐批次计算）
+        unrealized_pnl = (
+            self.calculate_unrealized_pnl_by_lots(lots, market_price) if total_quantity > 0 else 0.0
+        )
         avg_cost = total_cost / total_quantity if total_quantity > 0 else 0.0
         
         # 计算市场价值
@@ -105,12 +116,13 @@ class LotPnLCalculator:
         if market_price > 0 and price_date:
             self._check_placeholder_completion(symbol, calculation_date, daily_pnl)
         
-        # 一致性校验（如果不是陈旧价格）
-        if not is_stale:
+        # 一致性校验（如果不是陈旧价格，且配置开启了校验）
+        if not is_stale and self.config.validate_pnl:
             self._validate_pnl_consistency(lots, market_price, unrealized_pnl, realized_pnl, calculation_date)
         
-        self.logger.debug(f"✅ 批次级别盈亏计算完成: {total_quantity:.4f}股, "
-                         f"未实现{unrealized_pnl:.2f}, 已实现{realized_pnl:.2f}")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"✅ 批次级别盈亏计算完成: {total_quantity:.4f}股, "
+                             f"未实现{unrealized_pnl:.2f}, 已实现{realized_pnl:.2f}")
         
         return daily_pnl
     
@@ -126,20 +138,23 @@ class LotPnLCalculator:
         Returns:
             float: 总未实现盈亏
         """
-        total_unrealized_pnl = 0.0
-        
-        for lot in lots:
-            if lot.remaining_quantity <= 0:
-                continue
-            
-            # 计算该批次的未实现盈亏
-            lot_unrealized_pnl = (market_price - lot.cost_basis) * lot.remaining_quantity
-            total_unrealized_pnl += lot_unrealized_pnl
-            
-            self.logger.debug(f"    批次{lot.id}: {lot.remaining_quantity:.4f}@{lot.cost_basis:.4f} "
-                            f"-> 未实现{lot_unrealized_pnl:.2f}")
-        
-        return total_unrealized_pnl
+        if not lots:
+            return 0.0
+        
+        # 一次性转为 float64 数组，向量化计算 (市价 - 成本) * 剩余数量，跳过已清空的批次
+        quantities = np.fromiter((lot.remaining_quantity for lot in lots), dtype=np.float64, count=len(lots))
+        cost_basis = np.fromiter((lot.cost_basis for lot in lots), dtype=np.float64, count=len(lots))
+        held = quantities > 0
+        lot_unrealized = (float(market_price) - cost_basis[held]) * quantities[held]
+        
+        # 逐批次明细仅在开启DEBUG时输出
+        if self.logger.isEnabledFor(logging.DEBUG):
+            for lot, lot_unrealized_pnl in zip((lot for lot in lots if lot.remaining_quantity > 0),
+                                               lot_unrealized):
+                self.logger.debug(f"    批次{lot.id}: {lot.remaining_quantity:.4f}@{lot.cost_basis:.4f} "
+                                f"-> 未实现{lot_unrealized_pnl:.2f}")
+        
+        return float(lot_unrealized.sum())
     
     def calculate_weighted_avg_cost(self, lots: List[PositionLot]) -> float:
         """
@@ -168,7 +183,40 @@ class LotPnLCalculator:
                                  price_source: str = 'adj_close',
                                  only_trading_days: bool = False) -> Dict[str, List[DailyPnL]]:
         """
-        批量计算历史盈亏（优化版，减少N+1查询）
+        批量计算历史盈亏，返回 DailyPnL 对象
+        
+        只计算不落库；需要持久化时将结果展平后交给 save_daily_pnls 一次性批量写入。
+        参数见 batch_calculate_daily_pnl_records。
+        
+        Returns:
+            Dict[str, List[DailyPnL]]: 按股票代码分组的每日盈亏记录
+        """
+        return self.daily_pnls_from_records(self.batch_calculate_daily_pnl_records(
+            symbols, start_date, end_date, price_source, only_trading_days
+        ))
+    
+    @staticmethod
+    def daily_pnls_from_records(
+        records_by_symbol: Dict[str, List[Dict[str, Any]]]
+    ) -> Dict[str, List[DailyPnL]]:
+        """将批量计算的存储层记录构造为DailyPnL对象（数据由同一组列算出，跳过逐行一致性校验）"""
+        # 同一批次的记录共用一个创建时间
+        created_at = datetime.now()
+        return {
+            symbol: [DailyPnL.unchecked(**record, created_at=created_at) for record in records]
+            for symbol, records in records_by_symbol.items()
+        }
+    
+    def batch_calculate_daily_pnl_records(self, symbols: List[str],
+                                         start_date: str, end_date: str,
+                                         price_source: str = 'adj_close',
+                                         only_trading_days: bool = False
+                                         ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        批量计算历史盈亏（优化版，减少N+1查询），直接产出存储层记录字典
+        
+        只计算不落库；结果展平后可直接交给 storage.upsert_daily_pnls，
+        省去逐行构造DailyPnL对象及其校验。
         
         Args:
             symbols: 股票代码列表
@@ -178,99 +226,160 @@ class LotPnLCalculator:
             only_trading_days: 是否仅计算交易日
             
         Returns:
-            Dict[str, List[DailyPnL]]: 按股票代码分组的每日盈亏记录
+            Dict[str, List[Dict]]: 按股票代码分组的每日盈亏记录字典（字段与 _daily_pnl_record 一致）
         """
         self.logger.info(f"批量计算批次级别盈亏: {len(symbols)}只股票, "
                         f"{start_date} 到 {end_date}")
         
-        results = {}
+        results: Dict[str, List[Dict[str, Any]]] = {}
         
-        # 优化：批量获取所有symbols的lots数据，避免N+1查询
-        all_lots_by_symbol = {}
-        for symbol in symbols:
-            lots_data = self.storage.get_position_lots(symbol, active_only=True)
-            if lots_data:
-                all_lots_by_symbol[symbol] = self._convert_to_position_lots(lots_data)
+        # 优化：一次分块 IN 查询获取所有symbols的lots数据，避免N+1查询
+        all_lots_by_symbol = {
+            symbol: self._convert_to_position_lots(lots_data)
+            for symbol, lots_data in self.storage.iter_position_lots_batch(symbols, active_only=True)
+        }
+        
+        if only_trading_days:
+            # 交易日与价格来自同一次批量读取：区间内这些股票有价格记录的日期即为交易日
+            history_by_symbol = (
+                self.storage.get_stock_prices_bulk(symbols, start_date, end_date, price_source)
+                if symbols else {}
+            )
+            dates = sorted({
+                price_date for history in history_by_symbol.values()
+                for price_date, _ in history if price_date >= start_date
+            })
+        else:
+            # 生成自然日期范围；一次批量读取区间内价格（含区间前最近一条，供回填）
+            dates = self._generate_date_range(start_date, end_date, only_trading_days)
+            history_by_symbol = (
+                self.storage.get_stock_prices_bulk(symbols, dates[0], dates[-1], price_source)
+                if symbols and dates else {}
+            )
         
-        # 生成日期范围
-        dates = self._generate_date_range(start_date, end_date, only_trading_days)
+        # 优化：一次分组查询预取区间内每日已实现盈亏，避免逐日查询
+        realized_by_day = (
+            self.storage.get_daily_realized_pnl_bulk(symbols, min(dates), max(dates))
+            if dates else {}
+        )
+        
+        # DEBUG 关闭时跳过逐股票进度日志的 f-string 格式化
+        debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
         
-        # 优化：批量获取价格数据，减少数据库往返
-        price_cache = self._batch_get_prices(symbols, dates, price_source)
+        # 所有股票的 (股票, 日期) 行按列（每只股票一段数组）收集，最后拼接后由数值内核一次算完
+        calc_dates = np.array(dates, dtype=str)
+        # 日期列保存对已有字符串对象的引用（估值日期取自 dates，回填价格日期取自价格记录），
+        # 大批量结果中同一日期只占一个对象，而不是每行各自一份
+        row_dates, row_price_dates, row_stale, row_prices = [], [], [], []
+        row_quantities, row_total_costs, row_cost_quantities, row_realized = [], [], [], []
+        spans = []  # (symbol, 起始行, 结束行)
+        row_count = 0
         
         for symbol in symbols:
-            self.logger.debug(f"处理 {symbol}...")
-            symbol_results = []
+            if debug_enabled:
+                self.logger.debug(f"处理 {symbol}...")
             
             lots = all_lots_by_symbol.get(symbol, [])
             if not lots:
-                self.logger.debug(f"没有 {symbol} 的活跃持仓")
+                if debug_enabled:
+                    self.logger.debug(f"没有 {symbol} 的活跃持仓")
                 continue
                 
-            for date in dates:
-                # 从缓存获取价格
-                price_info = price_cache.get((symbol, date))
-                if not price_info:
-                    continue
-
-                market_price, price_date, is_stale = price_info
-
-                # 过滤出在当前日期之前已购买的批次
-                active_lots_on_date = [lot for lot in lots if lot.purchase_date <= date]
-                if not active_lots_on_date:
-                    continue  # 该日期没有持仓，跳过
-
-                # 计算加权平均成本和其他指标
-                # 注意：市值包含所有批次（含DRIP），但成本只计算非DRIP批次
-                total_quantity = sum(lot.remaining_quantity for lot in active_lots_on_date)
-                market_value = total_quantity * market_price
-
-                # 排除DRIP批次的成本（DRIP是用分红买的，不是自己投入的钱）
-                def is_drip(lot):
-                    return lot.notes and 'Dividend Reinvestment' in lot.notes
+            # 按购买日期排序后预先累加（排序稳定，累加顺序与逐日求和一致），
+            # 每个日期只需二分定位已购批次数量，不再逐日遍历全部批次；
+            # 热路径统一用 float 运算（存储层返回的即为 REAL），避免 Decimal 与 float 混算
+            # 注意：市值包含所有批次（含DRIP），但成本只计算非DRIP批次（DRIP是用分红买的，不是自己投入的钱）
+            ordered_lots = sorted(lots, key=lambda lot: lot.purchase_date)
+            purchase_dates = [lot.purchase_date for lot in ordered_lots]
+            cum_quantity, cum_cost, cum_cost_quantity = [0.0], [0.0], [0.0]
+            for lot in ordered_lots:
+                quantity = float(lot.remaining_quantity)
+                cum_quantity.append(cum_quantity[-1] + quantity)
+                if lot.is_drip:
+                    cum_cost.append(cum_cost[-1])
+                    cum_cost_quantity.append(cum_cost_quantity[-1])
+                else:
+                    cum_cost.append(cum_cost[-1] + float(lot.total_cost))
+                    cum_cost_quantity.append(cum_cost_quantity[-1] + quantity)
 
-                non_drip_lots = [lot for lot in active_lots_on_date if not is_drip(lot)]
-                total_cost = sum(lot.total_cost for lot in non_drip_lots)
-                non_drip_quantity = sum(lot.remaining_quantity for lot in non_drip_lots)
-                avg_cost = total_cost / non_drip_quantity if non_drip_quantity > Decimal('0') else Decimal('0.0')
+            # 整列定位：每个计算日截至当日的价格，以及当日之前（含当日）已购买的批次数量；
+            # 只保留有价格且有持仓的日期
+            history = history_by_symbol.get(symbol, [])
+            prices, price_dates, latest = self._align_prices(history, calc_dates)
+            active_counts = np.searchsorted(np.array(purchase_dates, dtype=str), calc_dates, side='right')
+            selected = np.flatnonzero(~np.isnan(prices) & (active_counts > 0))
+            if not selected.size:
+                continue
 
-                # 未实现盈亏 = 市值(所有股份) - 成本(排除DRIP)
-                unrealized_pnl = market_value - total_cost
-                unrealized_pnl_pct = (unrealized_pnl / total_cost) if total_cost > Decimal('0') else Decimal('0.0')
-                
-                # 获取当日已实现盈亏
-                realized_pnl = self.storage.get_daily_realized_pnl(symbol, date)
-                realized_pnl_pct = (realized_pnl / total_cost) if total_cost > Decimal('0') else Decimal('0.0')
-                
-                # 构造DailyPnL对象
-                daily_pnl = DailyPnL(
-                    symbol=symbol,
-                    valuation_date=date,
-                    quantity=total_quantity,
-                    avg_cost=avg_cost,
-                    market_price=market_price,
-                    market_value=market_value,
-                    unrealized_pnl=unrealized_pnl,
-                    unrealized_pnl_pct=unrealized_pnl_pct,
-                    realized_pnl=realized_pnl,
-                    realized_pnl_pct=realized_pnl_pct,
-                    total_cost=total_cost,
-                    price_date=price_date,
-                    is_stale_price=is_stale,
-                    created_at=datetime.now()
-                )
-                
-                symbol_results.append(daily_pnl)
-            
-            if symbol_results:
-                results[symbol] = symbol_results
+            counts = active_counts[selected]
+            selected_list = selected.tolist()
+            symbol_dates = [dates[j] for j in selected_list]
+            stale = (price_dates[selected] != calc_dates[selected]).tolist()
+            row_dates.extend(symbol_dates)
+            row_stale.extend(stale)
+            row_price_dates.extend(
+                history[latest[j] - 1][0] if is_stale else date
+                for j, date, is_stale in zip(selected_list, symbol_dates, stale)
+            )
+            row_prices.append(prices[selected])
+            row_quantities.append(np.array(cum_quantity)[counts])
+            row_total_costs.append(np.array(cum_cost)[counts])
+            row_cost_quantities.append(np.array(cum_cost_quantity)[counts])
+            row_realized.append(np.array(
+                [realized_by_day.get((symbol, date), 0.0) for date in symbol_dates],
+                dtype=float
+            ))
+            spans.append((symbol, row_count, row_count + selected.size))
+            row_count += selected.size
+        
+        if not spans:
+            return results
+        
+        # 各指标按列一次算出（逐元素 float64 运算，与逐行计算结果一致）
+        quantities = np.concatenate(row_quantities)
+        market_prices = np.concatenate(row_prices)
+        total_costs = np.concatenate(row_total_costs)
+        realized = np.concatenate(row_realized)
+        market_values, unrealized, avg_costs, unrealized_pct, realized_pct = compute_pnl_columns(
+            quantities, market_prices, total_costs, np.concatenate(row_cost_quantities), realized
+        )
+        
+        # 存储层记录字典（字段与 _daily_pnl_record 一致）
+        columns = list(zip(row_dates, quantities.tolist(), avg_costs.tolist(),
+                           market_prices.tolist(), market_values.tolist(), unrealized.tolist(),
+                           unrealized_pct.tolist(), realized.tolist(), realized_pct.tolist(),
+                           total_costs.tolist(), row_price_dates, row_stale))
+        for symbol, first_row, last_row in spans:
+            symbol_results = [
+                {
+                    'symbol': symbol,
+                    'valuation_date': date,
+                    'quantity': quantity,
+                    'avg_cost': avg_cost,
+                    'market_price': market_price,
+                    'market_value': market_value,
+                    'unrealized_pnl': unrealized_pnl,
+                    'unrealized_pnl_pct': unrealized_pnl_pct,
+                    'realized_pnl': realized_pnl,
+                    'realized_pnl_pct': realized_pnl_pct,
+                    'total_cost': total_cost,
+                    'price_date': price_date,
+                    'is_stale_price': is_stale
+                }
+                for (date, quantity, avg_cost, market_price, market_value, unrealized_pnl,
+                     unrealized_pnl_pct, realized_pnl, realized_pnl_pct, total_cost,
+                     price_date, is_stale) in columns[first_row:last_row]
+            ]
+            results[symbol] = symbol_results
+            if debug_enabled:
                 self.logger.debug(f"  {symbol}: 计算了 {len(symbol_results)} 个交易日")
         
         return results
     
-    def save_daily_pnl(self, daily_pnl: DailyPnL) -> int:
-        """保存每日盈亏记录到数据库"""
-        pnl_data = {
+    @staticmethod
+    def _daily_pnl_record(daily_pnl: DailyPnL) -> Dict[str, Any]:
+        """DailyPnL -> 存储层记录字典"""
+        return {
             'symbol': daily_pnl.symbol,
             'valuation_date': daily_pnl.valuation_date,
             'quantity': daily_pnl.quantity,
@@ -285,14 +394,65 @@ class LotPnLCalculator:
             'price_date': daily_pnl.price_date,
             'is_stale_price': daily_pnl.is_stale_price
         }
+    
+    def save_daily_pnl(self, daily_pnl: DailyPnL) -> int:
+        """保存每日盈亏记录到数据库"""
+        return self.storage.upsert_daily_pnl(self._daily_pnl_record(daily_pnl))
+    
+    def save_daily_pnls(self, daily_pnls: List[DailyPnL]) -> int:
+        """批量保存每日盈亏记录（单个事务），返回写入条数"""
+        return self.storage.upsert_daily_pnls(
+            [self._daily_pnl_record(daily_pnl) for daily_pnl in daily_pnls]
+        )
+    
+    def assign_daily_pnl_ids(self, valuation_date: str, daily_pnls: List[DailyPnL]) -> None:
+        """批量写入后按 (股票, 估值日期) 一次查询回填同一日期各记录的ID"""
+        if not daily_pnls:
+            return
+        ids = {
+            record['symbol']: record['id']
+            for record in self.storage.get_daily_pnl(None, valuation_date, valuation_date)
+        }
+        for daily_pnl in daily_pnls:
+            daily_pnl.id = ids.get(daily_pnl.symbol)
+    
+    def check_placeholder_completions(self, calculation_date: str,
+                                      daily_pnls: List[DailyPnL]) -> None:
+        """
+        批量检查占位记录补全（一次查询当日全部已有记录，逐条复用 _check_placeholder_completion）
         
-        return self.storage.upsert_daily_pnl(pnl_data)
+        Args:
+            calculation_date: 计算日期
+            daily_pnls: 即将写入的同一日期盈亏记录
+        """
+        candidates = [
+            daily_pnl for daily_pnl in daily_pnls
+            if daily_pnl.market_price > 0 and daily_pnl.price_date
+        ]
+        if not candidates:
+            return
+        try:
+            existing_by_symbol: Dict[str, List[Dict[str, Any]]] = {}
+            for record in self.storage.get_daily_pnl(None, calculation_date, calculation_date):
+                existing_by_symbol.setdefault(record['symbol'], []).append(record)
+        except Exception as e:
+            self.logger.error(f"❌ 占位记录检查失败: {e}")
+            return
+        for daily_pnl in candidates:
+            self._check_placeholder_completion(
+                daily_pnl.symbol, calculation_date, daily_pnl,
+                existing_records=existing_by_symbol.get(daily_pnl.symbol, [])
+            )
     
     def _convert_to_position_lots(self, lots_data: List[Dict[str, Any]]) -> List[PositionLot]:
         """将数据库记录转换为PositionLot对象"""
         lots = []
+        append = lots.append
         for lot_data in lots_data:
-            lot = PositionLot(
+            # 每个键只查一次
+            created_at = lot_data.get('created_at')
+            updated_at = lot_data.get('updated_at')
+            append(PositionLot(
                 id=lot_data['id'],
                 symbol=lot_data['symbol'],
                 transaction_id=lot_data['transaction_id'],
@@ -301,11 +461,10 @@ class LotPnLCalculator:
                 cost_basis=lot_data['cost_basis'],
                 purchase_date=lot_data['purchase_date'],
                 is_closed=bool(lot_data['is_closed']),
-                created_at=datetime.fromisoformat(lot_data.get('created_at', '')) if lot_data.get('created_at') else None,
-                updated_at=datetime.fromisoformat(lot_data.get('updated_at', '')) if lot_data.get('updated_at') else None,
+                created_at=_parse_timestamp(created_at) if created_at else None,
+                updated_at=_parse_timestamp(updated_at) if updated_at else None,
                 notes=lot_data.get('notes')  # 包含notes用于识别DRIP
-            )
-            lots.append(lot)
+            ))
         return lots
     
     def _get_market_price(self, symbol: str, date: str, 
@@ -316,12 +475,7 @@ class LotPnLCalculator:
         Returns:
             tuple: (价格, 价格日期, 是否为陈旧价格)
         """
-        # 首先尝试获取指定日期的价格
-        price = self.storage.get_stock_price_for_date(symbol, date, price_source)
-        if price is not None:
-            return price, date, False
-        
-        # 如果没有找到，尝试获取最近的价格（回填）
+        # 一次查询截至当日（含）最近的价格：当日有价格时即为当日价格，否则为回填价格
         latest_price_info = self.storage.get_latest_stock_price(symbol, date, price_source)
         if latest_price_info:
             price_date, price = latest_price_info
@@ -344,79 +498,33 @@ class LotPnLCalculator:
         Returns:
             List[str]: 日期字符串列表
         """
-        if only_trading_days and symbols:
-            # 获取指定symbols的联合交易日
-            T = self.storage.config.Tables.STOCK_PRICES
-            F = self.storage.config.Fields
-            
-            placeholders = ','.join(['?' for _ in symbols])
-            sql = f"""
-            SELECT DISTINCT {F.StockPrices.DATE} 
-            FROM {T} 
-            WHERE {F.StockPrices.DATE} >= ? AND {F.StockPrices.DATE} <= ?
-            AND {F.SYMBOL} IN ({placeholders})
-            ORDER BY {F.StockPrices.DATE}
-            """
-            params = [start_date, end_date] + symbols
-            
-            self.storage.cursor.execute(sql, params)
-            rows = self.storage.cursor.fetchall()
-            return [row[0] for row in rows]
-        
-        elif only_trading_days:
-            # 获取所有股票的交易日
-            T = self.storage.config.Tables.STOCK_PRICES
-            F = self.storage.config.Fields
-            
-            sql = f"""
-            SELECT DISTINCT {F.StockPrices.DATE} 
-            FROM {T} 
-            WHERE {F.StockPrices.DATE} >= ? AND {F.StockPrices.DATE} <= ?
-            ORDER BY {F.StockPrices.DATE}
-            """
-            
-            self.storage.cursor.execute(sql, (start_date, end_date))
-            rows = self.storage.cursor.fetchall()
-            return [row[0] for row in rows]
+        if only_trading_days:
+            # 获取交易日（指定symbols时为其联合交易日）
+            return self.storage.get_trading_days(start_date, end_date, symbols)
         
         else:
-            # 生成自然日期范围
-            dates = []
-            start = datetime.strptime(start_date, '%Y-%m-%d')
-            end = datetime.strptime(end_date, '%Y-%m-%d')
-            
-            current = start
-            while current <= end:
-                dates.append(current.strftime('%Y-%m-%d'))
-                current = current + timedelta(days=1)
-            
-            return dates
+            # 生成自然日期范围（datetime64[D] 转字符串即为 YYYY-MM-DD）
+            start = np.datetime64(datetime.strptime(start_date, '%Y-%m-%d').date(), 'D')
+            end = np.datetime64(datetime.strptime(end_date, '%Y-%m-%d').date(), 'D')
+            return np.arange(start, end + 1, dtype='datetime64[D]').astype(str).tolist()
     
-    def _batch_get_prices(self, symbols: List[str], dates: List[str], 
-                         price_source: str) -> Dict[tuple, tuple]:
+    @staticmethod
+    def _align_prices(history: List[tuple], calc_dates: np.ndarray) -> tuple:
         """
-        批量获取价格数据，减少数据库往返
+        将单只股票的价格序列（get_stock_prices_bulk 结果，按日期升序）前向回填对齐到计算日期
         
         Returns:
-            Dict[(symbol, date), (price, price_date, is_stale)]: 价格缓存
+            (prices, price_dates, latest): 每个计算日截至当日最近一条价格、其日期，
+            以及该条在 history 中的下标 + 1（0 表示无记录）；
+            区间前也无记录或最近一条价格为空时 price 为 NaN（与逐日查询的回退语义一致）
         """
-        price_cache = {}
-        
-        for symbol in symbols:
-            for date in dates:
-                # 首先尝试获取指定日期的价格
-                price = self.storage.get_stock_price_for_date(symbol, date, price_source)
-                if price is not None:
-                    price_cache[(symbol, date)] = (price, date, False)
-                else:
-                    # 尝试获取最近的价格（回填）
-                    latest_price_info = self.storage.get_latest_stock_price(symbol, date, price_source)
-                    if latest_price_info:
-                        price_date, latest_price = latest_price_info
-                        is_stale = price_date != date
-                        price_cache[(symbol, date)] = (latest_price, price_date, is_stale)
-        
-        return price_cache
+        # 下标 0 为哨兵（空日期、NaN价格），表示截至该日尚无任何价格
+        price_dates = np.array([''] + [row[0] for row in history], dtype=str)
+        prices = np.array(
+            [np.nan] + [np.nan if row[1] is None else row[1] for row in history], dtype=float
+        )
+        latest = np.searchsorted(price_dates, calc_dates, side='right') - 1
+        return prices[latest], price_dates[latest], latest
     
     def _validate_pnl_consistency(self, lots: List[PositionLot], market_price: float,
                                  calculated_unrealized: float, calculated_realized: float,
@@ -441,26 +549,19 @@ class LotPnLCalculator:
                 self.logger.warning(f"⚠️  未实现盈亏不一致: 计算值{calculated_unrealized:.2f}, "
                                   f"重算值{recalc_unrealized:.2f}, 差异{unrealized_diff:.2f}")
             
-            # 检查批次数量与计算结果的一致性
-            total_quantity = sum(lot.remaining_quantity for lot in lots)
-            total_cost_from_lots = sum(lot.remaining_quantity * lot.cost_basis for lot in lots)
-            market_value_from_lots = total_quantity * market_price
-            
-            calculated_market_value = total_quantity * market_price
-            if abs(market_value_from_lots - calculated_market_value) > 0.01:
-                self.logger.warning(f"⚠️  市场价值不一致: lots计算{market_value_from_lots:.2f}, "
-                                  f"直接计算{calculated_market_value:.2f}")
-            
             # 记录校验结果（debug级别）
-            self.logger.debug(f"📋 一致性校验通过: {calculation_date}, "
-                            f"未实现差异{unrealized_diff:.4f}, 总量{total_quantity:.4f}")
+            if self.logger.isEnabledFor(logging.DEBUG):
+                total_quantity = sum(lot.remaining_quantity for lot in lots)
+                self.logger.debug(f"📋 一致性校验通过: {calculation_date}, "
+                                f"未实现差异{unrealized_diff:.4f}, 总量{total_quantity:.4f}")
             
         except Exception as e:
             self.logger.error(f"❌ 一致性校验失败: {e}")
             # 不重新抛出异常，避免影响主流程
     
     def _check_placeholder_completion(self, symbol: str, 
-                                    calculation_date: str, daily_pnl: DailyPnL):
+                                    calculation_date: str, daily_pnl: DailyPnL,
+                                    existing_records: Optional[List[Dict[str, Any]]] = None) -> None:
         """
         检查是否是对占位记录的补全
         
@@ -468,12 +569,14 @@ class LotPnLCalculator:
             symbol: 股票代码
             calculation_date: 计算日期
             daily_pnl: 当前计算的PnL记录
+            existing_records: 可选，调用方已批量读取的当日已有记录（不提供时单独查询）
         """
         try:
             # 获取现有的daily_pnl记录
-            existing_records = self.storage.get_daily_pnl(
-                symbol, calculation_date, calculation_date
-            )
+            if existing_records is None:
+                existing_records = self.storage.get_daily_pnl(
+                    symbol, calculation_date, calculation_date
+                )
             
             if existing_records:
                 existing = existing_records[0]
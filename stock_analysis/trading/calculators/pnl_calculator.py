@@ -5,21 +5,48 @@
 """
 
 import logging
-from datetime import datetime, date, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
 from typing import List, Optional, Dict, Any, Tuple
 
+import numpy as np
+
 from ...data.storage import create_storage
 from ..models.portfolio import Position, DailyPnL
 from ..services.transaction_service import TransactionService
-from ..config import DEFAULT_TRADING_CONFIG
+from ..config import DEFAULT_TRADING_CONFIG, TradingConfig
 from .lot_pnl_calculator import LotPnLCalculator
 
 
+# 股票数不超过该值时直接串行计算，进程启动开销大于收益
+PARALLEL_MIN_SYMBOLS = 2
+
+
+def _batch_calculate_in_worker(
+    db_path: str, config: TradingConfig, symbols: List[str], start_date: str, end_date: str,
+    price_source: str, only_trading_days: bool
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    在子进程中计算一组股票的逐日盈亏记录
+
+    SQLite 连接不能跨进程共享，子进程打开自己的存储连接只读计算，返回前关闭。
+    """
+    storage = create_storage('sqlite', db_path=db_path)
+    try:
+        return LotPnLCalculator(storage, config).batch_calculate_daily_pnl_records(
+            symbols, start_date, end_date, price_source, only_trading_days
+        )
+    finally:
+        storage.close()
+
+
 class PnLCalculator:
     """盈亏计算器"""
     
     def __init__(self, storage, config, price_field: str = 'adj_close', 
-                 only_trading_days: bool = False):
+                 only_trading_days: bool = False,
+                 transaction_service: Optional[TransactionService] = None,
+                 lot_calculator: Optional[LotPnLCalculator] = None):
         """
         初始化盈亏计算器
         
@@ -28,16 +55,20 @@ class PnLCalculator:
             config: 交易配置
             price_field: 估值价格来源字段，默认使用adj_close
             only_trading_days: 是否只在交易日计算，默认False（包含自然日）
+            transaction_service: 可选，复用已有的交易服务（需基于同一storage）
+            lot_calculator: 可选，复用已有的批次级别计算器（需基于同一storage）
         """
         self.storage = storage
         self.config = config
-        self.transaction_service = TransactionService(storage, config)
+        self.transaction_service = transaction_service or TransactionService(storage, config)
         self.price_field = price_field
         self.only_trading_days = only_trading_days
         self.logger = logging.getLogger(__name__)
+        # 日期范围缓存：(开始, 结束, 股票集合, 是否仅交易日) -> 日期列表，实例生命周期内有效
+        self._date_range_cache: Dict[Tuple, List[date]] = {}
         
         # 使用批次级别计算器作为底层实现
-        self.lot_calculator = LotPnLCalculator(storage, config)
+        self.lot_calculator = lot_calculator or LotPnLCalculator(storage, config)
     
     def calculate_daily_pnl(self, symbol: str, 
                            calculation_date: str) -> Optional[DailyPnL]:
@@ -63,7 +94,9 @@ class PnLCalculator:
         
         return daily_pnl
     
-    def calculate_all_positions_pnl(self, calculation_date: str) -> List[DailyPnL]:
+    def calculate_all_positions_pnl(
+        self, calculation_date: str
+    ) -> Tuple[List[DailyPnL], List[Tuple[str, str]]]:
         """
         计算用户所有持仓在指定日期的盈亏
         
@@ -71,7 +104,8 @@ class PnLCalculator:
             calculation_date: 计算日期（YYYY-MM-DD格式）
             
         Returns:
-            List[DailyPnL]: 所有持仓的盈亏记录列表
+            Tuple[List[DailyPnL], List[Tuple[str, str]]]:
+                (所有持仓的盈亏记录列表, 计算失败的 (股票代码, 错误信息) 列表)
         """
         self.logger.info(f"计算所有持仓盈亏: {calculation_date}")
         
@@ -79,23 +113,42 @@ class PnLCalculator:
         symbols = self.transaction_service.get_active_symbols()
         if not symbols:
             self.logger.info(f"无持仓")
-            return []
+            return [], []
         
-        daily_pnls = []
-        
-        for symbol in symbols:
-            try:
-                daily_pnl = self.calculate_daily_pnl(
-                    symbol, calculation_date
+        # 与历史批量计算走同一路径（单日区间）：批次、价格、已实现盈亏各一次批量查询
+        errors: List[Tuple[str, str]] = []
+        try:
+            result_by_symbol = self.lot_calculator.daily_pnls_from_records(
+                self._batch_calculate_daily_pnl_records(
+                    symbols, calculation_date, calculation_date, self.price_field
                 )
-                if daily_pnl:
-                    daily_pnls.append(daily_pnl)
-            except Exception as e:
-                self.logger.error(f"计算持仓盈亏失败: {symbol} - {e}")
-                continue
+            )
+        except Exception as e:
+            # 整批失败时逐只股票重算，单只股票的错误不影响其他持仓
+            self.logger.error(f"批量计算持仓盈亏失败，改为逐只计算: {e}")
+            result_by_symbol = {}
+            for symbol in symbols:
+                try:
+                    result_by_symbol.update(self.lot_calculator.batch_calculate_daily_pnl(
+                        [symbol], calculation_date, calculation_date, self.price_field
+                    ))
+                except Exception as symbol_error:
+                    self.logger.error(f"计算持仓盈亏失败: {symbol} - {symbol_error}")
+                    errors.append((symbol, str(symbol_error)))
+        
+        daily_pnls = [
+            daily_pnl for symbol in symbols for daily_pnl in result_by_symbol.get(symbol, [])
+        ]
+        
+        # 写入前检查占位记录补全（一次读取当日已有记录）
+        self.lot_calculator.check_placeholder_completions(calculation_date, daily_pnls)
+        
+        # 全部持仓的记录在一个事务内批量写入，而非逐只股票提交，随后回填记录ID
+        self.lot_calculator.save_daily_pnls(daily_pnls)
+        self.lot_calculator.assign_daily_pnl_ids(calculation_date, daily_pnls)
         
         self.logger.info(f"✅ 完成所有持仓盈亏计算: {len(daily_pnls)}/{len(symbols)}")
-        return daily_pnls
+        return daily_pnls, errors
     
     def batch_calculate_historical_pnl(self, start_date: str, 
                                       end_date: str, symbols: List[str] = None) -> Dict[str, int]:
@@ -123,23 +176,28 @@ class PnLCalculator:
             self.logger.info("无持仓股票，跳过批量计算")
             return {'total_days': 0, 'calculated_records': 0}
         
-        # 委托给批次级别计算器进行批量计算
-        result_by_symbol = self.lot_calculator.batch_calculate_daily_pnl(
+        # 计算总天数（与是否有价格数据无关）
+        total_days = len(self._generate_date_range(start_date, end_date))
+        
+        # 冷启动探测：没有任何可用价格（回填模式下含区间之前的价格）时无需进入批量计算
+        probe_start = start_date if self.only_trading_days else None
+        if not self.storage.has_stock_prices(symbols, end_date, probe_start):
+            self.logger.info(f"区间内无价格数据，跳过批量计算: {start_date} 至 {end_date}")
+            return {'total_days': total_days, 'calculated_records': 0,
+                    'symbols_processed': len(symbols)}
+        
+        # 委托给批次级别计算器进行批量计算（直接产出存储层记录，不构造DailyPnL对象）
+        result_by_symbol = self._batch_calculate_daily_pnl_records(
             symbols, start_date, end_date, self.price_field, self.only_trading_days
         )
         
-        # 保存结果到数据库
-        calculated_records = 0
-        for symbol, symbol_results in result_by_symbol.items():
-            for daily_pnl in symbol_results:
-                self.lot_calculator.save_daily_pnl(daily_pnl)
-                calculated_records += 1
-        
-        # 计算总天数
-        date_range = self._generate_date_range(start_date, end_date)
+        # 保存结果到数据库：全部记录在一个事务内批量写入
+        calculated_records = self.storage.upsert_daily_pnls(
+            [record for symbol_results in result_by_symbol.values() for record in symbol_results]
+        )
         
         result = {
-            'total_days': len(date_range),
+            'total_days': total_days,
             'calculated_records': calculated_records,
             'symbols_processed': len(symbols)
         }
@@ -147,6 +205,38 @@ class PnLCalculator:
         self.logger.info(f"✅ 批量计算完成: {result}")
         return result
     
+    def _batch_calculate_daily_pnl_records(
+        self, symbols: List[str], start_date: str, end_date: str,
+        price_source: str = 'adj_close', only_trading_days: bool = False
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        按配置串行或多进程执行批次级别的批量盈亏计算，返回存储层记录字典
+        
+        parallel_workers > 1 且数据库为文件时，将股票轮转分组交给子进程，
+        每个子进程打开自己的存储连接只读计算，结果在父进程合并后统一写入。
+        参数与 LotPnLCalculator.batch_calculate_daily_pnl_records 一致。
+        """
+        workers = min(getattr(self.config, 'parallel_workers', 1), len(symbols))
+        db_path = getattr(self.storage, 'db_path', None)
+        if workers < 2 or len(symbols) <= PARALLEL_MIN_SYMBOLS or db_path in (None, ':memory:'):
+            return self.lot_calculator.batch_calculate_daily_pnl_records(
+                symbols, start_date, end_date, price_source, only_trading_days
+            )
+        
+        groups = [symbols[i::workers] for i in range(workers)]
+        result_by_symbol: Dict[str, List[Dict[str, Any]]] = {}
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    _batch_calculate_in_worker, db_path, self.config, group,
+                    start_date, end_date, price_source, only_trading_days
+                )
+                for group in groups
+            ]
+            for future in futures:
+                result_by_symbol.update(future.result())
+        return result_by_symbol
+    
     def recalculate_position_pnl(self, symbol: str, 
                                 recompute_days: int = 7) -> int:
         """
@@ -189,46 +279,49 @@ class PnLCalculator:
         """
         report = {}
         date_range = self._generate_date_range(start_date, end_date, symbols)
+        date_strs = [calc_date.isoformat() for calc_date in date_range]
+        calc_dates = np.array(date_strs, dtype=str)
+        
+        # 一次批量读取区间内价格（含区间前最近一条），不再逐日查询当日价格和回填价格
+        history_by_symbol = (
+            self.storage.get_stock_prices_bulk(symbols, date_strs[0], date_strs[-1], self.price_field)
+            if date_strs else {}
+        )
         
         for symbol in symbols:
-            available_dates = []
-            missing_dates = []
-            stale_dates = []
+            history = history_by_symbol.get(symbol, [])
+            # 下标 0 为哨兵（空日期、NaN价格），表示截至该日尚无任何价格
+            price_dates = np.array([''] + [row[0] for row in history], dtype=str)
+            prices = np.array(
+                [np.nan] + [np.nan if row[1] is None else row[1] for row in history], dtype=float
+            )
             
-            for calc_date in date_range:
-                calc_date_str = calc_date.strftime('%Y-%m-%d')
-                
-                # 检查当日价格
-                current_price = self.storage.get_stock_price_for_date(
-                    symbol, calc_date_str, self.price_field
-                )
-                
-                if current_price is not None:
-                    available_dates.append(calc_date_str)
-                else:
-                    # 尝试获取最近价格
-                    latest_price_info = self.storage.get_latest_stock_price(
-                        symbol, calc_date_str, self.price_field
-                    )
-                    
-                    if latest_price_info:
-                        stale_dates.append({
-                            'date': calc_date_str,
-                            'latest_price_date': latest_price_info[0],
-                            'price': latest_price_info[1]
-                        })
-                    else:
-                        missing_dates.append(calc_date_str)
+            # 每个计算日截至当日最近一条价格的下标（价格按日期升序）
+            latest = np.searchsorted(price_dates, calc_dates, side='right') - 1
+            # 最近一条价格为空时视为无价格（与逐日查询的回退语义一致）
+            missing = np.isnan(prices[latest])
+            available = ~missing & (price_dates[latest] == calc_dates)
+            stale = ~missing & ~available
+            
+            available_days = int(available.sum())
+            stale_samples = []
+            for j in np.flatnonzero(stale)[:5]:
+                price_date, price = history[latest[j] - 1]
+                stale_samples.append({
+                    'date': date_strs[j],
+                    'latest_price_date': price_date,
+                    'price': price
+                })
             
             report[symbol] = {
                 'total_days': len(date_range),
-                'available_days': len(available_dates),
-                'stale_days': len(stale_dates),
-                'missing_days': len(missing_dates),
-                'coverage_pct': len(available_dates) / len(date_range) * 100,
-                'available_dates': available_dates[:5],  # 前5个示例
-                'missing_dates': missing_dates[:5],     # 前5个示例
-                'stale_dates': stale_dates[:5]          # 前5个示例
+                'available_days': available_days,
+                'stale_days': int(stale.sum()),
+                'missing_days': int(missing.sum()),
+                'coverage_pct': available_days / len(date_range) * 100,
+                'available_dates': [date_strs[j] for j in np.flatnonzero(available)[:5]],  # 前5个示例
+                'missing_dates': [date_strs[j] for j in np.flatnonzero(missing)[:5]],      # 前5个示例
+                'stale_dates': stale_samples                                                 # 前5个示例
             }
         
         return report
@@ -244,22 +337,17 @@ class PnLCalculator:
         Returns:
             Optional[tuple]: (price, price_date, is_stale) 或 None
         """
-        # 首先尝试获取当日价格
-        price = self.storage.get_stock_price_for_date(
-            symbol, valuation_date, self.price_field
-        )
-        
-        if price is not None:
-            return (price, valuation_date, False)
-        
-        # 如果当日无价格，尝试获取最近的交易日价格（回填策略）
+        # 一次查询截至当日（含）最近的价格：当日有价格时即为当日价格，否则回填最近交易日价格
         latest_price_info = self.storage.get_latest_stock_price(
             symbol, valuation_date, self.price_field
         )
         
         if latest_price_info:
             latest_date, latest_price = latest_price_info
-            self.logger.debug(f"使用回填价格: {symbol} {valuation_date} -> {latest_date} {latest_price}")
+            if latest_date == valuation_date:
+                return (latest_price, valuation_date, False)
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(f"使用回填价格: {symbol} {valuation_date} -> {latest_date} {latest_price}")
             return (latest_price, latest_date, True)
         
         return None
@@ -274,25 +362,25 @@ class PnLCalculator:
             symbols: 可选，指定股票代码列表，用于交易日过滤
             
         Returns:
-            List[date]: 日期列表
+            List[date]: 日期列表（同一实例内相同参数复用缓存结果，调用方不应修改）
         """
-        if self.only_trading_days:
-            return self._get_trading_days(start_date, end_date, symbols)
-        else:
-            return self._get_natural_days(start_date, end_date)
+        key = (start_date, end_date, frozenset(symbols or ()), self.only_trading_days)
+        date_range = self._date_range_cache.get(key)
+        if date_range is None:
+            if self.only_trading_days:
+                date_range = self._get_trading_days(start_date, end_date, symbols)
+            else:
+                date_range = self._get_natural_days(start_date, end_date)
+            self._date_range_cache[key] = date_range
+        return date_range
     
     def _get_natural_days(self, start_date: str, end_date: str) -> List[date]:
-        """生成自然日期范围"""
-        start = datetime.strptime(start_date, '%Y-%m-%d').date()
-        end = datetime.strptime(end_date, '%Y-%m-%d').date()
-        
-        dates = []
-        current_date = start
-        while current_date <= end:
-            dates.append(current_date)
-            current_date += timedelta(days=1)
+        """生成自然日期范围（含首尾）"""
+        start = np.datetime64(date.fromisoformat(start_date), 'D')
+        end = np.datetime64(date.fromisoformat(end_date), 'D')
         
-        return dates
+        # datetime64[D] 数组的 tolist() 直接产出 datetime.date
+        return np.arange(start, end + 1, dtype='datetime64[D]').tolist()
     
     def _get_trading_days(self, start_date: str, end_date: str, symbols: List[str] = None) -> List[date]:
         """
@@ -308,43 +396,24 @@ class PnLCalculator:
         """
         self._check_connection("_get_trading_days")
         
-        T = self.storage.config.Tables.STOCK_PRICES
-        F = self.storage.config.Fields
-        
-        if symbols:
-            # 获取指定symbols的联合交易日
-            placeholders = ','.join(['?' for _ in symbols])
-            sql = f"""
-            SELECT DISTINCT {F.StockPrices.DATE} 
-            FROM {T} 
-            WHERE {F.StockPrices.DATE} >= ? AND {F.StockPrices.DATE} <= ?
-            AND {F.SYMBOL} IN ({placeholders})
-            ORDER BY {F.StockPrices.DATE}
-            """
-            params = [start_date, end_date] + symbols
-        else:
-            # 获取时间范围内的所有交易日（去重）
-            sql = f"""
-            SELECT DISTINCT {F.StockPrices.DATE} 
-            FROM {T} 
-            WHERE {F.StockPrices.DATE} >= ? AND {F.StockPrices.DATE} <= ?
-            ORDER BY {F.StockPrices.DATE}
-            """
-            params = [start_date, end_date]
-        
-        self.storage.cursor.execute(sql, params)
-        rows = self.storage.cursor.fetchall()
-        
-        # 转换为date对象
+        # 指定symbols时为其联合交易日，否则为时间范围内所有股票的交易日（去重、升序）
+        rows = self.storage.get_trading_days(start_date, end_date, symbols)
+        
+        # 转换为date对象：库中日期均为 YYYY-MM-DD，整体转换一次；
+        # 仅当出现非法日期时才退回逐行过滤并记录警告
+        try:
+            return [date.fromisoformat(day) for day in rows]
+        except ValueError:
+            return self._parse_valid_dates(rows)
+    
+    def _parse_valid_dates(self, date_strs) -> List[date]:
+        """逐个解析日期字符串，跳过非法值"""
         trading_days = []
-        for row in rows:
+        for date_str in date_strs:
             try:
-                trading_day = datetime.strptime(row[0], '%Y-%m-%d').date()
-                trading_days.append(trading_day)
+                trading_days.append(date.fromisoformat(date_str))
             except ValueError:
-                self.logger.warning(f"无效的日期格式: {row[0]}")
-                continue
-        
+                self.logger.warning(f"无效的日期格式: {date_str}")
         return trading_days
     
     def _check_connection(self, method_name: str):
@@ -356,30 +425,30 @@ class PnLCalculator:
         """校验计算输入参数"""
         # 日期格式校验
         try:
-            start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-            end_dt = datetime.strptime(end_date, '%Y-%m-%d')
+            start_dt = date.fromisoformat(start_date)
+            end_dt = date.fromisoformat(end_date)
         except ValueError as e:
             raise ValueError(f"盈亏计算错误：日期格式错误，应为YYYY-MM-DD。开始日期: {start_date}，结束日期: {end_date}")
         
         # 日期逻辑校验
-        if start_dt.date() > end_dt.date():
+        if start_dt > end_dt:
             raise ValueError(f"盈亏计算错误：开始日期({start_date})不能晚于结束日期({end_date})")
         
         # 未来日期校验
-        today = datetime.now().date()
-        if start_dt.date() > today:
+        today = date.today()
+        if start_dt > today:
             raise ValueError(f"盈亏计算错误：不能计算未来日期的盈亏，当前日期: {today}，开始日期: {start_date}")
         
-        if end_dt.date() > today:
+        if end_dt > today:
             raise ValueError(f"盈亏计算错误：不能计算未来日期的盈亏，当前日期: {today}，结束日期: {end_date}")
         
         # 历史日期合理性校验
         min_date = date(1990, 1, 1)
-        if start_dt.date() < min_date:
+        if start_dt < min_date:
             raise ValueError(f"盈亏计算错误：开始日期不能早于1990-01-01，当前值: {start_date}")
         
         # 计算时间跨度限制（使用配置化的限制）
-        time_span = (end_dt.date() - start_dt.date()).days
+        time_span = (end_dt - start_dt).days
         if time_span > self.config.max_calculation_days:
             max_years = self.config.max_calculation_days // 365
             raise ValueError(f"盈亏计算错误：计算时间跨度不能超过{max_years}年({self.config.max_calculation_days}天)，当前跨度: {time_span}天")
\ No newline at end of file
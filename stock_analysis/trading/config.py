@@ -29,6 +29,31 @@ class MissingPriceStrategy(Enum):
     STRICT_FAIL = "strict_fail"   # 严格模式：缺失则失败
 
 
+# 成本法说明（模块级常量，避免每次调用重建）
+_COST_BASIS_DESCRIPTIONS = {
+    CostBasisMethod.AVERAGE_COST: (
+        "平均成本法：所有买入的平均价格作为成本基础。"
+        "卖出时按平均成本计算已实现盈亏。"
+        "适用于长期投资，计算简单。"
+    ),
+    CostBasisMethod.FIFO: (
+        "先进先出法：按买入时间顺序，先买入的先卖出。"
+        "卖出时按最早买入批次的成本计算已实现盈亏。"
+        "税务上常用，符合会计准则。"
+    ),
+    CostBasisMethod.LIFO: (
+        "后进先出法：按买入时间倒序，后买入的先卖出。"
+        "卖出时按最晚买入批次的成本计算已实现盈亏。"
+        "某些税务环境下有优势。"
+    ),
+    CostBasisMethod.SPECIFIC_ID: (
+        "指定批次法：手动指定卖出特定买入批次。"
+        "最灵活的方法，可优化税务效果。"
+        "需要详细记录和手动选择。"
+    )
+}
+
+
 @dataclass
 class TradingConfig:
     """交易模块配置"""
@@ -47,6 +72,8 @@ class TradingConfig:
     # 计算配置
     only_trading_days: bool = False  # 是否只在交易日计算盈亏
     recompute_window_days: int = 7   # 重算窗口天数
+    validate_pnl: bool = False       # 是否对逐日盈亏做批次重算校验（调试用）
+    parallel_workers: int = 1        # 批量盈亏计算的并行进程数（1为串行）
     
     # 精度配置
     price_precision: int = 4         # 价格精度（小数位）
@@ -64,6 +91,9 @@ class TradingConfig:
         if self.recompute_window_days < 1:
             raise ValueError("重算窗口天数必须大于0")
         
+        if self.parallel_workers < 1:
+            raise ValueError("并行进程数必须大于0")
+        
         if self.price_precision < 0 or self.price_precision > 10:
             raise ValueError("价格精度必须在0-10之间")
         
@@ -77,29 +107,7 @@ class TradingConfig:
     
     def get_cost_basis_description(self) -> str:
         """获取成本法描述"""
-        descriptions = {
-            CostBasisMethod.AVERAGE_COST: (
-                "平均成本法：所有买入的平均价格作为成本基础。"
-                "卖出时按平均成本计算已实现盈亏。"
-                "适用于长期投资，计算简单。"
-            ),
-            CostBasisMethod.FIFO: (
-                "先进先出法：按买入时间顺序，先买入的先卖出。"
-                "卖出时按最早买入批次的成本计算已实现盈亏。"
-                "税务上常用，符合会计准则。"
-            ),
-            CostBasisMethod.LIFO: (
-                "后进先出法：按买入时间倒序，后买入的先卖出。"
-                "卖出时按最晚买入批次的成本计算已实现盈亏。"
-                "某些税务环境下有优势。"
-            ),
-            CostBasisMethod.SPECIFIC_ID: (
-                "指定批次法：手动指定卖出特定买入批次。"
-                "最灵活的方法，可优化税务效果。"
-                "需要详细记录和手动选择。"
-            )
-        }
-        return descriptions.get(self.cost_basis_method, "未知成本法")
+        return _COST_BASIS_DESCRIPTIONS.get(self.cost_basis_method, "未知成本法")
     
     def round_price(self, price: float) -> float:
         """根据配置的精度舍入价格"""
@@ -110,12 +118,12 @@ class TradingConfig:
         return round(amount, self.amount_precision)
     
     def format_price(self, price: float) -> str:
-        """格式化价格为字符串"""
-        return f"{self.round_price(price):.{self.price_precision}f}"
+        """格式化价格为字符串（定点格式化本身即按精度舍入，无需先 round）"""
+        return f"{price:.{self.price_precision}f}"
     
     def format_amount(self, amount: float) -> str:
         """格式化金额为字符串"""
-        return f"{self.round_amount(amount):.{self.amount_precision}f}"
+        return f"{amount:.{self.amount_precision}f}"
     
     def to_dict(self) -> dict:
         """转换为字典"""
@@ -127,6 +135,8 @@ class TradingConfig:
             'allow_fractional_shares': self.allow_fractional_shares,
             'only_trading_days': self.only_trading_days,
             'recompute_window_days': self.recompute_window_days,
+            'validate_pnl': self.validate_pnl,
+            'parallel_workers': self.parallel_workers,
             'price_precision': self.price_precision,
             'amount_precision': self.amount_precision,
             'max_symbol_length': self.max_symbol_length,
@@ -147,6 +157,8 @@ class TradingConfig:
             allow_fractional_shares=data.get('allow_fractional_shares', False),
             only_trading_days=data.get('only_trading_days', False),
             recompute_window_days=data.get('recompute_window_days', 7),
+            validate_pnl=data.get('validate_pnl', False),
+            parallel_workers=data.get('parallel_workers', 1),
             price_precision=data.get('price_precision', 4),
             amount_precision=data.get('amount_precision', 2),
             max_symbol_length=data.get('max_symbol_length', 20),
@@ -3,13 +3,18 @@
 投资组合和持仓相关数据模型
 """
 
-from dataclasses import dataclass, field
+import sys
+from dataclasses import MISSING, dataclass, field, fields
 from datetime import datetime
-from typing import Optional
+from typing import Any, Optional
 from decimal import Decimal
 
 
-@dataclass
+# 批量计算会生成大量实例，Python 3.10+ 使用 __slots__ 省去每个实例的 __dict__
+_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_SLOTS)
 class Position:
     """股票持仓记录模型"""
     symbol: str                     # 股票代码
@@ -101,7 +106,7 @@ class Position:
         )
 
 
-@dataclass
+@dataclass(**_SLOTS)
 class DailyPnL:
     """每日盈亏记录模型"""
     symbol: str                     # 股票代码
@@ -140,6 +145,27 @@ class DailyPnL:
         if abs(self.unrealized_pnl - expected_unrealized_pnl) > 0.01:
             raise ValueError(f"未实现盈亏计算不一致: {self.unrealized_pnl} vs {expected_unrealized_pnl}")
 
+    @classmethod
+    def unchecked(cls, **values: Any) -> 'DailyPnL':
+        """
+        跳过 __post_init__ 一致性校验直接构造
+
+        仅用于计算器内部批量生成的记录（市值、未实现盈亏由同一组数据算出，校验必然通过）；
+        外部数据仍应走构造函数或 from_dict
+        """
+        obj = object.__new__(cls)
+        for f in fields(cls):
+            if f.name in values:
+                value = values[f.name]
+            elif f.default is not MISSING:
+                value = f.default
+            elif f.default_factory is not MISSING:
+                value = f.default_factory()
+            else:
+                raise TypeError(f"missing field {f.name}")
+            setattr(obj, f.name, value)
+        return obj
+
     def to_dict(self) -> dict:
         """转换为字典格式"""
         return {
@@ -8,6 +8,12 @@ from datetime import datetime
 from typing import Optional
 from decimal import Decimal
 
+from ..utils.decimal_utils import QUANTITY_PRECISION
+
+
+# DRIP 交易在 notes 中的标记（与 trading_manager 记录分红再投资时写入的前缀一致）
+DRIP_NOTE_MARKER = 'Dividend Reinvestment'
+
 
 @dataclass
 class PositionLot:
@@ -38,10 +44,15 @@ class PositionLot:
         """剩余持仓的总成本"""
         return self.remaining_quantity * self.cost_basis
     
+    @property
+    def is_drip(self) -> bool:
+        """是否为分红再投资(DRIP)批次（关联交易的notes包含DRIP标记）"""
+        return self.notes is not None and DRIP_NOTE_MARKER in self.notes
+    
     @property
     def is_fully_sold(self) -> bool:
         """是否已完全卖出"""
-        return self.remaining_quantity <= Decimal('0.0001')  # 考虑精度
+        return self.remaining_quantity <= QUANTITY_PRECISION  # 考虑精度
     
     @property
     def sold_quantity(self) -> Decimal:
@@ -50,7 +61,7 @@ class PositionLot:
     
     def can_sell(self, quantity: Decimal) -> bool:
         """检查是否可以从此批次卖出指定数量"""
-        return self.remaining_quantity >= quantity - Decimal('0.0001')  # 考虑精度
+        return self.remaining_quantity >= quantity - QUANTITY_PRECISION  # 考虑精度
     
     def sell_from_lot(self, quantity: Decimal) -> None:
         """从此批次卖出指定数量"""
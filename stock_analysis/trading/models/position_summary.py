@@ -43,25 +43,29 @@ class PositionSummary:
                 closed_lot_count=0
             )
 
-        # 计算汇总数据
-        active_lots = [lot for lot in lots if not lot.is_closed]
-        total_quantity = sum(lot.remaining_quantity for lot in active_lots)
-
-        # 计算总成本时排除DRIP交易（分红再投资不算新投入资金）
-        # DRIP批次的notes字段包含"Dividend Reinvestment"
-        total_cost = sum(
-            lot.total_cost for lot in active_lots
-            if not (hasattr(lot, 'notes') and lot.notes and 'Dividend Reinvestment' in lot.notes)
-        )
-        avg_cost = total_cost / total_quantity if total_quantity > 0 else 0.0
+        # 单次遍历累计数量、成本、日期范围和批次统计（累加起点和顺序与逐项 sum() 相同，
+        # 结果类型随批次字段为 float 或 Decimal 不变）
+        total_quantity = 0
+        total_cost = 0
+        lot_count = 0
+        first_buy_date = last_transaction_date = lots[0].purchase_date
+        for lot in lots:
+            purchase_date = lot.purchase_date
+            if purchase_date < first_buy_date:
+                first_buy_date = purchase_date
+            elif purchase_date > last_transaction_date:
+                last_transaction_date = purchase_date
+            
+            if lot.is_closed:
+                continue
+            lot_count += 1
+            total_quantity += lot.remaining_quantity
+            # 计算总成本时排除DRIP交易（分红再投资不算新投入资金）
+            if not lot.is_drip:
+                total_cost += lot.total_cost
         
-        # 日期信息
-        first_buy_date = min(lot.purchase_date for lot in lots)
-        last_transaction_date = max(lot.purchase_date for lot in lots)
-        
-        # 批次统计
-        lot_count = len(active_lots)
-        closed_lot_count = len([lot for lot in lots if lot.is_closed])
+        avg_cost = total_cost / total_quantity if total_quantity > 0 else 0.0
+        closed_lot_count = len(lots) - lot_count
         
         return cls(
             symbol=symbol,
@@ -5,10 +5,112 @@
 """
 
 from abc import ABC, abstractmethod
-from typing import List, Dict, Tuple
+from decimal import Decimal
+import functools
+from typing import Any, Callable, List, Dict, Iterable, Optional, Sequence, Tuple, TypeVar
 import logging
 
+import numpy as np
+
 from ..models.position_lot import PositionLot
+from ..utils.decimal_utils import QUANTITY_PRECISION
+
+# 批次数量类型：模型中为 Decimal，numba 编译版本处理 float
+_Quantity = TypeVar('_Quantity', float, Decimal)
+
+
+def _lot_order_key(lot: PositionLot) -> Tuple[str, int]:
+    """批次的时间顺序键：(购买日期, ID)，与存储层查询的 ORDER BY 一致"""
+    return (lot.purchase_date, lot.id or 0)
+
+
+def _match_in_order(lots: Iterable[PositionLot], sell_quantity: float, label: str,
+                    logger: logging.Logger) -> List[Tuple[PositionLot, float]]:
+    """按给定顺序依次从各批次卖出，直到凑满卖出数量（FIFO/LIFO 共用）"""
+    eps = 0.0001  # 考虑浮点精度
+    debug = logger.isEnabledFor(logging.DEBUG)
+    matches: List[Tuple[PositionLot, float]] = []
+    append = matches.append
+    remaining_to_sell = sell_quantity
+    
+    for lot in lots:
+        if remaining_to_sell <= eps:
+            break
+        
+        # 模型标注为 Decimal，从存储层读出时为 float，与卖出数量同类型运算
+        available: Any = lot.remaining_quantity
+        if available <= eps:
+            continue
+        
+        # 计算从此批次卖出的数量（相等时取 remaining_to_sell，与 min() 的返回一致）
+        quantity_from_lot = available if available < remaining_to_sell else remaining_to_sell
+        append((lot, quantity_from_lot))
+        remaining_to_sell -= quantity_from_lot
+        
+        if debug:
+            logger.debug(f"{label}匹配: 批次{lot.id} {quantity_from_lot:.4f}@{lot.cost_basis:.4f}")
+    
+    if remaining_to_sell > eps:
+        raise ValueError(f"{label}匹配失败: 还有{remaining_to_sell:.4f}未匹配")
+    
+    return matches
+
+
+def _allocate_pro_rata(remaining: Sequence[_Quantity],
+                       sell_quantity: _Quantity) -> Tuple[List[Tuple[int, _Quantity]], _Quantity]:
+    """
+    按各批次剩余数量比例分配卖出数量（最后一个批次承接全部剩余）
+    
+    Returns:
+        (分配列表[(批次下标, 数量)], 未分配数量)
+    """
+    total_available = 0 * sell_quantity  # 与输入同类型的0（Decimal/float）
+    for quantity in remaining:
+        total_available += quantity
+    
+    allocations = []
+    remaining_to_sell = sell_quantity
+    last = len(remaining) - 1
+    
+    for i in range(len(remaining)):
+        if remaining_to_sell <= 0.0001:
+            break
+        
+        quantity = remaining[i]
+        if quantity <= 0.0001:
+            continue
+        
+        # 计算该批次应分配的数量
+        if i == last:  # 最后一个批次，分配所有剩余
+            quantity_from_lot = remaining_to_sell
+        else:
+            ratio = quantity / total_available
+            quantity_from_lot = min(sell_quantity * ratio, quantity, remaining_to_sell)
+        
+        if quantity_from_lot > 0.0001:
+            allocations.append((i, quantity_from_lot))
+            remaining_to_sell -= quantity_from_lot
+    
+    return allocations, remaining_to_sell
+
+
+# 批次数达到该值时才使用 numba 编译版本：导入 numba 并加载编译缓存的一次性开销约数百毫秒，
+# 而一次普通卖出通常只涉及几个批次，纯 Python 实现只需微秒级
+_NUMBA_MIN_LOTS = 500
+
+
+@functools.lru_cache(maxsize=1)
+def _compiled_allocate_pro_rata() -> Optional[Callable[..., Tuple[List[Tuple[int, float]], float]]]:
+    """
+    首次需要时才导入 numba 并编译 _allocate_pro_rata（未安装 numba 时返回 None）
+
+    未开启 fastmath，编译版本与 Python 实现逐位一致
+    """
+    try:
+        from numba import njit
+    except ImportError:  # 可选依赖，未安装时使用纯 Python 实现
+        return None
+    return njit(cache=True)(_allocate_pro_rata)
 
 
 class CostBasisMatcher(ABC):
@@ -19,13 +121,16 @@ class CostBasisMatcher(ABC):
     
     @abstractmethod
     def match_lots_for_sale(self, available_lots: List[PositionLot], 
-                           sell_quantity: float) -> List[Tuple[PositionLot, float]]:
+                           sell_quantity: float,
+                           presorted: bool = False) -> List[Tuple[PositionLot, float]]:
         """
         为卖出交易匹配批次
         
         Args:
             available_lots: 可用的持仓批次列表
             sell_quantity: 要卖出的数量
+            presorted: available_lots 是否已按 (purchase_date, id) 升序排列
+                （存储层查询即按此排序返回），为True时时间顺序匹配器跳过排序
             
         Returns:
             List[Tuple[PositionLot, float]]: 匹配结果，每个元组包含(批次, 从该批次卖出的数量)
@@ -38,84 +143,46 @@ class CostBasisMatcher(ABC):
         from decimal import Decimal
         total_available = Decimal(str(sum(float(lot.remaining_quantity) for lot in available_lots)))
         sell_quantity = Decimal(str(sell_quantity))
-        return total_available >= sell_quantity - Decimal('0.0001')  # 考虑浮点精度
+        return total_available >= sell_quantity - QUANTITY_PRECISION  # 考虑浮点精度
 
 
 class FIFOMatcher(CostBasisMatcher):
     """先进先出匹配器"""
     
     def match_lots_for_sale(self, available_lots: List[PositionLot], 
-                           sell_quantity: float) -> List[Tuple[PositionLot, float]]:
+                           sell_quantity: float,
+                           presorted: bool = False) -> List[Tuple[PositionLot, float]]:
         """按购买日期从早到晚匹配批次"""
         if not self._validate_sufficient_quantity(available_lots, sell_quantity):
             raise ValueError(f"可用持仓数量不足: 需要{sell_quantity}, 可用{sum(lot.remaining_quantity for lot in available_lots)}")
         
-        # 按购买日期和ID排序（先进先出）
-        sorted_lots = sorted(
-            available_lots,
-            key=lambda lot: (lot.purchase_date, lot.id or 0)
-        )
+        # 按购买日期和ID排序（先进先出）；已排序的输入直接顺序遍历
+        if presorted:
+            sorted_lots = available_lots
+        else:
+            sorted_lots = sorted(available_lots, key=_lot_order_key)
         
-        matches = []
-        remaining_to_sell = sell_quantity
-        
-        for lot in sorted_lots:
-            if remaining_to_sell <= 0.0001:  # 考虑浮点精度
-                break
-            
-            if lot.remaining_quantity <= 0.0001:
-                continue
-            
-            # 计算从此批次卖出的数量
-            quantity_from_lot = min(remaining_to_sell, lot.remaining_quantity)
-            matches.append((lot, quantity_from_lot))
-            remaining_to_sell -= quantity_from_lot
-            
-            self.logger.debug(f"FIFO匹配: 批次{lot.id} {quantity_from_lot:.4f}@{lot.cost_basis:.4f}")
-        
-        if remaining_to_sell > 0.0001:
-            raise ValueError(f"FIFO匹配失败: 还有{remaining_to_sell:.4f}未匹配")
-        
-        return matches
+        return _match_in_order(sorted_lots, sell_quantity, 'FIFO', self.logger)
 
 
 class LIFOMatcher(CostBasisMatcher):
     """后进先出匹配器"""
     
     def match_lots_for_sale(self, available_lots: List[PositionLot], 
-                           sell_quantity: float) -> List[Tuple[PositionLot, float]]:
+                           sell_quantity: float,
+                           presorted: bool = False) -> List[Tuple[PositionLot, float]]:
         """按购买日期从晚到早匹配批次"""
         if not self._validate_sufficient_quantity(available_lots, sell_quantity):
             raise ValueError(f"可用持仓数量不足: 需要{sell_quantity}, 可用{sum(lot.remaining_quantity for lot in available_lots)}")
         
-        # 按购买日期和ID倒序排序（后进先出）
-        sorted_lots = sorted(
-            available_lots,
-            key=lambda lot: (lot.purchase_date, lot.id or 0),
-            reverse=True
-        )
+        # 按购买日期和ID倒序排序（后进先出）；已排序的输入直接逆序遍历
+        sorted_lots: Iterable[PositionLot]
+        if presorted:
+            sorted_lots = reversed(available_lots)
+        else:
+            sorted_lots = sorted(available_lots, key=_lot_order_key, reverse=True)
         
-        matches = []
-        remaining_to_sell = sell_quantity
-        
-        for lot in sorted_lots:
-            if remaining_to_sell <= 0.0001:  # 考虑浮点精度
-                break
-            
-            if lot.remaining_quantity <= 0.0001:
-                continue
-            
-            # 计算从此批次卖出的数量
-            quantity_from_lot = min(remaining_to_sell, lot.remaining_quantity)
-            matches.append((lot, quantity_from_lot))
-            remaining_to_sell -= quantity_from_lot
-            
-            self.logger.debug(f"LIFO匹配: 批次{lot.id} {quantity_from_lot:.4f}@{lot.cost_basis:.4f}")
-        
-        if remaining_to_sell > 0.0001:
-            raise ValueError(f"LIFO匹配失败: 还有{remaining_to_sell:.4f}未匹配")
-        
-        return matches
+        return _match_in_order(sorted_lots, sell_quantity, 'LIFO', self.logger)
 
 
 class SpecificLotMatcher(CostBasisMatcher):
@@ -131,32 +198,54 @@ class SpecificLotMatcher(CostBasisMatcher):
         super().__init__()
         self.specific_lots = specific_lots
         
-        # 验证指定批次格式
+        # 验证指定批次格式，并预先展开为 (lot_id, quantity) 元组，匹配时不再逐次查字典
+        specs = []
         for spec in specific_lots:
             if 'lot_id' not in spec or 'quantity' not in spec:
                 raise ValueError("指定批次必须包含 lot_id 和 quantity 字段")
             if spec['quantity'] <= 0:
                 raise ValueError("指定批次数量必须大于0")
+            try:
+                lot_id = int(spec['lot_id'])
+            except (TypeError, ValueError):
+                raise ValueError(f"无效的批次ID: {spec['lot_id']}")
+            specs.append((lot_id, spec['quantity']))
+        self._specs: Tuple[Tuple[int, float], ...] = tuple(specs)
+        self._lot_ids = frozenset(lot_id for lot_id, _ in specs)
     
     def match_lots_for_sale(self, available_lots: List[PositionLot], 
-                           sell_quantity: float) -> List[Tuple[PositionLot, float]]:
+                           sell_quantity: float,
+                           presorted: bool = False) -> List[Tuple[PositionLot, float]]:
         """按用户指定的批次和数量匹配"""
-        # 创建批次ID到批次对象的映射
-        lot_map = {lot.id: lot for lot in available_lots if lot.id is not None}
+        # 只为指定的批次建立ID映射，全部找到后提前结束扫描
+        lot_ids = self._lot_ids
+        lot_map = {}
+        for lot in available_lots:
+            if lot.id in lot_ids:
+                lot_map[lot.id] = lot
+                if len(lot_map) == len(lot_ids):
+                    break
         
+        return self.match_with_map(lot_map, sell_quantity)
+    
+    def match_with_map(self, lot_map: Dict[int, PositionLot],
+                       sell_quantity: float) -> List[Tuple[PositionLot, float]]:
+        """
+        按指定批次匹配（调用方已持有批次ID到批次的映射时使用，开销只与指定批次数有关）
+        
+        Args:
+            lot_map: 批次ID到可用批次的映射
+            sell_quantity: 要卖出的数量
+        """
         matches = []
-        total_specified = 0
+        total_specified: float = 0.0
         
-        for spec in self.specific_lots:
-            lot_id = spec['lot_id']
-            specified_quantity = spec['quantity']
-            
+        for lot_id, specified_quantity in self._specs:
             # 检查批次是否存在
-            if lot_id not in lot_map:
+            lot = lot_map.get(lot_id)
+            if lot is None:
                 raise ValueError(f"指定的批次 {lot_id} 不存在或不可用")
             
-            lot = lot_map[lot_id]
-            
             # 检查批次是否有足够的剩余数量
             if lot.remaining_quantity < specified_quantity - 0.0001:
                 raise ValueError(f"批次 {lot_id} 剩余数量不足: 需要{specified_quantity}, 剩余{lot.remaining_quantity}")
@@ -177,7 +266,8 @@ class AverageCostMatcher(CostBasisMatcher):
     """平均成本匹配器"""
     
     def match_lots_for_sale(self, available_lots: List[PositionLot], 
-                           sell_quantity: float) -> List[Tuple[PositionLot, float]]:
+                           sell_quantity: float,
+                           presorted: bool = False) -> List[Tuple[PositionLot, float]]:
         """
         平均成本法匹配
         按各批次数量比例分配卖出数量，实现类似平均成本的效果
@@ -185,30 +275,25 @@ class AverageCostMatcher(CostBasisMatcher):
         if not self._validate_sufficient_quantity(available_lots, sell_quantity):
             raise ValueError(f"可用持仓数量不足: 需要{sell_quantity}, 可用{sum(lot.remaining_quantity for lot in available_lots)}")
         
-        total_available = sum(lot.remaining_quantity for lot in available_lots)
-        matches = []
-        remaining_to_sell = sell_quantity
+        # 模型标注为 Decimal，从存储层读出时为 float，两种类型都按原样分配
+        remaining: List[Any] = [lot.remaining_quantity for lot in available_lots]
+        # 批次很多且均为 float 时使用 numba 编译版本
+        allocate_nb = (
+            _compiled_allocate_pro_rata()
+            if len(remaining) >= _NUMBA_MIN_LOTS and type(sell_quantity) is float
+            and all(type(quantity) is float for quantity in remaining)
+            else None
+        )
+        if allocate_nb is not None:
+            allocations, remaining_to_sell = allocate_nb(np.array(remaining), sell_quantity)
+        else:
+            allocations, remaining_to_sell = _allocate_pro_rata(remaining, sell_quantity)
         
-        # 按比例分配到各批次
-        for i, lot in enumerate(available_lots):
-            if remaining_to_sell <= 0.0001:
-                break
-            
-            if lot.remaining_quantity <= 0.0001:
-                continue
-            
-            # 计算该批次应分配的数量
-            if i == len(available_lots) - 1:  # 最后一个批次，分配所有剩余
-                quantity_from_lot = remaining_to_sell
-            else:
-                ratio = lot.remaining_quantity / total_available
-                quantity_from_lot = min(sell_quantity * ratio, lot.remaining_quantity, remaining_to_sell)
-            
-            if quantity_from_lot > 0.0001:
-                matches.append((lot, quantity_from_lot))
-                remaining_to_sell -= quantity_from_lot
-                
-                self.logger.debug(f"平均成本匹配: 批次{lot.id} {quantity_from_lot:.4f}@{lot.cost_basis:.4f}")
+        matches = []
+        for i, quantity_from_lot in allocations:
+            lot = available_lots[i]
+            matches.append((lot, quantity_from_lot))
+            self.logger.debug(f"平均成本匹配: 批次{lot.id} {quantity_from_lot:.4f}@{lot.cost_basis:.4f}")
         
         if remaining_to_sell > 0.0001:
             raise ValueError(f"平均成本匹配失败: 还有{remaining_to_sell:.4f}未匹配")
@@ -216,6 +301,15 @@ class AverageCostMatcher(CostBasisMatcher):
         return matches
 
 
+# 无参数匹配器的方法名 -> 类（'AVERAGE' 为CLI命名的别名）
+_MATCHER_CLASSES = {
+    'FIFO': FIFOMatcher,
+    'LIFO': LIFOMatcher,
+    'AVERAGECOST': AverageCostMatcher,
+    'AVERAGE': AverageCostMatcher,
+}
+
+
 def create_cost_basis_matcher(method: str, **kwargs) -> CostBasisMatcher:
     """
     创建成本基础匹配器
@@ -229,20 +323,13 @@ def create_cost_basis_matcher(method: str, **kwargs) -> CostBasisMatcher:
     """
     method = method.upper()
     
-    # 处理CLI命名与匹配器不一致的问题
-    if method == 'AVERAGE':
-        method = 'AVERAGECOST'
-    
-    if method == 'FIFO':
-        return FIFOMatcher()
-    elif method == 'LIFO':
-        return LIFOMatcher()
-    elif method == 'SPECIFICLOT':
+    if method == 'SPECIFICLOT':
         specific_lots = kwargs.get('specific_lots')
         if not specific_lots:
             raise ValueError("SpecificLot方法需要提供specific_lots参数")
         return SpecificLotMatcher(specific_lots)
-    elif method == 'AVERAGECOST':
-        return AverageCostMatcher()
-    else:
-        raise ValueError(f"不支持的成本基础方法: {method}")
\ No newline at end of file
+    
+    matcher_class = _MATCHER_CLASSES.get(method)
+    if matcher_class is None:
+        raise ValueError(f"不支持的成本基础方法: {method}")
+    return matcher_class()
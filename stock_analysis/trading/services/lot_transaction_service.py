@@ -15,6 +15,7 @@ from ..models.position_lot import PositionLot
 from ..models.sale_allocation import SaleAllocation
 from ..models.position_summary import PositionSummary
 from ..config import DEFAULT_TRADING_CONFIG
+from ..utils.decimal_utils import QUANTITY_PRECISION
 from .cost_basis_matcher import create_cost_basis_matcher
 
 
@@ -132,7 +133,8 @@ class LotTransactionService:
                 transaction_date, platform
             )
             
-            # 构造返回的交易对象
+            # 构造返回的交易对象（创建与更新时间取同一时刻）
+            now = datetime.now()
             transaction = Transaction(
                 symbol=symbol,
                 transaction_type='BUY',
@@ -143,8 +145,8 @@ class LotTransactionService:
                 external_id=external_id,
                 notes=notes,
                 id=transaction_id,
-                created_at=datetime.now(),
-                updated_at=datetime.now()
+                created_at=now,
+                updated_at=now
             )
             
             self.logger.info(f"✅ 买入交易记录成功: ID={transaction_id}")
@@ -201,7 +203,7 @@ class LotTransactionService:
         with self.storage.transaction():
             # 1. 验证总持仓是否足够
             total_available = Decimal(str(sum(float(lot.remaining_quantity) for lot in available_lots)))
-            if total_available < quantity - Decimal('0.0001'):
+            if total_available < quantity - QUANTITY_PRECISION:
                 raise ValueError(f"持仓数量不足: 需要{quantity}, 可用{total_available}")
             
             # 2. 创建卖出交易记录
@@ -227,10 +229,12 @@ class LotTransactionService:
                 matcher_kwargs['specific_lots'] = specific_lots
             
             matcher = create_cost_basis_matcher(cost_basis_method, **matcher_kwargs)
-            matches = matcher.match_lots_for_sale(available_lots, quantity)
+            # get_position_lots 已按 (purchase_date, id) 排序返回，匹配器无需再排序
+            matches = matcher.match_lots_for_sale(available_lots, quantity, presorted=True)
             
-            # 4. 处理每个匹配，创建分配记录并更新批次
+            # 4. 处理每个匹配，创建分配记录并收集批次更新
             total_realized_pnl = Decimal('0.0')
+            lot_updates = []
             
             for lot, quantity_sold in matches:
                 # 计算已实现盈亏
@@ -248,10 +252,10 @@ class LotTransactionService:
                 
                 allocation_id = self.storage.create_sale_allocation(allocation_data)
                 
-                # 更新批次剩余数量
+                # 收集批次剩余数量更新，循环结束后一次性写入
                 new_remaining = lot.remaining_quantity - quantity_sold
-                is_closed = new_remaining <= Decimal('0.0001')
-                self.storage.update_lot_remaining_quantity(lot.id, new_remaining, is_closed)
+                is_closed = new_remaining <= QUANTITY_PRECISION
+                lot_updates.append((new_remaining, is_closed, lot.id))
                 
                 # 累计已实现盈亏
                 total_realized_pnl += realized_pnl
@@ -259,10 +263,14 @@ class LotTransactionService:
                 self.logger.debug(f"    🔄 分配: 批次{lot.id} 卖出{quantity_sold:.4f}, "
                                 f"成本{lot.cost_basis:.4f}, 盈亏{realized_pnl:.2f}")
             
+            # 批量更新批次剩余数量与关闭状态
+            self.storage.apply_lot_sales(lot_updates)
+            
             # 5. 更新当日已实现盈亏到daily_pnl（在同一事务中）
             self._update_daily_realized_pnl(symbol, transaction_date, total_realized_pnl)
             
-            # 构造返回的交易对象
+            # 构造返回的交易对象（创建与更新时间取同一时刻）
+            now = datetime.now()
             transaction = Transaction(
                 symbol=symbol,
                 transaction_type='SELL',
@@ -273,8 +281,8 @@ class LotTransactionService:
                 external_id=external_id,
                 notes=notes,
                 id=transaction_id,
-                created_at=datetime.now(),
-                updated_at=datetime.now()
+                created_at=now,
+                updated_at=now
             )
             
             self.logger.info(f"✅ 卖出交易记录成功: ID={transaction_id}, "
@@ -345,7 +353,7 @@ class LotTransactionService:
     def get_position_lots(self, symbol: str = None,
                          active_only: bool = True) -> List[PositionLot]:
         """获取用户的持仓批次"""
-        lots_data = self.storage.get_position_lots(symbol, active_only=True)
+        lots_data = self.storage.get_position_lots(symbol, active_only=active_only)
 
         lots = []
         for lot_data in lots_data:
@@ -435,7 +443,7 @@ class LotTransactionService:
             remaining_as_of_date = original_quantity - total_sold
 
             # 只包含在截止日期时还有剩余的批次
-            if remaining_as_of_date > Decimal('0.0001'):
+            if remaining_as_of_date > QUANTITY_PRECISION:
                 lot = PositionLot(
                     id=lot_data['id'],
                     symbol=lot_data['symbol'],
@@ -749,7 +757,7 @@ class LotTransactionService:
                 
                 # 验证分配数量总和是否等于卖出数量
                 total_allocated = sum(alloc.quantity_sold for alloc in allocations)
-                if abs(total_allocated - sell_txn['quantity']) > Decimal('0.0001'):  # 允许小的浮点误差
+                if abs(total_allocated - sell_txn['quantity']) > QUANTITY_PRECISION:  # 允许小的浮点误差
                     issues.append({
                         'type': 'allocation_quantity_mismatch',
                         'symbol': sym,
@@ -27,14 +27,19 @@ def to_decimal(value: Union[float, int, str, Decimal], precision: int = 4) -> De
     
     if isinstance(value, float):
         # 避免float精度问题，先转为字符串再转Decimal
-        return Decimal(f"{value:.{precision + 2}f}").quantize(
-            Decimal('0.' + '0' * precision), 
-            rounding=ROUND_HALF_UP
-        )
+        # 精度0的舍入单位 Decimal('0') 为假值，需按 None 判断是否命中缓存
+        quantizer = _QUANTIZERS.get(precision)
+        if quantizer is None:
+            quantizer = Decimal('0.' + '0' * precision)
+        return Decimal(f"{value:.{precision + 2}f}").quantize(quantizer, rounding=ROUND_HALF_UP)
     
     raise ValueError(f"无法将类型 {type(value)} 转换为Decimal")
 
 
+# 常用精度的舍入单位（float转换时复用，避免每次重建）
+_QUANTIZERS = {precision: Decimal('0.' + '0' * precision) for precision in range(11)}
+
+
 def to_financial_decimal(value: Union[float, int, str, Decimal]) -> Decimal:
     """
     转换为金融精度的Decimal（2位小数，适合金额）
@@ -58,6 +63,9 @@ def to_quantity_decimal(value: Union[float, int, str, Decimal]) -> Decimal:
     Returns:
         Decimal: 数量精度的Decimal值
     """
+    # float 为导入时的常见输入，直接舍入，省去一层 to_decimal 调用
+    if type(value) is float:
+        return Decimal(f"{value:.6f}").quantize(_QUANTIZERS[4], rounding=ROUND_HALF_UP)
     return to_decimal(value, precision=4)
 
 
@@ -71,6 +79,9 @@ def to_price_decimal(value: Union[float, int, str, Decimal]) -> Decimal:
     Returns:
         Decimal: 价格精度的Decimal值
     """
+    # float 为导入时的常见输入，直接舍入，省去一层 to_decimal 调用
+    if type(value) is float:
+        return Decimal(f"{value:.6f}").quantize(_QUANTIZERS[4], rounding=ROUND_HALF_UP)
     return to_decimal(value, precision=4)
 
 
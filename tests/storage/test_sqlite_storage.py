@@ -0,0 +1,559 @@
+#!/usr/bin/env python3
+import sqlite3
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from stock_analysis.data.storage import SQLiteStorage, sqlite_storage
+from stock_analysis.data.storage.base import BaseStorage
+
+
+def _query_plan(storage: SQLiteStorage, sql: str, params: list) -> str:
+    rows = storage.connection.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return "\n".join(row[-1] for row in rows)
+
+
+def test_sale_allocations_queries_use_indexes():
+    storage = SQLiteStorage(":memory:")
+    try:
+        by_symbol = _query_plan(storage, storage._sale_allocations_sql[(True, False)], ["AAPL"])
+        assert "idx_sale_allocations_lot" in by_symbol
+
+        by_txn = _query_plan(storage, storage._sale_allocations_sql[(False, True)], [1])
+        assert "idx_sale_allocations_transaction" in by_txn
+    finally:
+        storage.close()
+
+
+def test_price_and_statement_reads_use_covering_indexes():
+    storage = SQLiteStorage(":memory:")
+    try:
+        prices = _query_plan(
+            storage,
+            "SELECT date, open, high, low, close, volume, adj_close FROM stock_prices "
+            "WHERE symbol = ? AND date >= ? ORDER BY date",
+            ["AAPL", "2024-01-01"],
+        )
+        assert "COVERING INDEX idx_stock_prices_cover" in prices
+
+        statement = _query_plan(
+            storage,
+            "SELECT period, metric_name, metric_value FROM income_statement "
+            "WHERE symbol = ? ORDER BY period DESC",
+            ["AAPL"],
+        )
+        assert "COVERING INDEX idx_income_statement_cover" in statement
+    finally:
+        storage.close()
+
+
+def test_store_stock_data_rolls_back_whole_payload_on_error():
+    storage = SQLiteStorage(":memory:")
+    try:
+        payload = {
+            "basic_info": {"company_name": "Apple", "sector": "", "industry": "",
+                           "market_cap": 0, "employees": 0, "description": ""},
+            "price_data": {"dates": ["2024-01-02"]},  # 缺少价格列，写入中途失败
+        }
+        assert storage.store_stock_data("AAPL", payload) is False
+
+        cursor = storage.connection.execute("SELECT company_name FROM stocks")
+        assert cursor.fetchall() == [("",)]
+        cursor = storage.connection.execute("SELECT COUNT(*) FROM stock_prices")
+        assert cursor.fetchone()[0] == 0
+        cursor = storage.connection.execute("SELECT status FROM download_logs")
+        assert [row[0] for row in cursor.fetchall()] == ["failed"]
+    finally:
+        storage.close()
+
+
+
+def test_store_returns_false_when_failure_log_cannot_be_written(monkeypatch):
+    storage = SQLiteStorage(":memory:")
+    try:
+        def locked(*args, **kwargs):
+            raise sqlite3.OperationalError("database is locked")
+
+        # 写入与失败日志的补写都因锁失败：方法仍按声明返回 False，而不是抛出 sqlite3 异常
+        monkeypatch.setattr(storage, "_store_price_data_batch", locked)
+        monkeypatch.setattr(storage, "ensure_stock_exists", locked)
+        price_data = {"dates": ["2024-01-02"], "open": [1.0], "high": [1.0], "low": [1.0],
+                      "close": [1.0], "volume": [1], "adj_close": [1.0]}
+        assert storage.store_stock_data("AAPL", {"price_data": price_data}) is False
+
+        monkeypatch.setattr(storage, "_store_basic_info", locked)
+        basic_info = {"company_name": "Apple", "sector": "", "industry": "",
+                      "market_cap": 0, "employees": 0, "description": ""}
+        assert storage.store_financial_data("AAPL", {"basic_info": basic_info}) is False
+    finally:
+        storage.close()
+
+def test_price_summary_matches_full_stock_data():
+    storage = SQLiteStorage(":memory:")
+    try:
+        closes = [10.0, 12.5, 11.0, 13.25]
+        storage.store_stock_data("AAPL", {
+            "price_data": {
+                "dates": ["2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05"],
+                "open": closes, "high": closes, "low": closes, "close": closes,
+                "volume": [100, 200, 300, 400], "adj_close": closes,
+            },
+        })
+
+        full = storage.get_stock_data("AAPL").summary_stats
+        summary = storage.get_price_summary("AAPL")
+        assert summary["data_points"] == 4
+        assert (summary["start_date"], summary["end_date"]) == ("2024-01-02", "2024-01-05")
+        stats = summary["summary_stats"]
+        assert stats.total_volume == full.total_volume == 1000
+        assert stats.mean_price == pytest.approx(full.mean_price)
+        assert stats.std_price == pytest.approx(full.std_price)
+        assert storage.get_price_summary("MSFT") is None
+
+        # 收盘价为 NULL 的行计入 data_points，但不参与均值和标准差
+        closes = [10.0, None, 12.0, 14.0]
+        storage.store_stock_data("MSFT", {
+            "price_data": {
+                "dates": ["2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05"],
+                "open": closes, "high": closes, "low": closes, "close": closes,
+                "volume": [1, 2, 3, 4], "adj_close": closes,
+            },
+        })
+        full = storage.get_stock_data("MSFT").summary_stats
+        for summary in (storage.get_price_summary("MSFT"),
+                        storage.get_price_summary("MSFT", start_date="2024-01-01")):
+            assert summary["data_points"] == 4
+            assert summary["summary_stats"].mean_price == pytest.approx(full.mean_price) == 12.0
+            assert summary["summary_stats"].std_price == pytest.approx(full.std_price) == 2.0
+    finally:
+        storage.close()
+
+
+
+def test_base_price_df_default_matches_sqlite_query():
+    storage = SQLiteStorage(":memory:")
+    try:
+        closes = [10.0, 12.5, 11.0]
+        storage.store_stock_data("AAPL", {
+            "price_data": {
+                "dates": ["2024-01-02", "2024-01-03", "2024-01-04"],
+                "open": closes, "high": closes, "low": closes, "close": closes,
+                "volume": [100, 200, 300], "adj_close": closes,
+            },
+        })
+
+        # BaseStorage 的默认实现经 get_stock_data 转换，结果应与 SQLite 的直接查询一致
+        default = BaseStorage.get_price_df(storage, "AAPL", start_date="2024-01-03")
+        pd.testing.assert_frame_equal(default, storage.get_price_df("AAPL", start_date="2024-01-03"))
+        assert list(default["date"]) == ["2024-01-03", "2024-01-04"]
+        assert BaseStorage.get_price_df(storage, "MSFT") is None
+    finally:
+        storage.close()
+
+def test_reads_from_other_threads_use_their_own_connection(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "stock.db"))
+    try:
+        storage.ensure_stock_exists("AAPL")
+        seen = {}
+
+        def read():
+            seen["symbols"] = storage.get_existing_symbols()
+            seen["connection"] = storage._get_query_manager().connection
+
+        worker = threading.Thread(target=read)
+        worker.start()
+        worker.join()
+
+        assert seen["symbols"] == ["AAPL"]
+        assert seen["connection"] is not storage.connection
+        assert storage._get_query_manager() is storage.query_manager
+    finally:
+        storage.close()
+
+
+def test_trading_writes_wait_for_the_write_lock(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "stock.db"))
+    try:
+        storage.ensure_stock_exists("AAPL")
+        record = {
+            "symbol": "AAPL", "valuation_date": "2024-01-02", "quantity": 10,
+            "avg_cost": 100, "market_price": 110, "market_value": 1100,
+            "unrealized_pnl": 100, "unrealized_pnl_pct": 0.1, "total_cost": 1000,
+        }
+        writes = [
+            lambda: storage.upsert_daily_pnl(record),
+            lambda: storage.apply_lot_sales([(0.0, True, 1)]),
+            lambda: storage.upsert_transaction({
+                "symbol": "AAPL", "transaction_type": "BUY", "quantity": 1,
+                "price": 1, "transaction_date": "2024-01-02",
+            }),
+        ]
+        for write in writes:
+            done = threading.Event()
+            worker = threading.Thread(target=lambda: (write(), done.set()))
+            with storage._write_lock:
+                worker.start()
+                # 持有写锁期间其他线程的写入必须等待
+                assert not done.wait(0.1)
+            worker.join(5)
+            assert done.is_set()
+    finally:
+        storage.close()
+
+
+def test_download_logs_are_buffered_until_flush(tmp_path):
+    db_path = str(tmp_path / "stock.db")
+    storage = SQLiteStorage(db_path)
+    storage.ensure_stock_exists("AAPL")
+    storage.store_data_quality("AAPL", {"data_completeness": 1.0})
+
+    def logged():
+        with sqlite3.connect(db_path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM download_logs").fetchone()[0]
+
+    assert logged() == 0
+    storage.close()
+    assert logged() == 1
+
+
+def test_failed_log_inside_transaction_survives_rollback(tmp_path):
+    db_path = str(tmp_path / "stock.db")
+    storage = SQLiteStorage(db_path)
+    try:
+        storage.ensure_stock_exists("AAPL")
+        with pytest.raises(RuntimeError):
+            with storage.transaction():
+                storage._log_download("AAPL", "stock", "failed", 0, "boom")
+                raise RuntimeError("outer failure")
+
+        with sqlite3.connect(db_path) as conn:
+            rows = conn.execute("SELECT status, error_message FROM download_logs").fetchall()
+        assert rows == [("failed", "boom")]
+    finally:
+        storage.close()
+
+
+def test_storages_share_one_exit_hook(monkeypatch, tmp_path):
+    registered = []
+    monkeypatch.setattr(sqlite_storage.atexit, "register", registered.append)
+    storage = SQLiteStorage(str(tmp_path / "stock.db"))
+    assert registered == []
+    assert storage in sqlite_storage._LIVE_STORAGES
+    storage.close()
+    assert storage not in sqlite_storage._LIVE_STORAGES
+
+
+def test_key_metrics_projection_keeps_columns_from_each_statement():
+    storage = SQLiteStorage(":memory:")
+    try:
+        storage.store_financial_data("AAPL", {
+            "basic_info": {},
+            "financial_statements": {
+                "income_statement": {
+                    "statement_type": "income_statement",
+                    "periods": ["2023-12-31", "2022-12-31"],
+                    "items": {"Net sales": [120.0, 100.0], "Net income": [12.0, None]},
+                },
+                "balance_sheet": {
+                    "statement_type": "balance_sheet",
+                    "periods": ["2023-12-31"],
+                    "items": {"Total shareholders’ equity": [60.0]},
+                },
+            },
+        })
+
+        metrics = storage.get_key_metrics("AAPL")
+        assert list(metrics["period"]) == ["2023-12-31", "2022-12-31"]
+        latest = metrics.iloc[0]
+        assert (latest["revenue"], latest["net_income"], latest["total_equity"]) == (120.0, 12.0, 60.0)
+        assert metrics.iloc[1]["revenue"] == 100.0
+    finally:
+        storage.close()
+
+
+def test_iter_prices_streams_rows_in_chunks():
+    storage = SQLiteStorage(":memory:")
+    try:
+        dates = [f"2024-01-0{day}" for day in range(2, 7)]
+        closes = [10.0, 11.0, 12.0, 13.0, 14.0]
+        storage.store_stock_data("AAPL", {
+            "price_data": {
+                "dates": dates, "open": closes, "high": closes, "low": closes,
+                "close": closes, "volume": [100] * 5, "adj_close": closes,
+            },
+        })
+
+        chunks = list(storage.iter_prices("AAPL", start_date="2024-01-03", chunk_size=2))
+        assert [len(chunk) for chunk in chunks] == [2, 2]
+        assert chunks[0][0] == ("2024-01-03", 11.0, 11.0, 11.0, 11.0, 100, 11.0)
+
+        stock = storage.get_stock_data("AAPL")
+        assert stock.price_data.dates == dates
+        assert stock.price_data.volume == [100] * 5
+        assert (stock.start_date, stock.end_date) == ("2024-01-02", "2024-01-06")
+    finally:
+        storage.close()
+
+
+def test_upsert_daily_pnls_writes_batch_and_updates_existing_rows():
+    storage = SQLiteStorage(":memory:")
+    try:
+        storage.ensure_stock_exists("AAPL")
+        record = {
+            "symbol": "AAPL", "valuation_date": "2024-01-02", "quantity": 10,
+            "avg_cost": 100, "market_price": 110, "market_value": 1100,
+            "unrealized_pnl": 100, "unrealized_pnl_pct": 0.1, "total_cost": 1000,
+        }
+        assert storage.upsert_daily_pnls([record, {**record, "valuation_date": "2024-01-03"}]) == 2
+        assert storage.upsert_daily_pnls([{**record, "market_price": 120}]) == 1
+
+        cursor = storage.connection.execute(
+            "SELECT valuation_date, market_price FROM daily_pnl ORDER BY valuation_date"
+        )
+        assert cursor.fetchall() == [("2024-01-02", 120.0), ("2024-01-03", 110.0)]
+    finally:
+        storage.close()
+
+
+def test_mmap_size_is_configurable(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "stock.db"), mmap_size=0)
+    try:
+        assert storage.connection.execute("PRAGMA mmap_size").fetchone()[0] == 0
+    finally:
+        storage.close()
+
+    with pytest.raises(ValueError):
+        SQLiteStorage(str(tmp_path / "stock.db"), mmap_size=-1)
+
+
+def test_market_data_tables_skip_autoincrement_sequence():
+    storage = SQLiteStorage(":memory:")
+    try:
+        storage.ensure_stock_exists("AAPL")
+        storage.store_data_quality("AAPL", {"data_completeness": 1.0})
+        storage._flush_logs()
+
+        # 交易表仍使用 AUTOINCREMENT，sqlite_sequence 始终存在
+        cursor = storage.connection.execute("SELECT name FROM sqlite_sequence")
+        assert "download_logs" not in {row[0] for row in cursor.fetchall()}
+    finally:
+        storage.close()
+
+
+def test_bulk_load_drops_and_restores_secondary_indexes():
+    storage = SQLiteStorage(":memory:")
+
+    def indexes():
+        cursor = storage.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'stock_prices'"
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+    try:
+        before = indexes()
+        with storage.bulk_load():
+            assert "idx_stock_prices_cover" not in indexes()
+            storage.store_stock_data("AAPL", {
+                "price_data": {
+                    "dates": ["2024-01-02"], "open": [1.0], "high": [1.0], "low": [1.0],
+                    "close": [1.0], "volume": [1], "adj_close": [1.0],
+                },
+            })
+        assert indexes() == before
+        assert storage.get_stock_data("AAPL").data_points == 1
+    finally:
+        storage.close()
+
+
+
+def test_bulk_load_interrupted_indexes_rebuilt_on_next_connect(tmp_path):
+    db_path = str(tmp_path / "stock.db")
+
+    def indexes(storage):
+        cursor = storage.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'stock_prices'"
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+    storage = SQLiteStorage(db_path)
+    before = indexes(storage)
+    storage.close()
+
+    # 子进程进入批量导入后直接退出，模拟重建索引前进程终止
+    script = (
+        "import os\n"
+        "from stock_analysis.data.storage import SQLiteStorage\n"
+        f"storage = SQLiteStorage({db_path!r})\n"
+        "with storage.bulk_load():\n"
+        "    os._exit(0)\n"
+    )
+    subprocess.run([sys.executable, "-c", script], check=True,
+                   cwd=Path(__file__).resolve().parents[2])
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == 0
+        assert "idx_stock_prices_cover" not in {
+            row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        }
+    finally:
+        conn.close()
+
+    storage = SQLiteStorage(db_path)
+    try:
+        assert indexes(storage) == before
+        version = storage.connection.execute("PRAGMA user_version").fetchone()[0]
+        assert version == storage.config.SCHEMA_VERSION
+    finally:
+        storage.close()
+
+
+def test_price_summary_uses_stats_refreshed_on_every_write():
+    storage = SQLiteStorage(":memory:")
+
+    def store(dates, closes):
+        storage.store_stock_data("AAPL", {
+            "price_data": {
+                "dates": dates, "open": closes, "high": closes, "low": closes,
+                "close": closes, "volume": [10] * len(dates), "adj_close": closes,
+            },
+        })
+
+    try:
+        store(["2024-01-02", "2024-01-03"], [10.0, 20.0])
+        store(["2024-01-03", "2024-01-04"], [5.0, 30.0])  # 覆盖 01-03 的收盘价
+
+        cursor = storage.connection.execute(
+            "SELECT data_points, min_close, max_close FROM price_stats WHERE symbol = 'AAPL'"
+        )
+        assert cursor.fetchone() == (3, 5.0, 30.0)
+
+        summary = storage.get_price_summary("AAPL")
+        ranged = storage.get_price_summary("AAPL", start_date="2024-01-01")
+        assert summary["data_points"] == ranged["data_points"] == 3
+        assert summary["summary_stats"].total_volume == 30
+        assert summary["summary_stats"].mean_price == pytest.approx(15.0)
+        assert summary["summary_stats"].std_price == pytest.approx(ranged["summary_stats"].std_price)
+    finally:
+        storage.close()
+
+
+
+def test_upgrade_rebuilds_price_stats_without_close_count(tmp_path):
+    db_path = str(tmp_path / "stock.db")
+    closes = [10.0, None, 12.0, 14.0]
+    storage = SQLiteStorage(db_path)
+    try:
+        storage.store_stock_data("AAPL", {
+            "price_data": {
+                "dates": ["2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05"],
+                "open": closes, "high": closes, "low": closes, "close": closes,
+                "volume": [1, 2, 3, 4], "adj_close": closes,
+            },
+        })
+        # 模拟旧版本数据库：price_stats 没有 close_count 列
+        storage.connection.executescript(
+            "DROP TABLE price_stats;"
+            "CREATE TABLE price_stats (symbol TEXT PRIMARY KEY, data_points INTEGER NOT NULL, "
+            "start_date TEXT, end_date TEXT, mean_close REAL, min_close REAL, max_close REAL, "
+            "total_volume INTEGER, sum_close_sq REAL, updated_at TIMESTAMP);"
+            "PRAGMA user_version = 3;"
+        )
+    finally:
+        storage.close()
+
+    storage = SQLiteStorage(db_path)
+    try:
+        cursor = storage.connection.execute(
+            "SELECT data_points, close_count FROM price_stats WHERE symbol = 'AAPL'"
+        )
+        assert cursor.fetchone() == (4, 3)
+        assert storage.get_price_summary("AAPL")["summary_stats"].std_price == pytest.approx(2.0)
+    finally:
+        storage.close()
+
+def test_get_stock_prices_bulk_includes_prior_row_for_backfill():
+    storage = SQLiteStorage(":memory:")
+    try:
+        closes = [10.0, 11.0, 12.0]
+        storage.store_stock_data("AAPL", {
+            "price_data": {
+                "dates": ["2024-01-02", "2024-01-05", "2024-01-08"], "open": closes,
+                "high": closes, "low": closes, "close": closes, "volume": [1] * 3,
+                "adj_close": closes,
+            },
+        })
+
+        prices = storage.get_stock_prices_bulk(["AAPL", "MSFT"], "2024-01-04", "2024-01-06", "close")
+        assert prices == {"AAPL": [("2024-01-02", 10.0), ("2024-01-05", 11.0)]}
+    finally:
+        storage.close()
+
+
+def test_has_stock_prices_respects_backfill_window():
+    storage = SQLiteStorage(":memory:")
+    storage.IN_CLAUSE_CHUNK_SIZE = 1  # 强制跨块探测
+    try:
+        storage.store_stock_data("MSFT", {
+            "price_data": {
+                "dates": ["2024-01-02"], "open": [1.0], "high": [1.0], "low": [1.0],
+                "close": [1.0], "volume": [1], "adj_close": [1.0],
+            },
+        })
+
+        assert storage.has_stock_prices(["AAPL", "MSFT"], "2024-01-10")
+        assert not storage.has_stock_prices(["AAPL", "MSFT"], "2024-01-10", "2024-01-05")
+        assert not storage.has_stock_prices(["MSFT"], "2024-01-01")
+        assert not storage.has_stock_prices(["AAPL"], "2024-01-10")
+    finally:
+        storage.close()
+
+
+def test_symbol_chunks_pad_to_power_of_two_and_trading_days_union():
+    storage = SQLiteStorage(":memory:")
+    try:
+        chunks = list(storage._iter_symbol_chunks(["MSFT", "AAPL", "GOOG", "AAPL"]))
+        assert chunks == [("?,?,?,?", ["AAPL", "GOOG", "MSFT", "MSFT"])]
+
+        for symbol, dates in (("AAPL", ["2024-01-02", "2024-01-03"]), ("MSFT", ["2024-01-03", "2024-01-04"])):
+            closes = [1.0] * len(dates)
+            storage.store_stock_data(symbol, {
+                "price_data": {
+                    "dates": dates, "open": closes, "high": closes, "low": closes,
+                    "close": closes, "volume": [1] * len(dates), "adj_close": closes,
+                },
+            })
+
+        storage.IN_CLAUSE_CHUNK_SIZE = 1  # 强制跨块合并
+        assert storage.get_trading_days("2024-01-01", "2024-01-31", ["MSFT", "AAPL"]) == [
+            "2024-01-02", "2024-01-03", "2024-01-04"]
+        assert storage.get_trading_days("2024-01-03", "2024-01-31", ["AAPL"]) == ["2024-01-03"]
+        assert storage.get_trading_days("2024-01-04", "2024-01-31") == ["2024-01-04"]
+    finally:
+        storage.close()
+
+
+def test_iter_position_lots_batch_matches_single_symbol_reads():
+    storage = SQLiteStorage(":memory:")
+    storage.IN_CLAUSE_CHUNK_SIZE = 1  # 强制跨块读取
+    try:
+        for symbol, notes in (("AAPL", "Dividend Reinvestment"), ("MSFT", None)):
+            txn_id = storage.upsert_transaction({
+                "symbol": symbol, "transaction_type": "BUY", "quantity": 1, "price": 10,
+                "transaction_date": "2024-01-02", "notes": notes,
+            })
+            storage.connection.execute(
+                "INSERT INTO position_lots (symbol, transaction_id, original_quantity, "
+                "remaining_quantity, cost_basis, purchase_date) VALUES (?, ?, 1, 1, 10, '2024-01-02')",
+                (symbol, txn_id),
+            )
+
+        batched = dict(storage.iter_position_lots_batch(["MSFT", "AAPL", "MSFT"]))
+        assert list(batched) == ["AAPL", "MSFT"]
+        assert batched["AAPL"] == storage.get_position_lots("AAPL")
+        assert batched["AAPL"][0]["notes"] == "Dividend Reinvestment"
+    finally:
+        storage.close()
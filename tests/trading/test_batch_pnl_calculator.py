@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+批量盈亏计算路径测试（calculate_all_positions_pnl / batch_calculate_daily_pnl）
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+from stock_analysis.data.storage import SQLiteStorage
+from stock_analysis.data.models.price_models import PriceData
+from stock_analysis.trading.calculators import _kernels
+from stock_analysis.trading.calculators.lot_pnl_calculator import LotPnLCalculator
+from stock_analysis.trading.calculators.pnl_calculator import PnLCalculator
+from stock_analysis.trading.config import TradingConfig
+from stock_analysis.trading.models.portfolio import DailyPnL
+
+
+def seed_prices(storage: SQLiteStorage, symbol: str, dates_prices: list[tuple[str, float]]):
+    dates = [d for d, _ in dates_prices]
+    closes = [p for _, p in dates_prices]
+    price_data = PriceData(
+        dates=dates,
+        open=closes,
+        high=closes,
+        low=closes,
+        close=closes,
+        volume=[1] * len(dates),
+        adj_close=closes,
+    )
+    storage.ensure_stock_exists(symbol)
+    storage._store_price_data_batch(symbol, price_data)
+
+
+def add_lot(storage: SQLiteStorage, symbol: str, quantity: float, cost_basis: float,
+            purchase_date: str, notes: str = None) -> int:
+    """写入一笔买入交易及其批次（直接按 position_lots 表结构插入，notes 用于标记DRIP）"""
+    storage.ensure_stock_exists(symbol)
+    transaction_id = storage.upsert_transaction({
+        'symbol': symbol,
+        'transaction_type': 'BUY',
+        'quantity': quantity,
+        'price': cost_basis,
+        'transaction_date': purchase_date,
+        'notes': notes,
+    })
+    storage.cursor.execute(
+        "INSERT INTO position_lots (symbol, transaction_id, original_quantity, "
+        "remaining_quantity, cost_basis, purchase_date) VALUES (?, ?, ?, ?, ?, ?)",
+        (symbol, transaction_id, quantity, quantity, cost_basis, purchase_date),
+    )
+    storage.connection.commit()
+    return storage.cursor.lastrowid
+
+
+def test_all_positions_pnl_isolates_failing_symbol():
+    storage = SQLiteStorage(":memory:")
+    try:
+        day = "2024-03-01"
+        for symbol, price in (("AAA", 11.0), ("BAD", 20.0), ("CCC", 33.0)):
+            seed_prices(storage, symbol, [(day, price)])
+            add_lot(storage, symbol, quantity=10, cost_basis=10.0, purchase_date="2024-02-01")
+        # 损坏的价格行使整批计算失败，回退为逐只计算
+        storage.connection.execute("UPDATE stock_prices SET adj_close = 'n/a' WHERE symbol = 'BAD'")
+        storage.connection.commit()
+
+        calc = PnLCalculator(storage, TradingConfig())
+        daily_pnls, errors = calc.calculate_all_positions_pnl(day)
+
+        assert [pnl.symbol for pnl in daily_pnls] == ["AAA", "CCC"]
+        assert [symbol for symbol, _ in errors] == ["BAD"]
+        assert math.isclose(daily_pnls[1].unrealized_pnl, 230.0)
+        # 其他持仓照常落库，并回填记录ID
+        rows = {row['symbol']: row for row in storage.get_daily_pnl(None, day, day)}
+        assert sorted(rows) == ["AAA", "CCC"]
+        assert [pnl.id for pnl in daily_pnls] == [rows["AAA"]['id'], rows["CCC"]['id']]
+    finally:
+        storage.close()
+
+
+def test_parallel_workers_match_serial_output(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "parallel.db"))
+    try:
+        dates = [f"2024-01-{day:02d}" for day in (2, 3, 4, 5, 8, 9)]
+        symbols = ["AAA", "BBB", "CCC", "DDD"]
+        for k, symbol in enumerate(symbols):
+            seed_prices(storage, symbol, [(d, 50.0 + 3 * k + i) for i, d in enumerate(dates)])
+            add_lot(storage, symbol, quantity=5 + k, cost_basis=50.0, purchase_date="2024-01-03")
+            add_lot(storage, symbol, quantity=2, cost_basis=55.0, purchase_date="2024-01-05")
+
+        outputs = []
+        for workers in (1, 2):
+            storage.connection.execute("DELETE FROM daily_pnl")
+            storage.connection.commit()
+            calc = PnLCalculator(storage, TradingConfig(parallel_workers=workers))
+            if workers > 1:
+                # 并行模式下父进程不应自行计算
+                calc.lot_calculator.batch_calculate_daily_pnl_records = None
+            stats = calc.batch_calculate_historical_pnl("2024-01-02", "2024-01-09", symbols)
+            rows = [
+                {key: value for key, value in row.items() if key not in ('id', 'created_at')}
+                for row in storage.get_daily_pnl()
+            ]
+            daily_pnls, errors = calc.calculate_all_positions_pnl("2024-01-09")
+            outputs.append((stats, rows, [(p.symbol, p.market_value) for p in daily_pnls], errors))
+
+        serial, parallel = outputs
+        assert serial == parallel
+        assert serial[0]['calculated_records'] == len(symbols) * 7
+        assert [symbol for symbol, _ in serial[2]] == symbols
+    finally:
+        storage.close()
+
+
+
+def test_historical_stats_count_days_without_prices():
+    storage = SQLiteStorage(":memory:")
+    try:
+        add_lot(storage, "AAA", quantity=10, cost_basis=10.0, purchase_date="2024-01-01")
+        calc = PnLCalculator(storage, TradingConfig())
+
+        # 无价格数据时跳过计算，但总天数与有价格时一致
+        empty = calc.batch_calculate_historical_pnl("2024-01-02", "2024-01-08", ["AAA"])
+        seed_prices(storage, "AAA", [("2024-01-05", 12.0)])
+        filled = calc.batch_calculate_historical_pnl("2024-01-02", "2024-01-08", ["AAA"])
+
+        assert empty == {'total_days': 7, 'calculated_records': 0, 'symbols_processed': 1}
+        assert filled['total_days'] == 7
+        assert filled['calculated_records'] == 4
+    finally:
+        storage.close()
+
+def batch_records(storage: SQLiteStorage, symbols: list[str], start_date: str, end_date: str,
+                  only_trading_days: bool = False) -> dict:
+    calc = LotPnLCalculator(storage, TradingConfig())
+    return calc.batch_calculate_daily_pnl_records(symbols, start_date, end_date,
+                                                  only_trading_days=only_trading_days)
+
+
+def test_batch_backfills_stale_prices_from_before_range():
+    storage = SQLiteStorage(":memory:")
+    try:
+        seed_prices(storage, "AAA",
+                    [("2024-01-04", 12.0), ("2024-01-05", 13.0), ("2024-01-08", 15.0)])
+        add_lot(storage, "AAA", quantity=10, cost_basis=10.0, purchase_date="2024-01-02")
+
+        # 区间从周六开始：周末沿用区间前（周五）的价格并标记为过期
+        rows = batch_records(storage, ["AAA"], "2024-01-06", "2024-01-08")["AAA"]
+
+        assert [(r['valuation_date'], r['market_price'], r['price_date'], r['is_stale_price'])
+                for r in rows] == [
+            ("2024-01-06", 13.0, "2024-01-05", True),
+            ("2024-01-07", 13.0, "2024-01-05", True),
+            ("2024-01-08", 15.0, "2024-01-08", False),
+        ]
+        assert [r['market_value'] for r in rows] == [130.0, 130.0, 150.0]
+    finally:
+        storage.close()
+
+
+def test_batch_counts_lots_from_their_purchase_date():
+    storage = SQLiteStorage(":memory:")
+    try:
+        days = ["2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05"]
+        for symbol in ("AAA", "BBB"):
+            seed_prices(storage, symbol, [(d, 10.0 + i) for i, d in enumerate(days)])
+        add_lot(storage, "AAA", quantity=10, cost_basis=10.0, purchase_date="2024-01-02")
+        add_lot(storage, "AAA", quantity=5, cost_basis=20.0, purchase_date="2024-01-04")
+        add_lot(storage, "BBB", quantity=4, cost_basis=9.0, purchase_date="2024-01-03")
+
+        results = batch_records(storage, ["AAA", "BBB"], days[0], days[-1])
+
+        aaa = results["AAA"]
+        assert [r['quantity'] for r in aaa] == [10.0, 10.0, 15.0, 15.0]
+        assert [r['total_cost'] for r in aaa] == [100.0, 100.0, 200.0, 200.0]
+        assert math.isclose(aaa[2]['avg_cost'], 200.0 / 15)
+        assert aaa[2]['unrealized_pnl'] == 15 * 12.0 - 200.0
+        # 买入日之前没有持仓，不生成记录
+        assert [r['valuation_date'] for r in results["BBB"]] == days[1:]
+    finally:
+        storage.close()
+
+
+def test_batch_excludes_drip_lots_from_cost():
+    storage = SQLiteStorage(":memory:")
+    try:
+        day = "2024-03-01"
+        seed_prices(storage, "AAA", [(day, 15.0)])
+        seed_prices(storage, "DRP", [(day, 8.0)])
+        add_lot(storage, "AAA", quantity=10, cost_basis=10.0, purchase_date="2024-02-01")
+        add_lot(storage, "AAA", quantity=2, cost_basis=12.0, purchase_date="2024-02-15",
+                notes="Dividend Reinvestment")
+        add_lot(storage, "DRP", quantity=3, cost_basis=7.0, purchase_date="2024-02-15",
+                notes="Dividend Reinvestment Plan")
+
+        results = batch_records(storage, ["AAA", "DRP"], day, day)
+
+        # 市值包含DRIP批次，成本与平均成本只计非DRIP批次
+        aaa = results["AAA"][0]
+        assert (aaa['quantity'], aaa['market_value'], aaa['total_cost'], aaa['avg_cost']) == \
+            (12.0, 180.0, 100.0, 10.0)
+        assert aaa['unrealized_pnl'] == 80.0
+        assert math.isclose(aaa['unrealized_pnl_pct'], 0.8)
+        # 只有DRIP批次时成本为0，平均成本和盈亏比例记为0
+        drp = results["DRP"][0]
+        assert (drp['market_value'], drp['total_cost'], drp['avg_cost']) == (24.0, 0.0, 0.0)
+        assert (drp['unrealized_pnl'], drp['unrealized_pnl_pct']) == (24.0, 0.0)
+
+        # 返回模型对象的版本与记录字典一致
+        models = LotPnLCalculator(storage, TradingConfig()).batch_calculate_daily_pnl(
+            ["AAA", "DRP"], day, day
+        )
+        assert all(isinstance(pnl, DailyPnL) for pnls in models.values() for pnl in pnls)
+        assert [(pnl.symbol, pnl.market_value, pnl.total_cost) for pnl in models["AAA"]] == \
+            [("AAA", 180.0, 100.0)]
+    finally:
+        storage.close()
+
+
+def test_only_trading_days_uses_requested_symbols_calendar():
+    storage = SQLiteStorage(":memory:")
+    try:
+        seed_prices(storage, "AAA", [("2024-01-02", 10.0), ("2024-01-04", 12.0)])
+        seed_prices(storage, "BBB",
+                    [("2024-01-02", 20.0), ("2024-01-03", 21.0), ("2024-01-04", 22.0)])
+        seed_prices(storage, "CCC", [("2024-01-05", 30.0)])
+        for symbol in ("AAA", "BBB", "CCC"):
+            add_lot(storage, symbol, quantity=1, cost_basis=1.0, purchase_date="2024-01-01")
+
+        # 只计算 AAA：交易日只取 AAA 自己有价格的日期，不受其他股票影响
+        alone = batch_records(storage, ["AAA"], "2024-01-01", "2024-01-05", only_trading_days=True)
+        assert [r['valuation_date'] for r in alone["AAA"]] == ["2024-01-02", "2024-01-04"]
+
+        # 与 BBB 一起计算：交易日为两者并集，AAA 缺价的日期沿用前一交易日价格
+        together = batch_records(storage, ["AAA", "BBB"], "2024-01-01", "2024-01-05",
+                                 only_trading_days=True)
+        assert "CCC" not in together
+        assert [(r['valuation_date'], r['price_date'], r['is_stale_price'])
+                for r in together["AAA"]] == [
+            ("2024-01-02", "2024-01-02", False),
+            ("2024-01-03", "2024-01-02", True),
+            ("2024-01-04", "2024-01-04", False),
+        ]
+        assert [r['valuation_date'] for r in together["BBB"]] == \
+            ["2024-01-02", "2024-01-03", "2024-01-04"]
+    finally:
+        storage.close()
+
+
+def _random_pnl_columns(seed: int = 7, n: int = 64):
+    rng = np.random.default_rng(seed)
+    quantities = rng.integers(0, 50, n).astype(np.float64)
+    market_prices = rng.uniform(1.0, 200.0, n)
+    total_costs = rng.uniform(0.0, 5000.0, n)
+    cost_quantities = rng.integers(0, 50, n).astype(np.float64)
+    realized = rng.uniform(-500.0, 500.0, n)
+    # 覆盖成本/成本股数为0（如仅有DRIP批次）的分支
+    total_costs[::5] = 0.0
+    cost_quantities[::7] = 0.0
+    return quantities, market_prices, total_costs, cost_quantities, realized
+
+
+def test_pnl_column_loop_matches_numpy():
+    columns = _random_pnl_columns()
+    expected = _kernels._compute_pnl_columns_numpy(*columns)
+    for got, want in zip(_kernels._compute_pnl_columns_loop(*columns), expected):
+        np.testing.assert_allclose(got, want, rtol=0, atol=1e-12)
+
+
+def test_small_batches_do_not_load_numba(monkeypatch):
+    def fail():
+        raise AssertionError("不应加载 numba")
+
+    monkeypatch.setattr(_kernels, "_compiled_pnl_columns", fail)
+    columns = _random_pnl_columns()
+    expected = _kernels._compute_pnl_columns_numpy(*columns)
+    for got, want in zip(_kernels.compute_pnl_columns(*columns), expected):
+        np.testing.assert_array_equal(got, want)
+
+
+def test_compiled_pnl_kernel_matches_numpy(monkeypatch):
+    pytest.importorskip("numba")
+    kernel = _kernels._compiled_pnl_columns()
+    columns = _random_pnl_columns(seed=11)
+    expected = _kernels._compute_pnl_columns_numpy(*columns)
+    for got, want in zip(kernel(*columns), expected):
+        np.testing.assert_allclose(got, want, rtol=0, atol=1e-12)
+
+    # 行数达到阈值时走编译版本
+    monkeypatch.setattr(_kernels, "_NUMBA_MIN_ROWS", len(columns[0]))
+    monkeypatch.setattr(_kernels, "_compute_pnl_columns_numpy", None)
+    for got, want in zip(_kernels.compute_pnl_columns(*columns), expected):
+        np.testing.assert_allclose(got, want, rtol=0, atol=1e-12)
+
+
+def test_unchecked_daily_pnl_reports_missing_field():
+    record = {'symbol': "AAA", 'valuation_date': "2024-01-02", 'quantity': 1.0, 'avg_cost': 1.0,
+              'market_price': 2.0, 'market_value': 2.0, 'unrealized_pnl': 1.0,
+              'unrealized_pnl_pct': 1.0, 'realized_pnl': 0.0, 'realized_pnl_pct': 0.0,
+              'total_cost': 1.0}
+    assert DailyPnL.unchecked(**record).id is None
+
+    del record['total_cost']
+    with pytest.raises(TypeError, match="missing field total_cost"):
+        DailyPnL.unchecked(**record)
@@ -6,12 +6,16 @@
 
 import unittest
 import tempfile
+from unittest import mock
 import os
 from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 
 from stock_analysis.data.storage import create_storage
+from stock_analysis.trading.models.position_lot import PositionLot
+from stock_analysis.trading.services import cost_basis_matcher
+from stock_analysis.trading.services.cost_basis_matcher import AverageCostMatcher, SpecificLotMatcher
 from stock_analysis.trading.services.lot_transaction_service import LotTransactionService
 from stock_analysis.trading.config import DEFAULT_TRADING_CONFIG
 
@@ -507,5 +511,116 @@ class TestCostBasisComprehensive(unittest.TestCase):
         print("✅ 成本基础边缘情况测试通过")
 
 
+
+def _make_lots(quantities: List[Any], cost_basis: Any) -> List[PositionLot]:
+    """构造内存中的批次（不经过存储层）"""
+    return [
+        PositionLot(symbol='TEST', transaction_id=i, original_quantity=quantity,
+                    remaining_quantity=quantity, cost_basis=cost_basis,
+                    purchase_date=f'2024-01-{i:02d}', id=i)
+        for i, quantity in enumerate(quantities, 1)
+    ]
+
+
+class TestAverageCostAllocation(unittest.TestCase):
+    """平均成本按比例分配：float/Decimal 输入及 numba 编译版本的一致性"""
+    
+    QUANTITIES = ['100', '33.3333', '0', '250.5', '0.00005', '75']
+    SELL_QUANTITIES = ['1', '150', '299.9', '458.83335']
+    
+    def _allocate(self, quantities: List[Any], sell_quantity: Any) -> List[Tuple[int, Any]]:
+        matches = AverageCostMatcher().match_lots_for_sale(_make_lots(quantities, 10.0), sell_quantity)
+        return [(lot.id, quantity) for lot, quantity in matches]
+    
+    def test_float_and_decimal_inputs_agree(self):
+        for sell in self.SELL_QUANTITIES:
+            with self.subTest(sell_quantity=sell):
+                float_matches = self._allocate([float(q) for q in self.QUANTITIES], float(sell))
+                decimal_matches = self._allocate([Decimal(q) for q in self.QUANTITIES], Decimal(sell))
+                
+                self.assertEqual([lot_id for lot_id, _ in float_matches],
+                                 [lot_id for lot_id, _ in decimal_matches])
+                for (_, f), (_, d) in zip(float_matches, decimal_matches):
+                    self.assertIsInstance(d, Decimal)
+                    self.assertAlmostEqual(f, float(d), places=9)
+                # 分配总量等于卖出数量，且不超过各批次剩余
+                self.assertAlmostEqual(sum(q for _, q in float_matches), float(sell), places=9)
+                self.assertEqual(sum(q for _, q in decimal_matches), Decimal(sell))
+    
+    def test_insufficient_quantity_raises(self):
+        with self.assertRaises(ValueError):
+            self._allocate([1.0, 2.0], 3.5)
+    
+    def test_small_sales_do_not_load_numba(self):
+        # 批次数低于阈值时不导入/编译 numba，直接使用纯 Python 实现
+        with mock.patch.object(cost_basis_matcher, '_compiled_allocate_pro_rata',
+                               side_effect=AssertionError("不应加载 numba")):
+            self.assertEqual(len(self._allocate([float(q) for q in self.QUANTITIES], 150.0)), 4)
+    
+    @unittest.skipIf(cost_basis_matcher._compiled_allocate_pro_rata() is None, "未安装 numba")
+    def test_numba_path_matches_python(self):
+        import numpy as np
+        
+        allocate_nb = cost_basis_matcher._compiled_allocate_pro_rata()
+        remaining = [float(q) for q in self.QUANTITIES]
+        for sell in self.SELL_QUANTITIES:
+            with self.subTest(sell_quantity=sell):
+                expected = cost_basis_matcher._allocate_pro_rata(remaining, float(sell))
+                allocations, left = allocate_nb(np.array(remaining), float(sell))
+                # 未开启 fastmath，结果应逐位一致
+                self.assertEqual((list(allocations), left), expected)
+        
+        # 批次数达到阈值时匹配器走编译版本，结果与纯 Python 实现一致
+        many = [float(q) for q in self.QUANTITIES] * (cost_basis_matcher._NUMBA_MIN_LOTS // 5)
+        expected = cost_basis_matcher._allocate_pro_rata(many, 1234.5)
+        with mock.patch.object(cost_basis_matcher, '_allocate_pro_rata',
+                               side_effect=AssertionError("应使用编译版本")):
+            matches = self._allocate(many, 1234.5)
+        self.assertEqual([(lot_id - 1, quantity) for lot_id, quantity in matches], expected[0])
+
+
+class TestSpecificLotMatchWithMap(unittest.TestCase):
+    """指定批次匹配：调用方直接传入批次ID映射"""
+    
+    def setUp(self):
+        self.lots = {lot.id: lot for lot in _make_lots([100.0, 50.0, 80.0], 10.0)}
+    
+    def test_matches_specified_lots_in_spec_order(self):
+        matcher = SpecificLotMatcher([{'lot_id': 3, 'quantity': 30}, {'lot_id': 1, 'quantity': 20}])
+        matches = matcher.match_with_map(self.lots, 50)
+        self.assertEqual([(lot.id, quantity) for lot, quantity in matches], [(3, 30), (1, 20)])
+        # 与按列表匹配的结果一致
+        self.assertEqual(matcher.match_lots_for_sale(list(self.lots.values()), 50), matches)
+    
+    def test_missing_lot_id_raises(self):
+        matcher = SpecificLotMatcher([{'lot_id': 1, 'quantity': 10}, {'lot_id': 99, 'quantity': 10}])
+        with self.assertRaisesRegex(ValueError, "99"):
+            matcher.match_with_map(self.lots, 20)
+    
+    def test_quantity_beyond_lot_remaining_raises(self):
+        matcher = SpecificLotMatcher([{'lot_id': 2, 'quantity': 60}])
+        with self.assertRaisesRegex(ValueError, "剩余数量不足"):
+            matcher.match_with_map(self.lots, 60)
+    
+    def test_partial_map_missing_a_specified_lot_raises(self):
+        # 映射只包含部分指定批次（如其中一个批次已卖完）时不得静默少卖
+        matcher = SpecificLotMatcher([{'lot_id': 1, 'quantity': 10}, {'lot_id': 2, 'quantity': 10}])
+        with self.assertRaisesRegex(ValueError, "批次 2"):
+            matcher.match_with_map({1: self.lots[1]}, 20)
+    
+    def test_lot_ids_are_normalized_to_int(self):
+        # 来自 JSON/CLI 的批次ID可能是浮点数或字符串
+        matcher = SpecificLotMatcher([{'lot_id': 2.0, 'quantity': 10}, {'lot_id': '3', 'quantity': 5}])
+        matches = matcher.match_with_map(self.lots, 15)
+        self.assertEqual([lot.id for lot, _ in matches], [2, 3])
+        with self.assertRaisesRegex(ValueError, "无效的批次ID"):
+            SpecificLotMatcher([{'lot_id': 'abc', 'quantity': 1}])
+    
+    def test_specified_total_must_equal_sell_quantity(self):
+        matcher = SpecificLotMatcher([{'lot_id': 1, 'quantity': 10}])
+        with self.assertRaisesRegex(ValueError, "不匹配"):
+            matcher.match_with_map(self.lots, 15)
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)